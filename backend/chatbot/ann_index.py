@@ -0,0 +1,318 @@
+"""
+Các backend index cho retrieval trên ma trận embedding đã chuẩn hoá L2.
+
+- flat: brute-force chính xác (một phép nhân ma trận-vector + argpartition)
+- ivf:  inverted file với k-means cầu (numpy thuần), chỉ quét `nprobe` cụm gần nhất
+- hnsw: đồ thị HNSW qua thư viện `hnswlib` (tuỳ chọn, cần `pip install hnswlib`)
+
+Backend được chọn qua biến môi trường VECTOR_INDEX_BACKEND. Index ANN được lưu
+cạnh file parquet kèm fingerprint của ma trận để lần khởi động sau không phải dựng lại.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_BACKEND = os.getenv('VECTOR_INDEX_BACKEND', 'flat').lower()
+# Dưới ngưỡng này brute-force đã đủ nhanh, không cần ANN
+ANN_MIN_ROWS = int(os.getenv('ANN_MIN_ROWS', '5000'))
+IVF_NLIST = int(os.getenv('IVF_NLIST', '0'))  # 0 = tự chọn ~ 4*sqrt(N)
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '8'))
+HNSW_M = int(os.getenv('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '200'))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+# Search theo batch: số query mỗi block sao cho ma trận điểm (block, N) không vượt quá ngưỡng này
+BATCH_SCORES_MB = float(os.getenv('BATCH_SCORES_MB', '64'))
+
+_EMPTY = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+
+
+def matrix_fingerprint(matrix: np.ndarray) -> str:
+    """Fingerprint của ma trận (shape + nội dung) để kiểm tra index lưu trên đĩa còn hợp lệ"""
+    h = hashlib.sha1()
+    h.update(str(matrix.shape).encode())
+    h.update(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+def top_k_from_scores(scores: np.ndarray, k: int, ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Lấy top-k theo điểm giảm dần bằng argpartition; `ids` ánh xạ vị trí -> row id"""
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return _EMPTY
+    k = min(k, n)
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    rows = order if ids is None else ids[order]
+    return rows.astype(np.int64, copy=False), scores[order]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """top_k_from_scores cho từng dòng của ma trận điểm (Q, n), argpartition một lần theo trục 1"""
+    q, n = scores.shape
+    if n == 0 or k <= 0:
+        return [_EMPTY] * q
+    k = min(k, n)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (q, 1))
+    top = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-top, axis=1, kind='stable')
+    rows = np.take_along_axis(candidates, order, axis=1).astype(np.int64, copy=False)
+    return list(zip(rows, np.take_along_axis(top, order, axis=1)))
+
+
+def in_sorted(values: np.ndarray, sorted_rows: np.ndarray) -> np.ndarray:
+    """Mask: phần tử nào của `values` có trong mảng đã sắp xếp `sorted_rows` (searchsorted, không dựng mask N)"""
+    if len(sorted_rows) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_rows, values), len(sorted_rows) - 1)
+    return sorted_rows[pos] == values
+
+
+def query_blocks(n_queries: int, n_rows: int):
+    """Chia Q query thành các block để ma trận điểm (block, N) float32 nằm trong BATCH_SCORES_MB"""
+    block = max(1, int(BATCH_SCORES_MB * 1024 ** 2 // (4 * max(1, n_rows))))
+    for start in range(0, n_queries, block):
+        yield slice(start, min(start + block, n_queries))
+
+
+def search_batch(index, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Top-k cho nhiều query (Q, d): dùng search_batch của index nếu có, ngược lại tìm từng query"""
+    if hasattr(index, 'search_batch'):
+        return index.search_batch(queries, k)
+    return [index.search(query, k) for query in queries]
+
+
+class FlatIndex:
+    """Exact search: quét toàn bộ ma trận"""
+    name = 'flat'
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.matrix) == 0:
+            return _EMPTY
+        return top_k_from_scores(self.matrix @ query, k)
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Một phép nhân (Q, d) x (d, N) cho cả batch (theo block query) + top-k từng dòng"""
+        if len(self.matrix) == 0:
+            return [_EMPTY] * len(queries)
+        results = []
+        for block in query_blocks(len(queries), len(self.matrix)):
+            results.extend(top_k_rows(queries[block] @ self.matrix.T, k))
+        return results
+
+    def save(self, path: str, fingerprint: str):
+        pass  # Không có gì để lưu
+
+    @classmethod
+    def load(cls, path: str, matrix: np.ndarray, fingerprint: str) -> Optional['FlatIndex']:
+        return cls(matrix)
+
+
+class IVFIndex:
+    """Inverted file index: k-means cầu chia ma trận thành `nlist` cụm, tìm trong `nprobe` cụm gần nhất"""
+    name = 'ivf'
+
+    def __init__(self, matrix: np.ndarray, centroids: np.ndarray, list_ids: np.ndarray,
+                 list_offsets: np.ndarray, nprobe: int = IVF_NPROBE):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_ids = list_ids          # row id sắp xếp theo cụm
+        self.list_offsets = list_offsets  # offsets kiểu CSR, len = nlist + 1
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+              n_iter: int = 10, seed: int = 0) -> 'IVFIndex':
+        n = len(matrix)
+        if nlist <= 0:
+            nlist = int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(seed)
+
+        # Train trên mẫu con để build nhanh với corpus lớn
+        sample_size = min(n, nlist * 256)
+        sample = matrix[rng.choice(n, sample_size, replace=False)] if sample_size < n else matrix
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # Cụm rỗng được khởi tạo lại bằng điểm ngẫu nhiên
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assign = _assign(matrix, centroids)
+        list_ids = np.argsort(assign, kind='stable').astype(np.int64)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        return cls(matrix, centroids, list_ids, list_offsets, nprobe=nprobe)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.matrix) == 0:
+            return _EMPTY
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        ids = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe])
+        if len(ids) == 0:
+            return _EMPTY
+        return top_k_from_scores(self.matrix[ids] @ query, k, ids=ids)
+
+    def save(self, path: str, fingerprint: str):
+        np.savez(path, centroids=self.centroids, list_ids=self.list_ids,
+                 list_offsets=self.list_offsets, fingerprint=np.array(fingerprint))
+
+    @classmethod
+    def load(cls, path: str, matrix: np.ndarray, fingerprint: str) -> Optional['IVFIndex']:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if str(data['fingerprint']) != fingerprint:
+                return None
+            return cls(matrix, data['centroids'], data['list_ids'], data['list_offsets'])
+
+
+def _assign(points: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Gán mỗi điểm vào centroid gần nhất (theo inner product), xử lý theo chunk để giới hạn bộ nhớ"""
+    out = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk):
+        out[start:start + chunk] = np.argmax(points[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+class HNSWIndex:
+    """HNSW qua hnswlib (optional dependency)"""
+    name = 'hnsw'
+
+    def __init__(self, graph, matrix: np.ndarray, ef_search: int = HNSW_EF_SEARCH):
+        self.graph = graph
+        self.matrix = matrix
+        self.ef_search = ef_search
+        self.graph.set_ef(ef_search)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+              ef_search: int = HNSW_EF_SEARCH) -> 'HNSWIndex':
+        import hnswlib
+        graph = hnswlib.Index(space='ip', dim=matrix.shape[1])
+        graph.init_index(max_elements=len(matrix), M=m, ef_construction=ef_construction)
+        graph.add_items(matrix, np.arange(len(matrix)))
+        return cls(graph, matrix, ef_search=ef_search)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.matrix) == 0 or k <= 0:
+            return _EMPTY
+        k = min(k, len(self.matrix))
+        self.graph.set_ef(max(self.ef_search, k))
+        labels, distances = self.graph.knn_query(query.reshape(1, -1), k=k)
+        # space='ip' trả về 1 - inner product
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if len(self.matrix) == 0 or k <= 0:
+            return [_EMPTY] * len(queries)
+        k = min(k, len(self.matrix))
+        self.graph.set_ef(max(self.ef_search, k))
+        labels, distances = self.graph.knn_query(np.asarray(queries, dtype=np.float32), k=k)
+        return [(row.astype(np.int64), (1.0 - dist).astype(np.float32)) for row, dist in zip(labels, distances)]
+
+    def save(self, path: str, fingerprint: str):
+        self.graph.save_index(path)
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': fingerprint, 'dim': int(self.matrix.shape[1]), 'count': len(self.matrix)}, f)
+
+    @classmethod
+    def load(cls, path: str, matrix: np.ndarray, fingerprint: str) -> Optional['HNSWIndex']:
+        if not (os.path.exists(path) and os.path.exists(path + '.json')):
+            return None
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('fingerprint') != fingerprint:
+            return None
+        import hnswlib
+        graph = hnswlib.Index(space='ip', dim=info['dim'])
+        graph.load_index(path, max_elements=info['count'])
+        return cls(graph, matrix)
+
+
+BACKENDS = {
+    'flat': FlatIndex,
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+}
+
+_FILE_SUFFIX = {'ivf': '.ivf.npz', 'hnsw': '.hnsw.bin'}
+
+
+def build_index(matrix: np.ndarray, backend: str = INDEX_BACKEND):
+    """Dựng index theo backend (không dùng cache trên đĩa; load_or_build_index dùng để dựng khi cache miss)"""
+    if backend == 'flat':
+        return FlatIndex(matrix)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown index backend: {backend}")
+    return BACKENDS[backend].build(matrix)
+
+
+def index_path_for(base_path: str, backend: str) -> Optional[str]:
+    """Đường dẫn file index đặt cạnh file parquet, vd. english_qa_embeddings.ivf.npz"""
+    suffix = _FILE_SUFFIX.get(backend)
+    if suffix is None:
+        return None
+    root, _ = os.path.splitext(base_path)
+    return root + suffix
+
+
+def load_index(matrix: np.ndarray, base_path: str, fingerprint: str, backend: str = INDEX_BACKEND):
+    """Load index đã lưu cạnh `base_path` khi fingerprint của ma trận đã biết (shared index: không hash
+    lại ma trận); None nếu không có file hoặc fingerprint không khớp"""
+    if backend == 'flat':
+        return FlatIndex(matrix)
+    path = index_path_for(base_path, backend)
+    if path is None or backend not in BACKENDS:
+        return None
+    try:
+        return BACKENDS[backend].load(path, matrix, fingerprint)
+    except Exception as e:
+        logger.warning(f"⚠️ Không load được index {path}: {e}")
+        return None
+
+
+def load_or_build_index(matrix: np.ndarray, base_path: Optional[str] = None, backend: str = INDEX_BACKEND):
+    """Load index đã lưu nếu fingerprint khớp, ngược lại dựng mới và lưu lại.
+
+    Corpus nhỏ hơn ANN_MIN_ROWS hoặc backend không khả dụng sẽ dùng flat.
+    """
+    if backend == 'flat' or len(matrix) < ANN_MIN_ROWS:
+        return FlatIndex(matrix)
+
+    try:
+        path = index_path_for(base_path, backend) if base_path else None
+        fingerprint = matrix_fingerprint(matrix)
+        if path and backend in BACKENDS:
+            index = BACKENDS[backend].load(path, matrix, fingerprint)
+            if index is not None:
+                logger.info(f"✅ Đã load {backend} index từ {path}")
+                return index
+
+        index = build_index(matrix, backend)
+        logger.info(f"✅ Đã dựng {backend} index cho {len(matrix)} vectors")
+        if path:
+            try:
+                index.save(path, fingerprint)
+            except Exception as e:
+                logger.warning(f"⚠️ Không lưu được index {path}: {e}")
+        return index
+    except Exception as e:
+        logger.warning(f"⚠️ Không dùng được index '{backend}' ({e}), fallback sang flat")
+        return FlatIndex(matrix)
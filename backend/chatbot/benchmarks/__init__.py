@@ -0,0 +1,6 @@
+"""
+Các công cụ benchmark cho chatbot (chạy từ thư mục backend/chatbot, vd. `python -m benchmarks.ann_recall`).
+
+`python -m benchmarks.suite` chạy bộ benchmark tổng hợp (encode, retrieval, /ask, sync, startup) và ghi JSON
+để so sánh với lần chạy trước (--compare).
+"""
@@ -0,0 +1,126 @@
+"""
+So sánh recall@k và latency của các index backend (ivf, hnsw) với flat (exact).
+
+Ví dụ:
+    python -m benchmarks.ann_recall --rows 100000 --backends ivf hnsw --nprobe 4 8 16
+    python -m benchmarks.ann_recall --parquet ./english_qa_embeddings.parquet --json result.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ann_index import FlatIndex, HNSWIndex, IVFIndex
+from quantization import read_embedding_matrix
+from vector_store import l2_normalize
+
+
+def synthetic_corpus(rows: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Vector ngẫu nhiên có cấu trúc cụm (gần với embedding thật hơn nhiễu đều)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    points = centers[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return l2_normalize(points)
+
+
+def load_corpus(args) -> np.ndarray:
+    if args.parquet:
+        return l2_normalize(read_embedding_matrix(args.parquet))
+    return synthetic_corpus(args.rows, args.dim, seed=args.seed)
+
+
+def make_queries(matrix: np.ndarray, count: int, seed: int, noise: float = 1.0) -> np.ndarray:
+    """Query = vector trong corpus + nhiễu (norm ~ `noise`), để top-k không tầm thường"""
+    rng = np.random.default_rng(seed + 1)
+    base = matrix[rng.integers(0, len(matrix), count)]
+    jitter = rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(matrix.shape[1])
+    return l2_normalize(base + noise * jitter)
+
+
+def run_queries(index, queries: np.ndarray, k: int):
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        ids, _ = index.search(q, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids)
+    return results, np.array(latencies)
+
+
+def recall_at_k(truth, found, k: int) -> float:
+    hits = sum(len(set(t[:k].tolist()) & set(f[:k].tolist())) for t, f in zip(truth, found))
+    return hits / float(sum(min(k, len(t)) for t in truth) or 1)
+
+
+def summarize(name: str, params: dict, build_s: float, latencies: np.ndarray, recall: float) -> dict:
+    return {
+        'backend': name,
+        'params': params,
+        'build_seconds': round(build_s, 3),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 4),
+        'latency_ms_p95': round(float(np.percentile(latencies, 95)), 4),
+        'recall': round(recall, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall@k vs latency của ANN backend so với flat')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--parquet', help='Dùng embedding thật từ file parquet thay vì dữ liệu tổng hợp')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--backends', nargs='+', default=['ivf', 'hnsw'])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    matrix = load_corpus(args)
+    queries = make_queries(matrix, args.queries, args.seed)
+    print(f"📊 Corpus: {matrix.shape[0]} x {matrix.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    flat = FlatIndex(matrix)
+    truth, flat_lat = run_queries(flat, queries, args.k)
+    rows = [summarize('flat', {}, 0.0, flat_lat, 1.0)]
+
+    if 'ivf' in args.backends:
+        start = time.perf_counter()
+        ivf = IVFIndex.build(matrix)
+        build_s = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            ivf.nprobe = nprobe
+            found, lat = run_queries(ivf, queries, args.k)
+            rows.append(summarize('ivf', {'nlist': len(ivf.centroids), 'nprobe': nprobe},
+                                  build_s, lat, recall_at_k(truth, found, args.k)))
+
+    if 'hnsw' in args.backends:
+        try:
+            start = time.perf_counter()
+            hnsw = HNSWIndex.build(matrix)
+            build_s = time.perf_counter() - start
+            for ef in args.ef_search:
+                hnsw.ef_search = ef
+                found, lat = run_queries(hnsw, queries, args.k)
+                rows.append(summarize('hnsw', {'ef_search': ef}, build_s, lat,
+                                      recall_at_k(truth, found, args.k)))
+        except ImportError:
+            print("⚠️ Bỏ qua hnsw: chưa cài hnswlib (pip install hnswlib)")
+
+    print(f"\n{'backend':<8} {'params':<28} {'build(s)':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'recall@' + str(args.k):>10}")
+    for r in rows:
+        params = ','.join(f"{k}={v}" for k, v in r['params'].items())
+        print(f"{r['backend']:<8} {params:<28} {r['build_seconds']:>9} {r['latency_ms_p50']:>9} "
+              f"{r['latency_ms_p95']:>9} {r['recall']:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'rows': int(matrix.shape[0]), 'dim': int(matrix.shape[1]), 'k': args.k, 'results': rows}, f, indent=2)
+        print(f"\n✅ Đã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
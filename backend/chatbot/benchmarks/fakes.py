@@ -0,0 +1,140 @@
+"""
+Các đối tượng giả lập dùng chung cho benchmark (không cần MongoDB / mạng).
+
+FakeLessonsCollection hỗ trợ đúng phần API pymongo mà lesson_sync / improved_main dùng:
+find(query, projection).batch_size(n), find_one, insert/update/delete theo _id, với các
+toán tử `$in`, `$or`, `$gte`, `$exists`.
+
+FakeSentenceModel thay SentenceTransformer khi không có model (test): vector cố định theo hash của câu.
+"""
+import hashlib
+import itertools
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, cond in (query or {}).items():
+        if key == '$or':
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == '$in' and value not in arg:
+                    return False
+                if op == '$gte' and (value is None or value < arg):
+                    return False
+                if op == '$exists' and (key in doc) != bool(arg):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return dict(doc)
+    fields = [k for k, v in projection.items() if v]
+    out = {k: doc[k] for k in fields if k in doc}
+    if projection.get('_id', 1):
+        out['_id'] = doc['_id']
+    return out
+
+
+class FakeCursor:
+    """Project từng document khi duyệt (như cursor thật), không copy cả kết quả trước"""
+
+    def __init__(self, docs: List[dict], projection: Optional[dict] = None):
+        self._docs = docs
+        self._projection = projection
+
+    def batch_size(self, n: int) -> 'FakeCursor':
+        return self
+
+    def __iter__(self):
+        return (_project(doc, self._projection) for doc in self._docs)
+
+
+class FakeLessonsCollection:
+    """Collection lessons trong bộ nhớ, thread-safe, tự set updatedAt khi ghi"""
+
+    def __init__(self, docs: Iterable[dict] = ()):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._ids = itertools.count(1)
+        self._clock = datetime(2026, 1, 1)
+        for doc in docs:
+            self.insert_one(doc)
+
+    def _tick(self) -> datetime:
+        self._clock += timedelta(milliseconds=1)
+        return self._clock
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> FakeCursor:
+        with self._lock:
+            docs = [d for d in self._docs.values() if _matches(d, query)]
+        return FakeCursor(docs, projection)
+
+    def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        return next(iter(self.find(query, projection)), None)
+
+    def insert_one(self, doc: dict) -> str:
+        with self._lock:
+            doc = dict(doc)
+            doc.setdefault('_id', f"lesson-{next(self._ids):07d}")
+            doc.setdefault('updatedAt', self._tick())
+            self._docs[doc['_id']] = doc
+            return doc['_id']
+
+    def update_one(self, lesson_id: str, fields: dict):
+        with self._lock:
+            if lesson_id in self._docs:
+                # Thay document (không sửa tại chỗ) để cursor đang duyệt vẫn thấy bản cũ
+                self._docs[lesson_id] = {**self._docs[lesson_id], **fields, 'updatedAt': self._tick()}
+
+    def delete_one(self, lesson_id: str):
+        with self._lock:
+            self._docs.pop(lesson_id, None)
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(self._docs)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+
+def make_lessons(n: int, start: int = 0) -> List[dict]:
+    """Sinh n lesson giả (title/topics/content) có độ dài nội dung khác nhau; cứ 10 lesson có một
+    lesson dài (nhiều passage)"""
+    return [{
+        'title': f"Lesson {i}",
+        'topics': [f"topic-{i % 17}", f"level-{i % 5}"],
+        'content': f"Bài học số {i} về ngữ pháp và từ vựng. " * (1 + i % 8)
+                   + (f"Phần mở rộng {i}: luyện tập thì hiện tại hoàn thành với ví dụ. " * 40 if i % 10 == 9 else ''),
+        'category': 'lessons',
+    } for i in range(start, start + n)]
+
+
+class FakeSentenceModel:
+    """Phần API SentenceTransformer mà app dùng (encode): cùng câu cho cùng vector ngẫu nhiên `dim` chiều"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        seeds = (int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16) for text in ([texts] if single else texts))
+        matrix = np.array([np.random.default_rng(seed).standard_normal(self.dim) for seed in seeds],
+                          dtype=np.float32).reshape(-1, self.dim)
+        if normalize_embeddings:
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix[0] if single else matrix
@@ -0,0 +1,106 @@
+"""
+Load-test LLMClient với fake backend (không cần mạng).
+
+Bắn N request đồng thời gồm D prompt khác nhau, đo tổng thời gian, số call upstream
+thực tế (sau khi gộp prompt trùng) và độ trễ của event loop trong lúc chờ LLM.
+Với --stream, dùng LLMClient.stream() và đo thêm time-to-first-chunk.
+
+Ví dụ:
+    python -m benchmarks.llm_load --requests 200 --distinct 20 --concurrency 8 --latency-ms 500
+    python -m benchmarks.llm_load --requests 50 --distinct 50 --stream
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from llm_client import FakeLLMBackend, LLMClient
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> list:
+    """Đo độ trễ của event loop: nếu LLM chặn loop thì lag sẽ tăng vọt"""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+    return lags
+
+
+async def run(args) -> dict:
+    backend = FakeLLMBackend(latency_ms=args.latency_ms, fail_rate=args.fail_rate)
+    client = LLMClient(backend, max_concurrency=args.concurrency)
+    prompts = [f"Câu hỏi: câu hỏi số {i % args.distinct}\n" for i in range(args.requests)]
+
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(measure_loop_lag(stop))
+    latencies = []
+    first_chunk = []
+
+    async def one(prompt):
+        start = time.perf_counter()
+        try:
+            if args.stream:
+                first = None
+                async for _ in client.stream(prompt, max_retries=3, base_delay=0.05):
+                    if first is None:
+                        first = (time.perf_counter() - start) * 1000
+                first_chunk.append(first)
+            else:
+                await client.generate(prompt, max_retries=3, base_delay=0.05)
+            ok = True
+        except Exception:
+            ok = False
+        latencies.append((time.perf_counter() - start) * 1000)
+        return ok
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one(p) for p in prompts])
+    wall = time.perf_counter() - start
+    stop.set()
+    lags = await lag_task
+
+    result = {
+        'requests': args.requests,
+        'stream': args.stream,
+        'distinct_prompts': args.distinct,
+        'max_concurrency': args.concurrency,
+        'backend_latency_ms': args.latency_ms,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(args.requests / wall, 2),
+        'success': int(sum(results)),
+        'upstream_calls': backend.calls,
+        'coalesced': client.coalesced,
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 2),
+        'latency_ms_p95': round(float(np.percentile(latencies, 95)), 2),
+        'loop_lag_ms_max': round(max(lags) if lags else 0.0, 2),
+    }
+    if first_chunk:
+        result['first_chunk_ms_p50'] = round(float(np.percentile(first_chunk, 50)), 2)
+        result['first_chunk_ms_p95'] = round(float(np.percentile(first_chunk, 95)), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test LLMClient với fake backend')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--distinct', type=int, default=20, help='Số prompt khác nhau')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=500)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--stream', action='store_true', help='Dùng LLMClient.stream() (đo time-to-first-chunk)')
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        print(f"{key:<20} {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
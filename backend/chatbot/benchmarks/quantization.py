@@ -0,0 +1,110 @@
+"""
+So sánh lưu trữ / tìm kiếm embedding float32 với float16 và int8 (+ rescoring float32).
+
+Báo cáo cho mỗi cấu hình: bộ nhớ của ma trận first-pass, kích thước file parquet, latency
+p50/p95 và recall@k so với brute-force float32 (đường hiện tại). Cột embedding kiểu cũ
+(object column chứa list float Python) được ước lượng để so sánh.
+
+Ví dụ:
+    python -m benchmarks.quantization --rows 100000 --rescore 1 2 4 8
+    python -m benchmarks.quantization --parquet ./english_qa_embeddings.parquet --json quant.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ann_index import FlatIndex
+from benchmarks.ann_recall import make_queries, recall_at_k, run_queries, synthetic_corpus
+from quantization import QuantizedIndex, QuantizedMatrix, read_embedding_matrix, write_embeddings_parquet
+from vector_store import l2_normalize
+
+
+def object_column_bytes(matrix: np.ndarray, sample: int = 1000) -> int:
+    """Ước lượng bộ nhớ của cột embedding kiểu cũ: mỗi dòng là list các float Python"""
+    rows = matrix[:sample].tolist()
+    per_row = np.mean([sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r) for r in rows])
+    return int(per_row * len(matrix))
+
+
+def parquet_bytes(matrix: np.ndarray, dtype: str) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'embeddings.parquet')
+        write_embeddings_parquet(pd.DataFrame({'question': [''] * len(matrix)}), matrix, path, dtype=dtype)
+        size = os.path.getsize(path)
+        assert read_embedding_matrix(path).shape == matrix.shape
+        return size
+
+
+def summarize(name: str, params: dict, memory: int, file_size: int, build_s: float,
+              latencies: np.ndarray, recall: float) -> dict:
+    return {
+        'dtype': name,
+        'params': params,
+        'first_pass_mb': round(memory / 1024 ** 2, 2),
+        'parquet_mb': round(file_size / 1024 ** 2, 2),
+        'build_seconds': round(build_s, 3),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 4),
+        'latency_ms_p95': round(float(np.percentile(latencies, 95)), 4),
+        'recall': round(recall, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bộ nhớ / latency / recall của embedding lượng tử hoá')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--parquet', help='Dùng embedding thật từ file parquet thay vì dữ liệu tổng hợp')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--dtypes', nargs='+', default=['float16', 'int8'])
+    parser.add_argument('--rescore', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Hệ số shortlist (shortlist = k * rescore)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    if args.parquet:
+        matrix = l2_normalize(read_embedding_matrix(args.parquet))
+    else:
+        matrix = synthetic_corpus(args.rows, args.dim, seed=args.seed)
+    queries = make_queries(matrix, args.queries, args.seed)
+    print(f"📊 Corpus: {matrix.shape[0]} x {matrix.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    truth, flat_lat = run_queries(FlatIndex(matrix), queries, args.k)
+    results = [summarize('float32', {}, matrix.nbytes, parquet_bytes(matrix, 'float32'), 0.0, flat_lat, 1.0)]
+    legacy = object_column_bytes(matrix)
+
+    for dtype in args.dtypes:
+        start = time.perf_counter()
+        quantized = QuantizedMatrix.from_float(matrix, dtype)
+        build_s = time.perf_counter() - start
+        file_size = parquet_bytes(matrix, dtype)
+        for factor in args.rescore:
+            index = QuantizedIndex(matrix, quantized, rescore_factor=factor)
+            found, lat = run_queries(index, queries, args.k)
+            results.append(summarize(dtype, {'rescore': factor}, quantized.nbytes, file_size, build_s, lat,
+                                     recall_at_k(truth, found, args.k)))
+
+    print(f"\nCột embedding kiểu cũ (list float Python): ~{legacy / 1024 ** 2:.1f} MB")
+    print(f"\n{'dtype':<8} {'params':<12} {'mem(MB)':>9} {'file(MB)':>9} {'p50(ms)':>9} {'p95(ms)':>9} "
+          f"{'recall@' + str(args.k):>10}")
+    for r in results:
+        params = ','.join(f"{k}={v}" for k, v in r['params'].items())
+        print(f"{r['dtype']:<8} {params:<12} {r['first_pass_mb']:>9} {r['parquet_mb']:>9} {r['latency_ms_p50']:>9} "
+              f"{r['latency_ms_p95']:>9} {r['recall']:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'rows': int(matrix.shape[0]), 'dim': int(matrix.shape[1]), 'k': args.k,
+                       'legacy_object_column_mb': round(legacy / 1024 ** 2, 2), 'results': results}, f, indent=2)
+        print(f"\n✅ Đã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
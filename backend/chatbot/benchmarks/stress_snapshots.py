@@ -0,0 +1,183 @@
+"""
+Stress test cho index snapshot: bắn /ask liên tục trong lúc sync, /sync và
+/admin/index_lessons chạy song song trên một collection lessons giả lập.
+
+Kiểm tra các bất biến:
+- mọi /ask đều trả 200
+- version snapshot mà mỗi reader thấy chỉ tăng, không giảm
+- mỗi snapshot có ma trận và các cột metadata cùng số dòng, không có passage (lesson_id, chunk) còn sống trùng
+- corpus cuối cùng khớp với collection
+
+Chạy với fake LLM, không cần MongoDB (exit code 1 nếu vi phạm bất biến):
+    LLM_BACKEND=fake FAKE_LLM_LATENCY_MS=5 python -m benchmarks.stress_snapshots --seconds 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from benchmarks.fakes import FakeLessonsCollection, make_lessons
+
+
+def check_snapshot(snapshot) -> list:
+    """Trả về danh sách lỗi bất biến của một snapshot"""
+    errors = []
+    store = snapshot.store
+    columns = {'questions': len(store.questions), 'categories': len(store.categories), 'lesson_ids': len(store.lesson_ids)}
+    rows = len(store.static_matrix) + len(store.lesson_matrix)
+    if any(n != rows for n in columns.values()):
+        errors.append(f"v{snapshot.version}: matrix={rows} columns={columns}")
+    live = store.live_rows()
+    passages = [(lid, int(chunk)) for lid, chunk in zip(store.lesson_ids[live], store.chunks[live]) if lid is not None]
+    duplicates = [key for key, n in Counter(passages).items() if n > 1]
+    if duplicates:
+        errors.append(f"v{snapshot.version}: duplicate lesson passages {duplicates[:5]}")
+    return errors
+
+
+def run(args) -> dict:
+    import improved_main as app_module
+    from fastapi.testclient import TestClient
+    from lesson_segments import LessonSegmentLog
+
+    # Lesson store tạm, không đụng vào file parquet thật
+    workdir = tempfile.mkdtemp(prefix='stress-snapshots-')
+    app_module.lessons_parquet = os.path.join(workdir, 'english_lessons_embeddings.parquet')
+    app_module.lesson_log = LessonSegmentLog(app_module.lessons_parquet)
+    coll = FakeLessonsCollection(make_lessons(args.lessons))
+    app_module.lessons_coll = coll
+    app_module.AUTO_SYNC_ENABLED = False  # Sync do stress test tự điều khiển
+    app_module.sync_courses_from_mongodb(full=True)
+
+    store = app_module.index_snapshots.current.store
+    questions = store.questions.to_list(range(min(200, len(store)))) or ["What is the present perfect?"]
+    stop = threading.Event()
+    errors = []
+    counts = Counter()
+    lock = threading.Lock()
+
+    def record(key, error=None):
+        with lock:
+            counts[key] += 1
+            if error:
+                errors.append(error)
+
+    def reader(client, seed):
+        rng = random.Random(seed)
+        last_version = 0
+        while not stop.is_set():
+            response = client.post('/ask', json={'question': rng.choice(questions)})
+            if response.status_code != 200:
+                record('ask_errors', f"/ask -> {response.status_code}: {response.text[:200]}")
+            record('ask')
+            version = app_module.index_snapshots.current.version
+            if version < last_version:
+                record('version_errors', f"version went backwards {last_version} -> {version}")
+            last_version = version
+
+    def mutator(seed):
+        rng = random.Random(seed)
+        next_id = args.lessons
+        while not stop.is_set():
+            ids = coll.ids()
+            op = rng.random()
+            if op < 0.4 and ids:
+                coll.update_one(rng.choice(ids), {'content': f"Nội dung mới {rng.random()}"})
+            elif op < 0.7:
+                coll.insert_one(make_lessons(1, start=next_id)[0])
+                next_id += 1
+            elif ids:
+                coll.delete_one(rng.choice(ids))
+            record('mutations')
+            time.sleep(0.005)
+
+    def syncer():
+        while not stop.is_set():
+            app_module.sync_courses_from_mongodb()
+            record('syncs')
+
+    def admin(client, seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            ids = coll.ids()
+            response = client.post('/admin/index_lessons', json={'lesson_ids': rng.sample(ids, min(5, len(ids)))})
+            if response.status_code != 200:
+                record('admin_errors', f"/admin/index_lessons -> {response.status_code}")
+            response = client.post('/sync')
+            record('sync_in_progress' if response.json().get('status') == 'in_progress' else 'manual_syncs')
+
+    def checker():
+        seen = 0
+        while not stop.is_set():
+            snapshot = app_module.index_snapshots.current
+            if snapshot.version != seen:
+                seen = snapshot.version
+                for error in check_snapshot(snapshot):
+                    record('snapshot_errors', error)
+                record('snapshots_checked')
+            time.sleep(0.001)
+
+    # Một client (một event loop) dùng chung cho mọi thread, giống một worker uvicorn
+    with TestClient(app_module.app) as client:
+        threads = [threading.Thread(target=reader, args=(client, i)) for i in range(args.readers)]
+        threads += [threading.Thread(target=mutator, args=(1000,)), threading.Thread(target=syncer),
+                    threading.Thread(target=admin, args=(client, 2000)), threading.Thread(target=checker)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+
+    # Sau khi dừng ghi: một lần sync cuối phải đưa corpus về đúng collection
+    app_module.sync_courses_from_mongodb()
+    final = app_module.index_snapshots.current
+    errors.extend(check_snapshot(final))
+    indexed = set(final.store.lesson_state()[0])
+    if indexed != set(coll.ids()):
+        errors.append(f"final corpus mismatch: {len(indexed)} indexed vs {len(coll)} in collection")
+
+    return {
+        'seconds': round(wall, 2),
+        'asks': counts['ask'],
+        'ask_rps': round(counts['ask'] / wall, 1),
+        'mutations': counts['mutations'],
+        'syncs': counts['syncs'] + counts['manual_syncs'],
+        'sync_in_progress_responses': counts['sync_in_progress'],
+        'snapshots_published': final.version,
+        'snapshots_checked': counts['snapshots_checked'],
+        'final_lessons': len(indexed),
+        'errors': errors[:20],
+        'error_count': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test snapshot index khi /ask chạy song song với sync')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--lessons', type=int, default=300)
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    for key, value in result.items():
+        if key != 'errors':
+            print(f"{key:<28} {value}")
+    for error in result['errors']:
+        print(f"❌ {error}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if result['error_count'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+"""
+Benchmark tổng hợp cho retrieval và /ask end-to-end, xuất JSON để so sánh giữa các lần chạy.
+
+Các stage (--stages, mặc định chạy tất cả):
+- encode: latency encode một câu hỏi (p50/p95) và throughput encode theo batch, trên câu hỏi của faq_dataset.json
+- search: search_similar_embeddings trên FAQ thật và corpus tổng hợp (mặc định 10k / 100k / 1M dòng vector
+  ngẫu nhiên có cấu trúc cụm): latency vector / hybrid / có filter category, search_batch, thời gian dựng
+  store và bộ nhớ (ma trận, inverse index, RSS tăng thêm, peak tracemalloc mỗi query)
+- sync: throughput (lesson/s) của full sync, incremental sync và sync không có thay đổi trên collection
+  lessons giả lập (benchmarks.fakes)
+- rerank: chi phí re-rank (rerank.py) theo kích thước pool (--rerank-pools) trên FAQ thật và corpus tổng hợp
+  nhỏ nhất: latency lấy pool từ index, latency MMR, độ trùng lặp (cosine trung bình giữa các cặp) của top-5
+  trước / sau và overlap@5 với top-5 không re-rank; cross-encoder (FAQ) nếu load được model
+- ask: latency /ask qua TestClient với fake LLM: lần đầu (cache miss) và hỏi lại (answer cache hit)
+- startup: import + khởi động improved_main trong process mới cho đến khi /health/ready trả 200
+  (STARTUP_MODE eager và fast)
+
+Không gọi Gemini (LLM_BACKEND=fake) và không cần MongoDB. Với --compare, các metric latency / thời gian /
+bộ nhớ tăng (hoặc throughput giảm) quá --tolerance so với file JSON cũ được liệt kê, exit code 1.
+
+Ví dụ:
+    python -m benchmarks.suite --json bench.json
+    python -m benchmarks.suite --stages search --sizes 10000 100000 --json search.json
+    python -m benchmarks.suite --stages search ask --sizes 10000 --json new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fakes import FakeLessonsCollection, make_lessons
+
+FAQ_DATASET = './faq_dataset.json'
+FAQ_PARQUET = './english_qa_embeddings.parquet'
+STAGES = ('encode', 'search', 'rerank', 'sync', 'ask', 'startup')
+# Biến môi trường ảnh hưởng tới kết quả, ghi vào JSON để biết hai lần chạy có cùng cấu hình không
+CONFIG_ENV = ('VECTOR_INDEX_BACKEND', 'EMBEDDING_DTYPE', 'RETRIEVAL_MODE', 'HYBRID_PREFILTER_MIN_ROWS',
+              'EMBEDDINGS_MMAP', 'SENTENCE_MODEL_NAME', 'ENCODE_BATCH_SIZE', 'SYNC_ENCODE_BATCH_SIZE',
+              'RERANK_MODE', 'RERANK_POOL', 'RERANK_MMR_LAMBDA', 'RERANK_CROSS_ENCODER_MODEL')
+
+
+def percentiles(latencies_ms: List[float], prefix: str) -> dict:
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        f'{prefix}_ms_p50': round(float(np.percentile(values, 50)), 4),
+        f'{prefix}_ms_p95': round(float(np.percentile(values, 95)), 4),
+    }
+
+
+def timed(fn: Callable, items) -> List[float]:
+    """Gọi fn(item) cho từng item, trả về latency (ms)"""
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def rss_mb() -> float:
+    """RSS hiện tại của process (Linux /proc, nơi khác dùng peak RSS của resource)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def peak_query_mb(fn: Callable, items) -> float:
+    """Bộ nhớ tạm lớn nhất (tracemalloc, gồm buffer numpy) mà một lần gọi fn cấp phát"""
+    tracemalloc.start()
+    peak = 0
+    try:
+        for item in items:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn(item)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 ** 2, 3)
+
+
+def load_faq_questions() -> List[str]:
+    with open(FAQ_DATASET, 'r', encoding='utf-8') as f:
+        return [item['question'] for item in json.load(f)]
+
+
+# App ---------------------------------------------------------------------
+
+_app_module = None
+
+
+def load_app(args):
+    """Import improved_main một lần: lesson store trong thư mục tạm, collection lessons giả lập, tắt auto sync"""
+    global _app_module
+    if _app_module is None:
+        import improved_main as app_module
+        from lesson_segments import LessonSegmentLog
+
+        workdir = tempfile.mkdtemp(prefix='bench-suite-')
+        app_module.lessons_parquet = os.path.join(workdir, 'english_lessons_embeddings.parquet')
+        app_module.lesson_log = LessonSegmentLog(app_module.lessons_parquet)
+        app_module.lessons_coll = FakeLessonsCollection()
+        app_module.AUTO_SYNC_ENABLED = False
+        _app_module = app_module
+    return _app_module
+
+
+# Stages ------------------------------------------------------------------
+
+
+def bench_encode(args) -> dict:
+    from sentence_transformers import SentenceTransformer
+
+    from query_encoder import ENCODE_BATCH_SIZE
+
+    name = os.getenv('SENTENCE_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+    questions = load_faq_questions()
+    start = time.perf_counter()
+    model = SentenceTransformer(name)
+    load_s = time.perf_counter() - start
+    model.encode(questions[0])  # Warm-up
+
+    latencies = timed(model.encode, questions[:args.queries])
+    start = time.perf_counter()
+    matrix = model.encode(questions, batch_size=ENCODE_BATCH_SIZE)
+    batch_s = time.perf_counter() - start
+    return {
+        'model': name,
+        'dim': int(np.asarray(matrix).shape[1]),
+        'model_load_seconds': round(load_s, 3),
+        **percentiles(latencies, 'single'),
+        'batch_size': ENCODE_BATCH_SIZE,
+        'batch_questions': len(questions),
+        'batch_questions_per_sec': round(len(questions) / batch_s, 1),
+    }
+
+
+def synthetic_store(rows: int, dim: int, seed: int):
+    """Corpus tổng hợp: vector cụm (sinh theo chunk, chuẩn hoá tại chỗ để 1M dòng không cần bản sao),
+    câu hỏi 6 từ từ vocab 5000 từ, 20 category"""
+    from vector_store import VectorStore
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((256, dim), dtype=np.float32)
+    matrix = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 65536):
+        block = matrix[start:start + 65536]
+        block[:] = centers[rng.integers(0, len(centers), len(block))]
+        block += 0.6 * rng.standard_normal(block.shape, dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+
+    words = np.array([f"term{i}" for i in range(5000)], dtype=object)
+    questions = [' '.join(row) for row in words[rng.integers(0, len(words), (rows, 6))]]
+    categories = np.array([f"category-{i}" for i in range(20)], dtype=object)[rng.integers(0, 20, rows)]
+    return VectorStore(matrix, questions, [''] * rows, list(categories), ['lessons'] * rows, normalized=True)
+
+
+def faq_store():
+    from mmap_embeddings import load_faq_table
+    from vector_store import VectorStore
+
+    df, matrix = load_faq_table(FAQ_PARQUET, use_mmap=False)
+    return VectorStore.from_dataframe(df, prefix_matrix=matrix)
+
+
+def lexical_mb(store) -> float:
+    if store.lexical is None:
+        return 0.0
+    return round(store.lexical.nbytes / 1024 ** 2, 2)
+
+
+def bench_store(store, build_s: float, rss_delta: float, args) -> dict:
+    """search_similar_embeddings (như /ask gọi) trên một store: vector, hybrid, có filter, batch"""
+    search_similar_embeddings = load_app(args).search_similar_embeddings
+    rng = np.random.default_rng(args.seed + 1)
+    rows = rng.integers(0, len(store), args.queries)
+    jitter = rng.standard_normal((len(rows), store.dim), dtype=np.float32) / np.sqrt(store.dim)
+    queries = store.vectors(rows) + jitter
+    # Câu hỏi dạng text: 3 từ đầu của dòng gốc, để phía BM25 có kết quả
+    texts = [' '.join(str(question).split()[:3]) for question in store.questions.to_list(rows)]
+    category = max(store.partitions['category'].items(), key=lambda item: len(item[1]))[0]
+    items = list(zip(queries, texts))
+
+    def vector(item):
+        search_similar_embeddings(item[0], store, top_k=5, threshold=0.3)
+
+    def hybrid(item):
+        search_similar_embeddings(item[0], store, top_k=5, threshold=0.3, question=item[1])
+
+    def filtered(item):
+        search_similar_embeddings(item[0], store, top_k=5, threshold=0.3, question=item[1], category=category)
+
+    vector(items[0])  # Warm-up (BLAS thread pool, page cache)
+    result = {
+        'rows': len(store),
+        'dim': store.dim,
+        'index': store.index_name,
+        'build_seconds': round(build_s, 3),
+        'matrix_mb': round(store.matrix_nbytes / 1024 ** 2, 2),
+        'metadata_mb': round(store.metadata_nbytes / 1024 ** 2, 2),
+        'lexical_mb': lexical_mb(store),
+        'rss_delta_mb': round(rss_delta, 1),
+        **percentiles(timed(vector, items), 'vector'),
+        **percentiles(timed(hybrid, items), 'hybrid'),
+        'filter_fraction': round(len(store.partitions['category'][category]) / len(store), 3),
+        **percentiles(timed(filtered, items), 'filtered'),
+        'vector_peak_query_mb': peak_query_mb(vector, items[:5]),
+        'hybrid_peak_query_mb': peak_query_mb(hybrid, items[:5]),
+    }
+    start = time.perf_counter()
+    store.search_batch(queries, top_k=5, threshold=0.3, texts=texts)
+    result['batch_ms_per_query'] = round((time.perf_counter() - start) * 1000 / len(queries), 4)
+    return result
+
+
+def bench_search(args) -> dict:
+    load_app(args)  # Import trước để RSS của corpus đầu tiên không gồm bộ nhớ của các module
+    results = {}
+    corpora = [('faq', faq_store)] + [(f'synthetic-{n}', lambda n=n: synthetic_store(n, args.dim, args.seed))
+                                      for n in args.sizes]
+    for name, build in corpora:
+        print(f"🔎 search: {name}", flush=True)
+        before = rss_mb()
+        start = time.perf_counter()
+        store = build().build_index()
+        build_s = time.perf_counter() - start
+        results[name] = bench_store(store, build_s, rss_mb() - before, args)
+        del store
+    return results
+
+
+def bench_rerank_store(store, args, cross_encoder=None) -> dict:
+    """Với mỗi pool: thời gian lấy pool (search + gộp passage) và thời gian re-rank đo riêng, để thấy
+    phần tăng thêm so với top-5 thường"""
+    from rerank import Reranker, redundancy
+
+    rng = np.random.default_rng(args.seed + 2)
+    rows = rng.integers(0, len(store), args.queries)
+    jitter = rng.standard_normal((len(rows), store.dim), dtype=np.float32) / np.sqrt(store.dim)
+    queries = store.vectors(rows) + jitter
+    texts = store.questions.to_list(rows)
+
+    def retrieve(query, k):
+        indices, scores = store.search(query, top_k=store.fetch_k(k), threshold=0.3)
+        return store.collapse_passages(indices, scores, k)
+
+    retrieve(queries[0], 5)  # Warm-up
+    baseline = [retrieve(query, 5)[0] for query in queries]
+    result = {
+        'rows': len(store),
+        **percentiles(timed(lambda query: retrieve(query, 5), queries), 'top5_search'),
+        'top5_redundancy': round(float(np.mean([redundancy(store, top) for top in baseline])), 4),
+        'pools': {},
+    }
+    for pool in args.rerank_pools:
+        pools = [retrieve(query, pool) for query in queries]
+        entry = {
+            'mean_candidates': round(float(np.mean([len(indices) for indices, _ in pools])), 1),
+            **percentiles(timed(lambda query: retrieve(query, pool), queries), 'pool_search'),
+        }
+        stages = [('mmr', None)] + ([('cross_encoder', cross_encoder), ('cross_encoder+mmr', cross_encoder)]
+                                    if cross_encoder is not None else [])
+        for mode, model in stages:
+            # Budget vô hạn, không theo dõi tải: đo chi phí thật của từng bước
+            reranker = Reranker(mode=mode, pool=pool, budget_ms=float('inf'))
+            reranker.cross_encoder = model
+            reranked = []
+
+            def rerank(i):
+                reranked.append(reranker.rerank(store, queries[i], *pools[i], 5, text=texts[i])[0])
+
+            latencies = timed(rerank, range(len(queries)))
+            prefix = mode.replace('+', '_')
+            entry.update(percentiles(latencies, prefix))
+            entry[f'{prefix}_redundancy'] = round(float(np.mean([redundancy(store, top) for top in reranked])), 4)
+            entry[f'{prefix}_overlap_at_5'] = round(float(np.mean(
+                [len(set(top.tolist()) & set(base.tolist())) / max(len(base), 1)
+                 for top, base in zip(reranked, baseline)])), 3)
+        result['pools'][str(pool)] = entry
+    return result
+
+
+def bench_rerank(args) -> dict:
+    from rerank import RERANK_CROSS_ENCODER_MODEL, Reranker
+
+    load_app(args)
+    # Cross-encoder chỉ đo trên FAQ (câu hỏi có text thật); không có model (offline) thì bỏ qua
+    probe = Reranker(mode='cross_encoder')
+    probe.load_cross_encoder()
+    results = {'cross_encoder_model': RERANK_CROSS_ENCODER_MODEL if probe.cross_encoder is not None else None}
+    corpora = [('faq', faq_store, probe.cross_encoder)]
+    if args.sizes:
+        size = min(args.sizes)
+        corpora.append((f'synthetic-{size}', lambda: synthetic_store(size, args.dim, args.seed), None))
+    for name, build, cross_encoder in corpora:
+        print(f"🔀 rerank: {name}", flush=True)
+        store = build().build_index()
+        results[name] = bench_rerank_store(store, args, cross_encoder)
+        del store
+    return results
+
+
+def bench_sync(args) -> dict:
+    app_module = load_app(args)
+    coll = FakeLessonsCollection(make_lessons(args.lessons))
+    app_module.lessons_coll = coll
+
+    start = time.perf_counter()
+    app_module.sync_courses_from_mongodb(full=True)
+    full_s = time.perf_counter() - start
+
+    ids = coll.ids()
+    changed = ids[::10]
+    for lesson_id in changed:
+        coll.update_one(lesson_id, {'content': f"Nội dung cập nhật của {lesson_id}"})
+    start = time.perf_counter()
+    app_module.sync_courses_from_mongodb()
+    incremental_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    app_module.sync_courses_from_mongodb()
+    noop_s = time.perf_counter() - start
+    return {
+        'lessons': len(ids),
+        'full_seconds': round(full_s, 3),
+        'full_lessons_per_sec': round(len(ids) / full_s, 1),
+        'changed': len(changed),
+        'incremental_seconds': round(incremental_s, 3),
+        'incremental_lessons_per_sec': round(len(changed) / incremental_s, 1),
+        'noop_seconds': round(noop_s, 3),
+        'corpus_rows': len(app_module.index_snapshots.current.store),
+    }
+
+
+def bench_ask(args) -> dict:
+    from fastapi.testclient import TestClient
+
+    app_module = load_app(args)
+    questions = load_faq_questions()[:args.queries]
+    with TestClient(app_module.app) as client:
+        client.post('/ask', json={'question': 'warm-up'})
+
+        def ask(question):
+            response = client.post('/ask', json={'question': question})
+            assert response.status_code == 200, response.text
+
+        cold = timed(ask, questions)
+        warm = timed(ask, questions)  # Câu hỏi lặp lại: query embedding cache + answer cache
+    context_tokens = app_module.PROMPT_CONTEXT_TOKENS_HIST.mean()
+    return {
+        'questions': len(questions),
+        'corpus_rows': len(app_module.index_snapshots.current.store),
+        'fake_llm_latency_ms': args.llm_latency_ms,
+        'prompt_context_tokens_mean': round(context_tokens, 1) if context_tokens is not None else None,
+        **percentiles(cold, 'cold'),
+        **percentiles(warm, 'cached'),
+    }
+
+
+def startup_child():
+    """Chạy trong process con (xem bench_startup): in JSON thời gian khởi động"""
+    started = time.perf_counter()
+    import improved_main as app_module
+    imported = time.perf_counter() - started
+    from fastapi.testclient import TestClient
+
+    app_module.AUTO_SYNC_ENABLED = False
+    app_module.lessons_coll = None
+    with TestClient(app_module.app) as client:
+        serving = time.perf_counter() - started
+        deadline = time.monotonic() + 300
+        while client.get('/health/ready').status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        ready = time.perf_counter() - started
+    print(json.dumps({'import_seconds': round(imported, 3), 'serving_seconds': round(serving, 3),
+                      'ready_seconds': round(ready, 3), 'phases': app_module.startup_timings}))
+
+
+def bench_startup(args) -> dict:
+    results = {}
+    for mode in args.startup_modes:
+        runs = []
+        for _ in range(args.startup_runs):
+            env = {**os.environ, 'STARTUP_MODE': mode}
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', 'from benchmarks.suite import startup_child; startup_child()'],
+                                 env=env, capture_output=True, text=True, check=True)
+            run = json.loads(out.stdout.strip().splitlines()[-1])
+            run['process_seconds'] = round(time.perf_counter() - start, 3)
+            runs.append(run)
+        results[mode] = {
+            **{key: round(statistics.median(r[key] for r in runs), 3)
+               for key in ('import_seconds', 'serving_seconds', 'ready_seconds', 'process_seconds')},
+            'runs': runs,
+        }
+    return results
+
+
+# Compare -----------------------------------------------------------------
+
+
+def flatten(tree, prefix: str = '') -> Dict[str, float]:
+    """{'search': {'faq': {'vector_ms_p50': 1}}} -> {'search.faq.vector_ms_p50': 1} (chỉ giá trị số)"""
+    out = {}
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            if key != 'runs':
+                out.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(tree, (int, float)) and not isinstance(tree, bool):
+        out[prefix[:-1]] = float(tree)
+    return out
+
+
+def direction(key: str):
+    """(chiều, ngưỡng nhiễu tuyệt đối): +1 càng thấp càng tốt, -1 càng cao càng tốt, 0 không phải
+    metric hiệu năng. Thay đổi nhỏ hơn ngưỡng (vd. 0.01s của một sync rỗng) không tính là regression."""
+    name = key.rsplit('.', 1)[-1]
+    if name.endswith('_per_sec'):
+        return -1, 0.0
+    if '_ms' in name:
+        return 1, 0.05
+    if name.endswith('_seconds'):
+        return 1, 0.01
+    if name.endswith('_mb'):
+        return 1, 1.0
+    return 0, 0.0
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """Metric thay đổi quá tolerance theo chiều xấu đi"""
+    old, new = flatten(baseline.get('results', {})), flatten(current.get('results', {}))
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        sign, floor = direction(key)
+        if sign == 0 or old[key] <= 0 or abs(new[key] - old[key]) < floor:
+            continue
+        change = (new[key] - old[key]) / old[key]
+        if sign * change > tolerance:
+            regressions.append({'metric': key, 'baseline': old[key], 'current': new[key], 'change': round(change, 3)})
+    return regressions
+
+
+def run_metadata(args) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {name: os.environ[name] for name in CONFIG_ENV if name in os.environ},
+        'args': {k: v for k, v in vars(args).items() if k not in ('json', 'compare')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark encode / retrieval / /ask / sync / startup, xuất JSON')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000, 1000000],
+                        help='Số dòng của các corpus tổng hợp (stage search)')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200, help='Số query cho mỗi phép đo latency')
+    parser.add_argument('--rerank-pools', type=int, nargs='+', default=[10, 20, 50],
+                        help='Các kích thước pool ứng viên cho stage rerank')
+    parser.add_argument('--lessons', type=int, default=2000, help='Số lesson trong collection giả lập (stage sync)')
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0,
+                        help='Latency của fake LLM; 0 để chỉ đo phần overhead của server')
+    parser.add_argument('--startup-modes', nargs='+', default=['eager', 'fast'])
+    parser.add_argument('--startup-runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    parser.add_argument('--compare', help='File JSON của lần chạy trước để phát hiện regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Tỉ lệ xấu đi cho phép khi --compare')
+    args = parser.parse_args()
+
+    # Benchmark không bao giờ gọi Gemini thật; đặt trước khi import improved_main / llm_client
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ['FAKE_LLM_LATENCY_MS'] = str(args.llm_latency_ms)
+
+    stages = {'encode': bench_encode, 'search': bench_search, 'rerank': bench_rerank, 'sync': bench_sync, 'ask': bench_ask,
+              'startup': bench_startup}
+    report = {'meta': run_metadata(args), 'results': {}}
+    for name in STAGES:
+        if name in args.stages:
+            print(f"⏱️ Stage {name}...", flush=True)
+            start = time.perf_counter()
+            report['results'][name] = stages[name](args)
+            print(f"✅ {name} xong sau {time.perf_counter() - start:.1f}s", flush=True)
+
+    print(json.dumps(report['results'], indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Đã ghi kết quả vào {args.json}")
+
+    regressions: Optional[List[dict]] = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        print(f"\n📊 So với {args.compare} (tolerance {args.tolerance:.0%}): {len(regressions)} regression")
+        for r in regressions:
+            print(f"❌ {r['metric']:<48} {r['baseline']:>12} -> {r['current']:>12} ({r['change']:+.1%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Các cache cho đường xử lý /ask.
+
+SemanticAnswerCache: cache câu trả lời theo embedding câu hỏi. Câu hỏi mới trúng cache khi
+cosine với một câu hỏi đã cache >= ngưỡng VÀ tập context retrieve được giống hệt, khi đó
+trả luôn ChatResponse đã lưu mà không gọi Gemini.
+
+QueryEmbeddingCache: lớp cache rẻ hơn đặt trước encoder, ánh xạ câu hỏi đã chuẩn hoá
+(khoảng trắng / chữ hoa / dấu tiếng Việt) sang embedding để bỏ qua transformer.
+"""
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '2000'))
+ANSWER_CACHE_MAX_MB = float(os.getenv('ANSWER_CACHE_MAX_MB', '64'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '4096'))
+
+
+def _estimate_bytes(value) -> int:
+    """Ước lượng thô kích thước payload (chuỗi UTF-8 + overhead cố định)"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 50
+    if isinstance(value, dict):
+        return sum(_estimate_bytes(k) + _estimate_bytes(v) for k, v in value.items()) + 100
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_bytes(v) for v in value) + 60
+    return 32
+
+
+class _Entry:
+    __slots__ = ('slot', 'context_key', 'payload', 'created_at', 'size')
+
+    def __init__(self, slot: int, context_key: Hashable, payload: dict, size: int):
+        self.slot = slot
+        self.context_key = context_key
+        self.payload = payload
+        self.created_at = time.monotonic()
+        self.size = size
+
+
+class SemanticAnswerCache:
+    """Cache câu trả lời theo độ tương đồng embedding, với LRU + TTL + giới hạn bộ nhớ"""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, max_mb: float = ANSWER_CACHE_MAX_MB,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl_seconds
+        self.threshold = threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()  # slot -> entry, thứ tự LRU
+        self._matrix: Optional[np.ndarray] = None  # (max_entries, d) embedding đã chuẩn hoá theo slot
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+
+    def get(self, embedding: np.ndarray, context_key: Hashable) -> Optional[dict]:
+        """Trả payload đã cache nếu có câu hỏi đủ giống với cùng context, ngược lại None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            query = self._normalize(embedding)
+            if self._matrix is None or self._matrix.shape[1] != len(query):
+                self.misses += 1
+                return None
+            scores = self._matrix @ query
+            scores[~self._valid] = -np.inf
+            now = time.monotonic()
+            candidates = np.flatnonzero(scores >= self.threshold)
+            for slot in candidates[np.argsort(-scores[candidates])]:
+                entry = self._entries.get(int(slot))
+                if entry is None:
+                    continue
+                if self.ttl > 0 and now - entry.created_at > self.ttl:
+                    self._remove(entry)
+                    continue
+                if entry.context_key != context_key:
+                    continue
+                self._entries.move_to_end(entry.slot)
+                self.hits += 1
+                return entry.payload
+            self.misses += 1
+            return None
+
+    def put(self, embedding: np.ndarray, context_key: Hashable, payload: dict):
+        if not self.enabled:
+            return
+        with self._lock:
+            query = self._normalize(embedding)
+            if self._matrix is None or self._matrix.shape[1] != len(query):
+                self._reset(len(query))
+            size = query.nbytes + _estimate_bytes(payload) + _estimate_bytes(context_key)
+            if size > self.max_bytes:
+                return
+            while self._entries and (len(self._entries) >= self.max_entries or self._bytes + size > self.max_bytes):
+                self._remove(next(iter(self._entries.values())))
+                self.evictions += 1
+            slot = int(np.flatnonzero(~self._valid)[0])
+            self._matrix[slot] = query
+            self._valid[slot] = True
+            entry = _Entry(slot, context_key, payload, size)
+            self._entries[slot] = entry
+            self._bytes += size
+
+    def _remove(self, entry: _Entry):
+        self._entries.pop(entry.slot, None)
+        self._valid[entry.slot] = False
+        self._bytes -= entry.size
+
+    def _reset(self, dim: int):
+        self._entries.clear()
+        self._matrix = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._valid[:] = False
+        self._bytes = 0
+
+    def invalidate(self):
+        """Xoá toàn bộ cache (gọi khi corpus thay đổi: sync, index lesson)"""
+        with self._lock:
+            if self._entries:
+                logger.info(f"🧹 Xoá {len(self._entries)} câu trả lời trong answer cache")
+            self._entries.clear()
+            self._valid[:] = False
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def normalize_question(text: str) -> str:
+    """Chuẩn hoá câu hỏi làm khoá cache: bỏ dấu, chữ thường, gộp khoảng trắng"""
+    text = unicodedata.normalize('NFD', text or '')
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    return ' '.join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """LRU cache: câu hỏi đã chuẩn hoá -> embedding"""
+
+    def __init__(self, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_size = max(0, max_size)
+        self._lock = threading.Lock()
+        self._items: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, question: str) -> Optional[np.ndarray]:
+        if self.max_size == 0:
+            return None
+        key = normalize_question(question)
+        with self._lock:
+            embedding = self._items.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, question: str, embedding: np.ndarray):
+        if self.max_size == 0:
+            return
+        key = normalize_question(question)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding.setflags(write=False)  # Dùng chung giữa các request nên không cho sửa
+        with self._lock:
+            self._items[key] = embedding
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
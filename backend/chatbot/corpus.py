@@ -0,0 +1,204 @@
+"""
+Các cột metadata của corpus dạng gọn (không DataFrame, không một object Python cho mỗi ô).
+
+- StringColumn: chuỗi UTF-8 nằm liền trong buffer Arrow (large_string: offsets int64 + data),
+  thay vì mỗi dòng một object str; chỉ các dòng được lấy ra (top-k) mới thành str Python.
+- InternedColumn: category / source_type dạng mã int32 + bảng nhãn dùng chung; partition theo
+  giá trị là một lần argsort trên mã.
+- Hit: một dòng kết quả đã materialize, thứ duy nhất request /ask đọc từ corpus.
+
+Các cột không bị sửa tại chỗ, chỉ được nối thêm: chuỗi nối bằng chunk Arrow mới (zero-copy), cột
+numpy ghi vào phần trống phía sau của một AppendBuffer. Phiên bản cột mà snapshot cũ đang đọc (n dòng
+đầu) không bao giờ bị ghi lại, nên bản copy của store dùng chung cột mà không copy.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def _rows(rows) -> pa.Array:
+    return pa.array(np.asarray(rows, dtype=np.int64))
+
+
+class StringColumn:
+    """Cột chuỗi (có thể null) trong một mảng Arrow large_string"""
+
+    __slots__ = ('array',)
+
+    def __init__(self, array: pa.Array):
+        self.array = array
+
+    @classmethod
+    def from_values(cls, values: Iterable) -> 'StringColumn':
+        return cls(pa.array([None if v is None else str(v) for v in values], type=pa.large_string()))
+
+    @classmethod
+    def from_arrow(cls, array) -> 'StringColumn':
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks() if array.num_chunks else pa.array([], type=pa.large_string())
+        return cls(array.cast(pa.large_string()))
+
+    @classmethod
+    def nulls(cls, n: int) -> 'StringColumn':
+        return cls(pa.nulls(n, type=pa.large_string()))
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        return self.array[int(row)].as_py()
+
+    def take(self, rows) -> 'StringColumn':
+        array = self.array.take(_rows(rows))
+        return StringColumn(array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array)
+
+    def concat(self, other: 'StringColumn') -> 'StringColumn':
+        """Nối không copy: cột mới là các chunk của hai cột (take() gộp lại thành một mảng)"""
+        return StringColumn(pa.chunked_array(_chunks(self.array) + _chunks(other.array), type=pa.large_string()))
+
+    def to_list(self, rows=None) -> List[Optional[str]]:
+        return (self.array if rows is None else self.array.take(_rows(rows))).to_pylist()
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+
+def _chunks(array) -> list:
+    return array.chunks if isinstance(array, pa.ChunkedArray) else [array]
+
+
+class InternedColumn:
+    """Cột giá trị lặp lại nhiều (category, source_type): mã int32 + bảng nhãn"""
+
+    __slots__ = ('codes', 'labels', '_lookup')
+
+    def __init__(self, codes: np.ndarray, labels: Sequence[str]):
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.labels = np.asarray(labels, dtype=object)
+        self._lookup = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def from_values(cls, values: Iterable) -> 'InternedColumn':
+        values = np.asarray([str(v) for v in values], dtype=object)
+        if not len(values):
+            return cls(np.empty(0, dtype=np.int32), [])
+        codes, uniques = pd.factorize(values)
+        return cls(codes, list(uniques))
+
+    @classmethod
+    def from_arrow(cls, array) -> 'InternedColumn':
+        """Cột dictionary (như to_arrow ghi ra) dùng lại mã; cột chuỗi thường được factorize"""
+        if isinstance(array, pa.ChunkedArray):
+            if array.num_chunks != 1:
+                return cls.from_values(array.to_pylist())
+            array = array.chunk(0)
+        if pa.types.is_dictionary(array.type) and not array.null_count:
+            return cls(array.indices.to_numpy(zero_copy_only=False), array.dictionary.to_pylist())
+        return cls.from_values(array.to_pylist())
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> str:
+        return self.labels[self.codes[row]]
+
+    def take(self, rows) -> 'InternedColumn':
+        return InternedColumn(self.codes[np.asarray(rows, dtype=np.int64)], self.labels)
+
+    def merge(self, other: 'InternedColumn') -> Tuple[List[str], np.ndarray]:
+        """(bảng nhãn chung, mã của `other` theo bảng đó); nhãn mới được thêm vào cuối nên mã cũ giữ nguyên"""
+        labels = list(self.labels)
+        mapping = np.empty(len(other.labels), dtype=np.int32)
+        for i, label in enumerate(other.labels):
+            code = self._lookup.get(label)
+            if code is None:
+                code = len(labels)
+                labels.append(label)
+            mapping[i] = code
+        return labels, mapping[other.codes]
+
+    def to_list(self, rows=None) -> List[str]:
+        codes = self.codes if rows is None else self.codes[np.asarray(rows, dtype=np.int64)]
+        return self.labels[codes].tolist()
+
+    def to_arrow(self) -> pa.DictionaryArray:
+        return pa.DictionaryArray.from_arrays(pa.array(self.codes, type=pa.int32()),
+                                              pa.array(self.labels.tolist(), type=pa.string()))
+
+    def partition(self) -> Dict[str, np.ndarray]:
+        """nhãn -> các row có nhãn đó (tăng dần); bỏ nhãn không còn dòng nào"""
+        order = np.argsort(self.codes, kind='stable').astype(np.int64)
+        bounds = np.searchsorted(self.codes[order], np.arange(len(self.labels) + 1))
+        return {str(label): order[bounds[i]:bounds[i + 1]] for i, label in enumerate(self.labels)
+                if bounds[i + 1] > bounds[i]}
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+def take(column, rows):
+    """take() cho cả cột numpy lẫn StringColumn / InternedColumn"""
+    if isinstance(column, np.ndarray):
+        return column[np.asarray(rows, dtype=np.int64)]
+    return column.take(rows)
+
+
+class AppendBuffer:
+    """Buffer numpy chỉ nối thêm, dùng chung giữa các phiên bản của một cột: phiên bản n dòng là view
+    data[:n]; `length` là số dòng đã có phiên bản sở hữu"""
+
+    __slots__ = ('data', 'length')
+
+    def __init__(self, data: np.ndarray, length: int):
+        self.data = data
+        self.length = length
+
+    def owns(self, view: np.ndarray) -> bool:
+        return (self.length == len(view) and self.data.shape[1:] == view.shape[1:]
+                and self.data.__array_interface__['data'][0] == view.__array_interface__['data'][0])
+
+
+def extend(buffer: Optional[AppendBuffer], view: np.ndarray, values: np.ndarray) -> Tuple[AppendBuffer, np.ndarray]:
+    """Nối `values` sau `view` (phiên bản hiện tại của cột), trả về (buffer, view mới).
+
+    Nếu `view` là phiên bản mới nhất của buffer và còn chỗ thì ghi vào phần trống phía sau (không copy,
+    reader của `view` không thấy gì thay đổi); ngược lại copy sang buffer mới gấp đôi."""
+    n, k = len(view), len(values)
+    if buffer is not None and buffer.owns(view) and n + k <= len(buffer.data):
+        buffer.data[n:n + k] = values
+        buffer.length = n + k
+        return buffer, buffer.data[:n + k]
+    data = np.empty((max(16, 2 * (n + k)),) + values.shape[1:], dtype=view.dtype if n else values.dtype)
+    if n:
+        data[:n] = view
+    data[n:n + k] = values
+    return AppendBuffer(data, n + k), data[:n + k]
+
+
+class Hit:
+    """Một dòng top-k đã materialize cho phần xử lý sau retrieval (prompt, suggestions, cache key)"""
+
+    __slots__ = ('row', 'question', 'answer', 'category', 'source_type', 'lesson_id', 'similarity', 'title')
+
+    def __init__(self, row: int, question: str, answer: str, category: str, source_type: str,
+                 lesson_id: Optional[str], similarity: float, title: Optional[str] = None):
+        self.row = row
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.source_type = source_type
+        self.lesson_id = lesson_id
+        self.similarity = similarity
+        self.title = title
+
+    @property
+    def label(self) -> str:
+        """Tên hiển thị: tiêu đề lesson (question của passage là text đã embed), hoặc câu hỏi FAQ"""
+        return (self.title or self.question) if self.lesson_id is not None else self.question
+
+    def __repr__(self) -> str:
+        return f"Hit(row={self.row}, similarity={self.similarity:.3f}, question={self.question[:40]!r})"
@@ -1,119 +1,353 @@
 """
 Script để tạo embeddings sử dụng SentenceTransformers với faq_dataset.json
+
+Input: JSON (mảng, đọc cả file) hoặc JSON Lines (.jsonl / .ndjson, mỗi dòng một câu hỏi, đọc dạng
+stream). Dataset được xử lý theo từng chunk `--chunk-size` câu hỏi: encode chunk đó rồi ghi thành một
+row group của parquet (cột embedding fixed_size_list<float32>[dim]), nên bộ nhớ đỉnh cỡ một chunk
+chứ không phải vài lần kích thước dataset. Corpus lớn (hàng triệu câu hỏi) nên dùng JSON Lines.
+
+Build incremental: mỗi câu hỏi được nhận diện bằng sha1(model name + câu hỏi). Nếu file parquet cũ
+được tạo bởi cùng model (model + dimension lưu trong metadata của file), embedding của các câu hỏi
+không đổi được dùng lại, chỉ câu hỏi mới/đã sửa được encode, câu hỏi đã xoá khỏi dataset bị bỏ.
+Embedding cũ được chép theo block sang một file .npy tạm (memory-map), tra theo 8 byte đầu của hash
+trong mảng numpy đã sắp xếp. Đổi model, file cũ không có metadata hoặc lưu int8 (giải lượng tử rồi
+lượng tử lại sẽ cộng dồn sai số) thì tạo lại toàn bộ; `--full` để ép tạo lại.
+`--workers N` encode song song trên N process CPU.
 """
+import argparse
+import hashlib
 import json
-import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sentence_transformers import SentenceTransformer
 import os
+import tempfile
 from tqdm import tqdm
 
-def load_faq_data(file_path):
-    """Load FAQ data from JSON file"""
-    try:
+from quantization import (EmbeddingParquetWriter, embedding_storage_dtype, iter_embedding_blocks, read_embedding_info,
+                          requantize_embeddings_parquet)
+from vector_store import l2_normalize
+
+DEFAULT_MODEL_NAME = os.getenv('SENTENCE_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+FAQ_FIELDS = [
+    ('question', pa.string()),
+    ('answer', pa.string()),
+    ('category', pa.string()),
+    ('tags', pa.list_(pa.string())),
+]
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+
+def iter_faq_records(file_path):
+    """Từng câu hỏi của dataset: JSON Lines đọc từng dòng, JSON mảng đọc cả file"""
+    if os.path.splitext(file_path)[1].lower() not in JSON_LINES_EXTENSIONS:
         with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        print(f"✅ Đã load {len(data)} câu hỏi từ {file_path}")
-        return data
+            yield from json.load(f)
+        return
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{file_path}:{line_no}: {e}") from e
+
+def normalize_record(item):
+    """Các cột được lưu, với giá trị mặc định như trước"""
+    return {
+        'question': item['question'],
+        'answer': item['answer'],
+        'category': item.get('category', 'general'),
+        'tags': list(item.get('tags') or []),
+    }
+
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for item in records:
+        chunk.append(normalize_record(item))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def question_hash(model_name, question):
+    """Khoá của một embedding: đổi câu hỏi hoặc model thì phải encode lại"""
+    return hashlib.sha1(f"{model_name}\0{question}".encode('utf-8')).hexdigest()
+
+def question_keys(model_name, questions):
+    """8 byte đầu của question_hash dạng uint64 (đủ để tra, không phải giữ chuỗi hex cho cả corpus)"""
+    return np.fromiter((int(question_hash(model_name, q)[:16], 16) for q in questions),
+                       dtype=np.uint64, count=len(questions))
+
+def source_hash(file_path):
+    """(hash toàn bộ nội dung dataset, số câu hỏi) - một lượt đọc stream, không encode;
+    dùng để biết có cần ghi lại file không"""
+    hasher = hashlib.sha1()
+    rows = 0
+    for item in iter_faq_records(file_path):
+        hasher.update(json.dumps(normalize_record(item), ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        hasher.update(b'\n')
+        rows += 1
+    return hasher.hexdigest(), rows
+
+class PreviousEmbeddings:
+    """Embedding của file parquet cũ: keys (uint64, đã sắp xếp) -> dòng của ma trận memory-map"""
+
+    def __init__(self, keys, rows, matrix):
+        self.keys = keys
+        self.rows = rows
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """(mask các key có sẵn, dòng tương ứng trong self.matrix)"""
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[positions] == keys, self.rows[positions]
+
+def load_previous_embeddings(path, model_name, dtype, tmp_dir):
+    """Embedding trong file parquet cũ (PreviousEmbeddings), None nếu không dùng lại được"""
+    if not os.path.exists(path):
+        return None
+    try:
+        info = read_embedding_info(path)
+        stored_dtype = embedding_storage_dtype(path)
     except Exception as e:
-        print(f"❌ Lỗi khi đọc file {file_path}: {e}")
+        print(f"⚠️ Không đọc được {path} ({e}), tạo lại toàn bộ")
+        return None
+    if info is None:
+        print(f"ℹ️ {path} không có metadata model, tạo lại toàn bộ")
+        return None
+    if info.get('model') != model_name:
+        print(f"🔄 Model đổi ({info.get('model')} -> {model_name}), tạo lại toàn bộ")
+        return None
+    if stored_dtype not in ('float32', dtype) or stored_dtype == 'int8':
+        # float16 -> float32 sẽ giữ sai số float16; int8 lượng tử lại với scale mới sẽ cộng dồn sai số
+        print(f"🔄 File cũ lưu {stored_dtype}, không dùng lại được cho {dtype}, tạo lại toàn bộ")
         return None
 
-def create_embeddings_with_sentence_transformers(data, model_name='all-MiniLM-L6-v2'):
+    source = pq.ParquetFile(path)
+    n, dim = source.metadata.num_rows, info.get('dim')
+    if n == 0:
+        return None
+    matrix = np.lib.format.open_memmap(os.path.join(tmp_dir, 'previous.npy'), mode='w+',
+                                       dtype=np.float32, shape=(n, dim))
+    keys = np.empty(n, dtype=np.uint64)
+    start = 0
+    # iter_embedding_blocks trả về từng row group, cùng thứ tự với read_row_group
+    for i, block in enumerate(iter_embedding_blocks(path)):
+        if block.shape[1] != dim:
+            print(f"⚠️ {path} không khớp metadata (dim {dim}), tạo lại toàn bộ")
+            return None
+        questions = source.read_row_group(i, columns=['question']).column(0).to_pylist()
+        matrix[start:start + len(block)] = block
+        keys[start:start + len(block)] = question_keys(model_name, questions)
+        start += len(block)
+    order = np.argsort(keys, kind='stable')
+    return PreviousEmbeddings(keys[order], order, matrix)
+
+class ChunkEncoder:
+    """Load model (và pool process khi workers > 1) ở lần encode đầu tiên, dùng lại cho mọi chunk"""
+
+    def __init__(self, model_name, batch_size=32, workers=1):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = workers
+        self.model = None
+        self.pool = None
+
+    def encode(self, questions):
+        if self.model is None:
+            print(f"🤖 Đang load model SentenceTransformers: {self.model_name}")
+            self.model = SentenceTransformer(self.model_name)
+            if self.workers > 1:
+                print(f"🧵 Encode song song trên {self.workers} process")
+                self.pool = self.model.start_multi_process_pool(target_devices=['cpu'] * self.workers)
+        # Pool chỉ đáng dùng khi chunk đủ lớn để chia cho các process
+        if self.pool is not None and len(questions) >= self.workers * self.batch_size:
+            vectors = self.model.encode_multi_process(questions, self.pool, batch_size=self.batch_size)
+        else:
+            vectors = self.model.encode(
+                questions,
+                show_progress_bar=False,
+                batch_size=self.batch_size,
+                convert_to_numpy=True
+            )
+        return np.asarray(vectors, dtype=np.float32)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def create_embeddings_with_sentence_transformers(records, output_path, model_name='all-MiniLM-L6-v2', dtype='float32',
+                                                 previous=None, info=None, chunk_size=10000, batch_size=32,
+                                                 workers=1, total=None):
     """
-    Tạo embeddings sử dụng SentenceTransformers
+    Tạo embeddings sử dụng SentenceTransformers, ghi parquet theo từng chunk
     Model options:
     - 'all-MiniLM-L6-v2': Nhẹ, nhanh, hiệu suất tốt (384 dimensions)
     - 'all-mpnet-base-v2': Hiệu suất cao hơn (768 dimensions)
     - 'paraphrase-multilingual-MiniLM-L12-v2': Hỗ trợ tiếng Việt tốt
+
+    previous: embedding đã có (load_previous_embeddings), chỉ encode phần còn thiếu.
+    dtype != 'float32': vector được chuẩn hoá L2 trước khi lượng tử hoá để các chiều có cùng thang đo;
+    int8 cần scale của cả file nên được ghi float32 trước rồi lượng tử hoá ở lượt thứ hai.
+    Trả về dict thống kê (rows, dim, reused, encoded, removed, examples).
     """
-    print(f"🤖 Đang load model SentenceTransformers: {model_name}")
-    
-    # Load model
-    model = SentenceTransformer(model_name)
-    
-    # Chuẩn bị dữ liệu
-    questions = []
-    answers = []
-    categories = []
-    tags = []
-    
-    for item in data:
-        questions.append(item['question'])
-        answers.append(item['answer'])
-        categories.append(item.get('category', 'general'))
-        tags.append(item.get('tags', []))
-    
-    print(f"📝 Đang tạo embeddings cho {len(questions)} câu hỏi...")
-    
-    # Tạo embeddings cho câu hỏi
-    question_embeddings = model.encode(
-        questions, 
-        show_progress_bar=True,
-        batch_size=32,
-        convert_to_numpy=True
-    )
-    
-    # Tạo DataFrame
-    df = pd.DataFrame({
-        'question': questions,
-        'answer': answers,
-        'category': categories,
-        'tags': tags,
-        'embedding': question_embeddings.tolist()
-    })
-    
-    print(f"✅ Đã tạo embeddings với shape: {question_embeddings.shape}")
-    return df, model
-
-def save_embeddings(df, output_path):
-    """Lưu embeddings vào file parquet"""
+    encoder = ChunkEncoder(model_name, batch_size=batch_size, workers=workers)
+    info = dict(info or {})
+    stats = {'rows': 0, 'dim': None, 'reused': 0, 'encoded': 0, 'removed': 0, 'examples': []}
+    seen_keys = []
+    write_path = f"{output_path}.float32.tmp" if dtype == 'int8' else output_path
+    writer = None
+    progress = tqdm(total=total, unit='câu hỏi')
     try:
-        df.to_parquet(output_path, index=False)
-        print(f"✅ Đã lưu embeddings vào {output_path}")
-        print(f"📊 Số dòng: {len(df)}")
-        print(f"🔢 Các cột: {list(df.columns)}")
-        return True
-    except Exception as e:
-        print(f"❌ Lỗi khi lưu file: {e}")
-        return False
+        for chunk in iter_chunks(records, chunk_size):
+            questions = [item['question'] for item in chunk]
+            keys = question_keys(model_name, questions)
+            seen_keys.append(keys)
+            found, rows = previous.lookup(keys) if previous is not None else (np.zeros(len(keys), dtype=bool), None)
+
+            missing = np.flatnonzero(~found)
+            encoded = None
+            if len(missing):
+                # Câu hỏi trùng nhau trong chunk chỉ encode một lần
+                unique_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+                encoded = encoder.encode([questions[i] for i in missing[first]])
+                stats['encoded'] += len(unique_keys)
+            dim = encoded.shape[1] if encoded is not None else previous.matrix.shape[1]
+            matrix = np.empty((len(chunk), dim), dtype=np.float32)
+            if found.any():
+                matrix[found] = previous.matrix[rows[found]]
+            if encoded is not None:
+                matrix[missing] = encoded[inverse]
+            stats['reused'] += int(found.sum())
+            if dtype != 'float32':
+                matrix = l2_normalize(matrix)
+
+            if writer is None:
+                stats['dim'] = info['dim'] = int(matrix.shape[1])
+                writer = EmbeddingParquetWriter(write_path, FAQ_FIELDS, stats['dim'],
+                                                dtype='float32' if dtype == 'int8' else dtype, info=info)
+            writer.write({name: [item[name] for item in chunk] for name, _ in FAQ_FIELDS}, matrix)
+            stats['rows'] += len(chunk)
+            if len(stats['examples']) < 3:
+                stats['examples'].extend(chunk[:3 - len(stats['examples'])])
+            progress.update(len(chunk))
+    finally:
+        progress.close()
+        encoder.close()
+        if writer is not None:
+            writer.close()
+
+    if writer is not None and dtype == 'int8':
+        requantize_embeddings_parquet(write_path, output_path, 'int8', info=info)
+        os.remove(write_path)
+    if previous is not None and len(previous):
+        current = np.unique(np.concatenate(seen_keys)) if seen_keys else np.empty(0, dtype=np.uint64)
+        stats['removed'] = int(len(np.setdiff1d(previous.keys, current)))
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Tạo embeddings cho faq_dataset.json')
+    parser.add_argument('--dtype', choices=['float32', 'float16', 'int8'],
+                        default=os.getenv('EMBEDDING_STORAGE_DTYPE', 'float32'),
+                        help='Kiểu lưu cột embedding trong parquet (mặc định float32)')
+    parser.add_argument('--model', default=DEFAULT_MODEL_NAME,
+                        help='Model SentenceTransformers (mặc định SENTENCE_MODEL_NAME hoặc '
+                             'paraphrase-multilingual-MiniLM-L12-v2, tốt cho tiếng Việt)')
+    parser.add_argument('--input', default='./faq_dataset.json',
+                        help='File FAQ: JSON (mảng) hoặc JSON Lines (.jsonl / .ndjson)')
+    parser.add_argument('--output', default='./english_qa_embeddings.parquet', help='File parquet đầu ra')
+    parser.add_argument('--full', action='store_true', help='Bỏ qua file cũ, encode lại toàn bộ')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Số process CPU để encode song song (dataset lớn)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Số câu hỏi mỗi chunk / row group (quyết định bộ nhớ đỉnh)')
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
     # Đường dẫn files
-    faq_file = './faq_dataset.json'
-    output_file = './english_qa_embeddings.parquet'
-    
+    faq_file = args.input
+    output_file = args.output
+
     # Kiểm tra file tồn tại
     if not os.path.exists(faq_file):
         print(f"❌ Không tìm thấy file {faq_file}")
         return
-    
-    # Load dữ liệu
-    faq_data = load_faq_data(faq_file)
-    if not faq_data:
+
+    # Lượt đọc đầu: kiểm tra dữ liệu, đếm câu hỏi và hash nội dung
+    try:
+        digest, total = source_hash(faq_file)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ Lỗi khi đọc file {faq_file}: {e}")
+        return
+    if not total:
+        print("❌ Dataset rỗng")
         return
-    
+    print(f"✅ Đã đọc {total} câu hỏi từ {faq_file}")
+
+    info = {'model': args.model, 'key': 'sha1(model + question)', 'source_hash': digest}
+    if not args.full and os.path.exists(output_file):
+        try:
+            previous_info = read_embedding_info(output_file)
+            unchanged = (previous_info is not None and previous_info.get('model') == args.model
+                         and previous_info.get('source_hash') == digest
+                         and embedding_storage_dtype(output_file) == args.dtype)
+        except Exception:
+            unchanged = False
+        if unchanged:
+            # Không ghi lại file: mtime đổi sẽ làm server dựng lại cache .npy và ANN index
+            print(f"✅ Không có thay đổi, giữ nguyên {output_file}")
+            return
+
     # Tạo embeddings
     try:
-        df, model = create_embeddings_with_sentence_transformers(
-            faq_data, 
-            model_name='paraphrase-multilingual-MiniLM-L12-v2'  # Tốt cho tiếng Việt
-        )
-        
-        # Lưu kết quả
-        if save_embeddings(df, output_file):
-            print(f"\n🎉 Hoàn thành! File đã được lưu tại: {output_file}")
-            print(f"📏 Embedding dimension: {len(df['embedding'].iloc[0])}")
-            print(f"🏷️ Categories: {df['category'].unique()}")
-            
-            # Hiển thị một vài ví dụ
-            print("\n📋 Một vài ví dụ:")
-            for i in range(min(3, len(df))):
-                print(f"  {i+1}. Q: {df['question'].iloc[i][:50]}...")
-                print(f"     A: {df['answer'].iloc[i][:50]}...")
-                print(f"     Category: {df['category'].iloc[i]}")
-                print()
-        
+        # File tạm cùng thư mục với output để os.replace là atomic: server đang chạy không đọc phải file ghi dở
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as tmp_dir:
+            previous = None if args.full else load_previous_embeddings(output_file, args.model, args.dtype, tmp_dir)
+            tmp_output = os.path.join(tmp_dir, 'embeddings.parquet')
+            stats = create_embeddings_with_sentence_transformers(
+                iter_faq_records(faq_file),
+                tmp_output,
+                model_name=args.model,
+                dtype=args.dtype,
+                previous=previous,
+                info=info,
+                chunk_size=args.chunk_size,
+                batch_size=args.batch_size,
+                workers=args.workers,
+                total=total
+            )
+            del previous  # Đóng memmap trước khi xoá thư mục tạm
+            os.replace(tmp_output, output_file)
+
+        print(f"♻️ Dùng lại {stats['reused']} embedding, 🆕 encode {stats['encoded']}, "
+              f"🗑️ bỏ {stats['removed']} câu hỏi đã xoá/sửa")
+        print(f"✅ Đã lưu embeddings ({args.dtype}) vào {output_file}")
+        print(f"💾 Kích thước file: {os.path.getsize(output_file) / 1024:.1f} KB")
+        print(f"📊 Số dòng: {stats['rows']}")
+        print(f"\n🎉 Hoàn thành! File đã được lưu tại: {output_file}")
+        print(f"📏 Embedding dimension: {stats['dim']}")
+
+        # Hiển thị một vài ví dụ
+        print("\n📋 Một vài ví dụ:")
+        for i, item in enumerate(stats['examples']):
+            print(f"  {i+1}. Q: {item['question'][:50]}...")
+            print(f"     A: {item['answer'][:50]}...")
+            print(f"     Category: {item['category']}")
+            print()
+
     except Exception as e:
         print(f"❌ Lỗi trong quá trình tạo embeddings: {e}")
 
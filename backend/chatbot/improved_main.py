@@ -1,21 +1,43 @@
 import os
-from fastapi import FastAPI, HTTPException, APIRouter, BackgroundTasks
+from fastapi import FastAPI, HTTPException, APIRouter, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from sentence_transformers import SentenceTransformer
 import google.generativeai as genai
-from typing import List, Optional
+from typing import Dict, List, Optional
 import logging
 from dotenv import load_dotenv
 import asyncio
+import contextvars
+import functools
 import time
 from datetime import datetime, timedelta
 import threading
-from contextlib import asynccontextmanager
-import re
+from contextlib import asynccontextmanager, contextmanager
+import json
+
+from caches import QueryEmbeddingCache, SemanticAnswerCache, normalize_question
+from corpus import Hit
+from index_snapshot import SnapshotRegistry
+from lesson_segments import LessonSegmentLog
+from lesson_sync import (LESSON_PROJECTION, PASSAGE_CONFIG, embed_changed_lessons, iter_changed_lesson_chunks,
+                         iter_lesson_docs, plan_lesson_sync)
+from lesson_watcher import SYNC_MODE, LessonChangeStreamWatcher
+from llm_client import LLMClient, create_backend
+from markdown_cleaner import StreamingMarkdownCleaner, clean_markdown_response
+from metrics import (ANSWERS, PROMPT_CONTEXT_TOKENS_HIST, REQUEST_SECONDS, SERVER_TIMING_ENABLED, SYNC_RUNS,
+                     SYNC_SECONDS, CallbackMetric,
+                     begin_request, record_stage, render as render_metrics, stage)
+from mmap_embeddings import load_faq_table
+from quantization import read_embedding_info
+from query_encoder import BatchingQueryEncoder
+from rerank import Reranker
+from prompt_context import assemble_context
+from shared_index import SHARED_INDEX, SHARED_INDEX_POLL_SECONDS, SharedIndexStore, SyncLeader
+from vector_store import VectorStore
 
 # Load environment variables từ .env file
 load_dotenv()
@@ -24,6 +46,8 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PROCESS_STARTED = time.perf_counter()
+
 # Load environment variables
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 if not GOOGLE_API_KEY:
@@ -34,17 +58,45 @@ else:
 
 # Models
 gemini_model = genai.GenerativeModel('models/gemini-2.0-flash')
+# Client chạy LLM trên executor riêng, giới hạn concurrency và gộp prompt trùng (LLM_BACKEND=fake để load-test)
+llm_client = LLMClient(create_backend(gemini_model=gemini_model))
+# Re-rank pool ứng viên (RERANK_MODE); bỏ qua khi số call LLM đang chạy cho thấy server đang tải cao
+reranker = Reranker(load=lambda: llm_client.active)
 sentence_model = None  # Sẽ được load sau
+SENTENCE_MODEL_NAME = os.getenv('SENTENCE_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+# STARTUP_MODE=fast: chỉ memory-map index lúc import, model + initial sync chạy nền,
+# load balancer chờ /health/ready thay vì chờ cả quá trình khởi động
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'eager').lower()
+startup_timings = {}  # phase -> giây, báo cáo trên /health
+model_loading = threading.Event()
+initial_sync_done = False
+faq_matrix = None  # Ma trận FAQ đã chuẩn hoá (memmap chỉ đọc, dùng chung giữa các worker)
 
 # Load dữ liệu embeddings
 parquet_path = './english_qa_embeddings.parquet'
 lessons_parquet = './english_lessons_embeddings.parquet'
-df = None
+# Base parquet + delta segments append-only, compact định kỳ (thay vì ghi lại cả file mỗi lần)
+lesson_log = LessonSegmentLog(lessons_parquet)
+# Snapshot hiện tại (vector store + df), writer dựng bản mới rồi publish bằng một atomic swap
+index_snapshots = SnapshotRegistry()
+sync_lock = threading.Lock()  # Single-flight: chỉ một sync chạy tại một thời điểm
+SYNC_SKIPPED = 'skipped'  # sync_courses_from_mongodb bị bỏ qua vì đã có sync khác đang chạy
+# SHARED_INDEX=true (start_server.py --workers N): các worker dùng chung index version trên đĩa
+# (memory-map), ghi dưới file lock, và chỉ sync leader chạy sync định kỳ / change stream
+shared_index = SharedIndexStore() if SHARED_INDEX else None
+sync_leader = SyncLeader() if SHARED_INDEX else None
+answer_cache = SemanticAnswerCache()  # Cache câu trả lời theo embedding, bị xoá khi corpus thay đổi
+# Cache embedding theo câu hỏi đã chuẩn hoá (câu hỏi lặp lại / suggestion được click lại),
+# bị xoá khi load model mới vì embedding cũ thuộc về model trước
+query_embedding_cache = QueryEmbeddingCache()
 
 # Auto sync configuration
 LAST_SYNC_TIME = None
 SYNC_INTERVAL_MINUTES = 30  # Sync every 30 minutes
 AUTO_SYNC_ENABLED = True
+# SYNC_MODE=change_stream: index lesson theo change stream, fallback polling nếu mongod standalone
+RESUME_TOKEN_PATH = './english_lessons_resume_token.json'
+change_stream_watcher = None
 
 # Mongo config for optional admin indexing (optional)
 try:
@@ -63,131 +115,361 @@ except Exception as mongo_error:
     MongoClient = None
     ObjectId = None
 
-def load_data():
-    global df, sentence_model
+@contextmanager
+def startup_phase(name: str):
+    """Đo thời gian một phase khởi động, ghi log và lưu vào startup_timings"""
+    started = time.perf_counter()
     try:
-        # Load FAQ embeddings
-        if os.path.exists(parquet_path):
-            df_faq = pd.read_parquet(parquet_path)
-            df_faq['source_type'] = 'faq'
-            logger.info(f"✅ Đã load {len(df_faq)} câu hỏi từ {parquet_path}")
-        else:
-            logger.warning(f"⚠️ Không tìm thấy file {parquet_path}. Vui lòng chạy create_embeddings_st.py trước.")
-            df_faq = pd.DataFrame()
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - started, 3)
+        logger.info(f"⏱️ Startup phase '{name}': {startup_timings[name]:.2f}s")
+
+
+def build_store(frame: pd.DataFrame) -> VectorStore:
+    """Dựng vector store từ bảng FAQ + lessons; bảng không được giữ lại sau khi dựng"""
+    try:
+        # Các dòng FAQ (luôn đứng đầu frame) lấy từ ma trận memmap, không parse lại cột embedding
+        store = VectorStore.from_dataframe(frame, prefix_matrix=faq_matrix)
+        # Index (flat/ivf/hnsw theo VECTOR_INDEX_BACKEND) chỉ phủ các dòng FAQ, lưu cạnh file parquet FAQ;
+        # cùng memmap FAQ với snapshot hiện tại thì dùng lại index đang có
+        if store.reuse_static_index(index_snapshots.current.store):
+            return store
+        return store.build_index(parquet_path)
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi dựng vector store: {e}")
+        return VectorStore.empty()
+
+
+def publish_snapshot(store: Optional[VectorStore] = None):
+    """Publish snapshot mới (không có store thì dựng lại từ FAQ parquet + lesson log). Caller giữ write_lock."""
+    if store is None:
+        store = build_store(load_corpus_frame())
+    snapshot = index_snapshots.publish(store)
+    # Corpus đã thay đổi nên các câu trả lời cache không còn đáng tin
+    answer_cache.invalidate()
+    return snapshot
+
+
+@contextmanager
+def index_writer():
+    """Vùng ghi index: write_lock trong process, và với SHARED_INDEX thêm file lock giữa các worker.
+    Trước khi ghi thì bắt kịp version mới nhất trên đĩa, ghi xong thì lưu snapshot thành version mới."""
+    with index_snapshots.write_lock:
+        if shared_index is None:
+            yield
+            return
+        with shared_index.write_lock():
+            adopt_shared_version()
+            before = index_snapshots.current
+            yield
+            if index_snapshots.current is not before:
+                try:
+                    shared_index.save(index_snapshots.current.store)
+                except Exception as e:
+                    logger.error(f"❌ Không ghi được shared index: {e}")
+
+
+def adopt_shared_version() -> bool:
+    """Memory-map version mới hơn trên đĩa (do worker khác publish). Caller giữ write_lock."""
+    global faq_matrix
+    if shared_index.current_version() <= shared_index.loaded_version:
+        return False
+    version, store = shared_index.load()
+    # Các dòng FAQ đứng đầu (phần tĩnh): giữ view vào memmap để dựng lại store khi cần
+    faq_matrix = store.static_matrix
+    publish_snapshot(store)
+    logger.info(f"🔁 Đã chuyển sang shared index v{version} ({len(store)} vectors)")
+    return True
+
+
+def shared_index_watch_task():
+    """SHARED_INDEX: poll manifest và chuyển sang version mới khi worker khác publish"""
+    while True:
+        time.sleep(SHARED_INDEX_POLL_SECONDS)
+        try:
+            if shared_index.current_version() > shared_index.loaded_version:
+                with index_snapshots.write_lock:
+                    adopt_shared_version()
+        except Exception as e:
+            logger.warning(f"⚠️ Không load được shared index: {e}")
+
+
+def refresh_vector_store():
+    """Dựng lại vector store từ dữ liệu trên đĩa (chỉ chạy khi load/sync/index, không chạy mỗi request)"""
+    with index_writer():
+        publish_snapshot()
+
+
+def load_faq_frame() -> pd.DataFrame:
+    """FAQ embeddings: metadata từ parquet, ma trận memory-map từ file .npy (gán vào faq_matrix)"""
+    global faq_matrix
+    if not os.path.exists(parquet_path):
+        logger.warning(f"⚠️ Không tìm thấy file {parquet_path}. Vui lòng chạy create_embeddings_st.py trước.")
+        faq_matrix = None
+        return pd.DataFrame()
+    df_faq, faq_matrix = load_faq_table(parquet_path)
+    df_faq['source_type'] = 'faq'
+    logger.info(f"✅ Đã load {len(df_faq)} câu hỏi từ {parquet_path}")
+    info = read_embedding_info(parquet_path)
+    if info is not None and info.get('model') != SENTENCE_MODEL_NAME:
+        logger.warning(f"⚠️ {parquet_path} được tạo bằng model {info.get('model')}, khác "
+                       f"SENTENCE_MODEL_NAME={SENTENCE_MODEL_NAME}; chạy lại create_embeddings_st.py")
+    return df_faq
+
+
+def load_lessons_frame() -> pd.DataFrame:
+    df_lessons = lesson_log.load()
+    if not df_lessons.empty:
+        df_lessons['source_type'] = 'lessons'
+        logger.info(f"✅ Đã load {len(df_lessons)} lesson embeddings từ {lessons_parquet}")
+    return df_lessons
+
+
+def concat_corpus(df_faq: pd.DataFrame, df_lessons: pd.DataFrame) -> pd.DataFrame:
+    """FAQ trước, lessons sau (FAQ đứng đầu để dùng lại ma trận memmap)"""
+    if not df_faq.empty and not df_lessons.empty:
+        return pd.concat([df_faq, df_lessons], ignore_index=True)
+    if not df_faq.empty:
+        return df_faq
+    return df_lessons
+
+
+def load_corpus_frame() -> pd.DataFrame:
+    return concat_corpus(load_faq_frame(), load_lessons_frame())
+
+
+def load_data(load_model: bool = True):
+    global sentence_model
+    try:
+        # Worker của deployment nhiều process: memory-map version mới nhất nếu đã có trên đĩa
+        if shared_index is not None and load_shared_index():
+            if load_model:
+                load_sentence_model()
+            return
+        
+        with startup_phase('faq_load'):
+            df_faq = load_faq_frame()
 
         # Load lesson embeddings if exist
-        if os.path.exists(lessons_parquet):
-            df_lessons = pd.read_parquet(lessons_parquet)
-            df_lessons['source_type'] = 'lessons'
-            logger.info(f"✅ Đã load {len(df_lessons)} lesson embeddings từ {lessons_parquet}")
-        else:
-            df_lessons = pd.DataFrame()
-
-        # Normalize/concat
-        if not df_faq.empty and not df_lessons.empty:
-            # Ensure both have common columns
-            df = pd.concat([df_faq, df_lessons], ignore_index=True)
-        elif not df_faq.empty:
-            df = df_faq.copy()
-        elif not df_lessons.empty:
-            df = df_lessons.copy()
-        else:
-            df = pd.DataFrame()
+        with startup_phase('lessons_load'):
+            df_lessons = load_lessons_frame()
 
-        # Load SentenceTransformer model
-        logger.info("🤖 Đang load SentenceTransformer model...")
-        sentence_model = SentenceTransformer(os.getenv('SENTENCE_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2'))
-        logger.info("✅ Đã load SentenceTransformer model")
+        # Bảng tạm chỉ dùng để dựng store, không giữ lại trong snapshot
+        with startup_phase('index_build'), index_snapshots.write_lock:
+            store = publish_snapshot(build_store(concat_corpus(df_faq, df_lessons))).store
+        del df_faq, df_lessons
+        logger.info(f"✅ Vector store: {len(store)} vectors, dim={store.dim}, index={store.index_name}, "
+                    f"metadata={store.metadata_nbytes / 1e6:.1f}MB")
+
+        if load_model:
+            load_sentence_model()
 
     except Exception as e:
         logger.error(f"❌ Lỗi khi load dữ liệu: {e}")
-        df = pd.DataFrame()
+        with index_snapshots.write_lock:
+            publish_snapshot(VectorStore.empty())
         sentence_model = None
 
 
+def load_shared_index() -> bool:
+    try:
+        with startup_phase('shared_index_load'), index_snapshots.write_lock:
+            return adopt_shared_version()
+    except Exception as e:
+        logger.warning(f"⚠️ Không load được shared index ({e}), load từ parquet")
+        return False
+
+
+def load_sentence_model():
+    """Load SentenceTransformer model (eager: lúc import, fast: trên thread nền)"""
+    global sentence_model
+    model_loading.set()
+    try:
+        logger.info("🤖 Đang load SentenceTransformer model...")
+        with startup_phase('model_load'):
+            model = SentenceTransformer(SENTENCE_MODEL_NAME)
+        sentence_model = model
+        query_embedding_cache.clear()
+        logger.info("✅ Đã load SentenceTransformer model")
+        if 'cross_encoder' in reranker.stages:
+            with startup_phase('rerank_model_load'):
+                reranker.load_cross_encoder()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi load SentenceTransformer model: {e}")
+    finally:
+        model_loading.clear()
+
+
+def is_ready() -> bool:
+    """Sẵn sàng nhận /ask: model đã load và index có dữ liệu"""
+    return sentence_model is not None and len(index_snapshots.current.store) > 0
+
+
+def mark_ready_if_needed():
+    if 'time_to_ready' not in startup_timings and is_ready():
+        startup_timings['time_to_ready'] = round(time.perf_counter() - PROCESS_STARTED, 3)
+        logger.info(f"✅ Ready sau {startup_timings['time_to_ready']:.2f}s kể từ lúc khởi động process")
+
+
+def run_initial_sync():
+    global initial_sync_done
+    try:
+        with startup_phase('initial_sync'):
+            sync_courses_from_mongodb()
+    except Exception as e:
+        logger.warning(f"Initial sync failed: {e}")
+    finally:
+        initial_sync_done = True
+
+
+def warm_up(initial_sync: bool):
+    """STARTUP_MODE=fast: load model rồi chạy initial sync trên thread nền"""
+    global initial_sync_done
+    if sentence_model is None:
+        load_sentence_model()
+    mark_ready_if_needed()
+    if initial_sync:
+        run_initial_sync()
+    else:
+        initial_sync_done = True
+
+
 async def retry_gemini_call(prompt: str, max_retries: int = 3, base_delay: float = 1.0) -> str:
-    """Retry Gemini API call with exponential backoff"""
-    for attempt in range(max_retries):
-        try:
-            response = gemini_model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            error_msg = str(e)
-            logger.warning(f"Gemini API attempt {attempt + 1} failed: {error_msg}")
-            
-            # Check if it's a quota error
-            if "429" in error_msg or "quota" in error_msg.lower():
-                if attempt < max_retries - 1:
-                    delay = base_delay * (2 ** attempt)  # Exponential backoff
-                    logger.info(f"Quota exceeded, waiting {delay} seconds before retry...")
-                    await asyncio.sleep(delay)
-                    continue
-                else:
-                    logger.error("Max retries reached for Gemini API")
-                    raise e
-            else:
-                # For non-quota errors, raise immediately
-                raise e
+    """Retry Gemini API call with exponential backoff (chạy ngoài event loop qua llm_client)"""
+    return await llm_client.generate(prompt, max_retries=max_retries, base_delay=base_delay)
+
+
+def current_lesson_state():
+    """({lesson_id: content_hash}, watermark) của snapshot hiện tại: view trên các cột của store"""
+    return index_snapshots.current.store.lesson_state()
+
+
+def passage_config_changed() -> bool:
+    """Lesson đã index với cấu hình chia passage khác PASSAGE_CONFIG: mọi hash lesson đều lệch nên phải
+    encode lại toàn bộ bằng full sync (ghi lại base), không upsert từng lesson vào delta log"""
+    if index_snapshots.current.store.lesson_count == 0:
+        return False
+    indexed = lesson_log.passage_config
+    if indexed == PASSAGE_CONFIG:
+        return False
+    logger.warning(f"⚠️ Cấu hình passage đổi ({indexed or 'không rõ'} -> {PASSAGE_CONFIG}): "
+                   f"encode lại toàn bộ lesson và ghi lại base")
+    return True
+
+
+def publish_lesson_store(store: Optional[VectorStore], compact: bool = False):
+    """Publish store đã áp dụng thay đổi lesson (bản sao, xem VectorStore.apply_lesson_changes); None thì dựng
+    lại từ đĩa. Compaction ghi base từ chính store theo từng block, không dựng cả bảng lesson.
+    Caller giữ write_lock và đã ghi các delta (trừ khi compact)."""
+    if store is not None and (compact or lesson_log.needs_compaction()):
+        lesson_log.compact(store.lesson_frames())
+    return publish_snapshot(store)
+
+
+def publish_lesson_changes(upserts: pd.DataFrame, deleted_ids):
+    """Ghi một batch upsert/xoá vào delta log, áp dụng lên bản sao của store rồi publish. Caller giữ write_lock."""
+    lesson_log.append(upserts, deleted_ids)
+    # Upsert/xoá trên bản sao của vector store (reader vẫn dùng bản cũ), các dòng khác giữ nguyên
+    try:
+        # Index của phần FAQ được dùng chung, không dựng / hash / lưu lại; lesson được quét flat
+        store = index_snapshots.current.store.copy().apply_lesson_changes(upserts, deleted_ids)
+    except Exception as e:
+        logger.warning(f"Failed to apply incremental changes to vector store, rebuilding: {e}")
+        store = None  # Lesson log đã có thay đổi nên dựng lại từ đĩa
+    new_snapshot = publish_lesson_store(store)
     
-    raise Exception("Max retries exceeded")
+    logger.info(f"✅ Lessons updated: {len(upserts)} upserted, {len(deleted_ids)} deleted, "
+                f"{new_snapshot.store.lesson_count} lessons total (index v{new_snapshot.version})")
+
+
+def apply_lesson_events(docs, deleted_ids):
+    """Callback của change stream watcher: áp dụng một batch insert/update/delete"""
+    global LAST_SYNC_TIME
+    if sentence_model is None:
+        raise RuntimeError('Sentence model not loaded')
+    started = time.perf_counter()
+    if passage_config_changed():
+        # Full sync cũng áp dụng luôn batch này; chưa chạy được thì watcher áp dụng lại batch sau
+        if sync_courses_from_mongodb(full=True) is not True:
+            raise RuntimeError('Full sync sau khi đổi cấu hình passage chưa chạy được')
+        return
+    with index_writer():
+        known, _ = current_lesson_state()
+        upserts = embed_changed_lessons(docs, known, sentence_model)
+        deleted_ids = {lid for lid in deleted_ids if lid in known}
+        if not upserts.empty or deleted_ids:
+            publish_lesson_changes(upserts, deleted_ids)
+    SYNC_SECONDS.observe(time.perf_counter() - started, mode='change_stream')
+    SYNC_RUNS.inc(mode='change_stream', result='ok')
+    LAST_SYNC_TIME = datetime.now()
+
+
+def sync_courses_from_mongodb(full: bool = False):
+    """Sync course data from MongoDB to local embeddings (incremental: chỉ encode lesson mới/thay đổi).
+    Single-flight: nếu đã có sync đang chạy thì bỏ qua lần gọi này và trả về SYNC_SKIPPED (khác True:
+    lần gọi này chưa sync gì, caller cần full resync phải thử lại)."""
+    mode = 'full' if full else 'incremental'
+    if not sync_lock.acquire(blocking=False):
+        logger.info("⏭️ Sync already running, skipping")
+        SYNC_RUNS.inc(mode=mode, result='skipped')
+        return SYNC_SKIPPED
+    started = time.perf_counter()
+    ok = False
+    try:
+        with index_writer():
+            ok = _sync_courses_from_mongodb(full)
+            return ok
+    finally:
+        sync_lock.release()
+        SYNC_SECONDS.observe(time.perf_counter() - started, mode=mode)
+        SYNC_RUNS.inc(mode=mode, result='ok' if ok else 'failed')
 
 
-def sync_courses_from_mongodb():
-    """Sync course data from MongoDB to local embeddings"""
-    global df, LAST_SYNC_TIME
+def _sync_courses_from_mongodb(full: bool = False):
+    global LAST_SYNC_TIME
     
     if lessons_coll is None:
         logger.warning("MongoDB not available for sync")
         return False
     
+    if sentence_model is None:
+        logger.warning("Sentence model not loaded, skip sync")
+        return False
+    
     try:
-        logger.info("🔄 Starting auto sync from MongoDB...")
+        full = full or passage_config_changed()
+        logger.info(f"🔄 Starting {'full' if full else 'incremental'} sync from MongoDB...")
         
-        # Get all lessons from MongoDB
-        cursor = lessons_coll.find({})
-        lessons = list(cursor)
+        known, watermark = current_lesson_state()
+        query, deleted_ids = plan_lesson_sync(lessons_coll, known, watermark, full=full)
         
-        if not lessons:
-            logger.info("No lessons found in MongoDB")
-            return True
+        # Streaming: cursor -> chunk text -> encode theo batch -> ghi delta segment và áp dụng lên bản sao
+        # của store từng chunk, nên bộ nhớ tạm chỉ là một chunk dù collection lớn cỡ nào (full sync không
+        # ghi delta: base được ghi lại từ store lúc publish)
+        store = index_snapshots.current.store.copy()
+        lessons = passages = 0
+        started = time.perf_counter()
+        if deleted_ids:
+            if not full:
+                lesson_log.append(None, deleted_ids)
+            store = store.apply_lesson_changes(None, deleted_ids)
+        for chunk in iter_changed_lesson_chunks(iter_lesson_docs(lessons_coll, query), known, sentence_model):
+            if not full:
+                lesson_log.append(chunk, ())
+            store = store.apply_lesson_changes(chunk, ())
+            lessons += chunk['lesson_id'].nunique()
+            passages += len(chunk)
+            logger.info(f"🔄 Embedded {lessons} lessons ({passages} passages)...")
         
-        logger.info(f"Found {len(lessons)} lessons in MongoDB")
-        
-        # Process lessons and create embeddings
-        new_rows = []
-        for lesson in lessons:
-            try:
-                text = build_text_for_embedding(lesson)
-                if sentence_model:
-                    embedding = sentence_model.encode([text])[0].astype(np.float32)
-                    
-                    new_row = {
-                        'question': text,
-                        'answer': (lesson.get('content') or lesson.get('description') or lesson.get('explanation') or '')[:2000],
-                        'category': lesson.get('category', 'lessons'),
-                        'embedding': embedding.tolist(),
-                        'meta': {'lesson_id': str(lesson.get('_id')), 'title': lesson.get('title'), 'source': 'lessons'},
-                        'source_type': 'lessons'
-                    }
-                    new_rows.append(new_row)
-            except Exception as e:
-                logger.warning(f"Failed to process lesson {lesson.get('_id')}: {e}")
-                continue
-        
-        if new_rows:
-            # Save to parquet
-            df_new_lessons = pd.DataFrame(new_rows)
-            df_new_lessons.to_parquet(lessons_parquet, index=False)
-            
-            # Update in-memory df
-            if df is None or df.empty:
-                df = df_new_lessons.copy()
-            else:
-                # Remove old lessons and add new ones
-                df_filtered = df[df['source_type'] != 'lessons']
-                df = pd.concat([df_filtered, df_new_lessons], ignore_index=True)
-            
-            logger.info(f"✅ Synced {len(new_rows)} lessons from MongoDB")
+        if not lessons and not deleted_ids:
+            logger.info("✅ Lessons are up to date, nothing to re-embed")
+        else:
+            elapsed = time.perf_counter() - started
+            logger.info(f"⏱️ Embedded {lessons} lessons in {elapsed:.2f}s ({lessons / max(elapsed, 1e-6):.1f} lessons/s)")
+            snapshot = publish_lesson_store(store, compact=full)
+            logger.info(f"✅ Lessons updated: {lessons} upserted, {len(deleted_ids)} deleted, "
+                        f"{snapshot.store.lesson_count} lessons total (index v{snapshot.version})")
         
         LAST_SYNC_TIME = datetime.now()
         return True
@@ -199,6 +481,12 @@ def sync_courses_from_mongodb():
 
 def should_sync() -> bool:
     """Check if it's time to sync"""
+    # Change stream đang chạy thì không cần polling
+    if change_stream_watcher is not None and change_stream_watcher.active:
+        return False
+    # Nhiều worker: chỉ sync leader sync định kỳ (worker khác lên thay khi leader chết)
+    if sync_leader is not None and not sync_leader.try_acquire():
+        return False
     if not AUTO_SYNC_ENABLED or LAST_SYNC_TIME is None:
         return True
     
@@ -218,120 +506,91 @@ def background_sync_task():
             time.sleep(300)  # Wait 5 minutes on error
 
 
-def build_text_for_embedding(lesson):
-    title = lesson.get('title') or lesson.get('name') or ''
-    topics = lesson.get('topics', [])
-    if isinstance(topics, list):
-        topics_text = ', '.join([str(t) for t in topics])
-    else:
-        topics_text = str(topics)
-    content = lesson.get('content', '') or lesson.get('description', '') or lesson.get('explanation', '')
-    content_snip = content[:2000]
-    text = f"Title: {title}\nTopics: {topics_text}\nContent: {content_snip}"
-    return text
-
-
 # Admin router for indexing
 admin_router = APIRouter(prefix='/admin')
 
 
-def clean_markdown_response(text):
-    """Clean up excessive markdown formatting from AI responses"""
-    if not text:
-        return text
-    
-    # Remove excessive bold formatting (more than 2 consecutive **)
-    text = re.sub(r'\*{3,}', '', text)
-    
-    # Convert proper bold (**text**) to normal text for cleaner display
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    
-    # Remove excessive asterisks at line beginnings
-    text = re.sub(r'^\*\s+', '', text, flags=re.MULTILINE)
-    
-    # Clean up multiple consecutive asterisks (but keep single ones for emphasis)
-    text = re.sub(r'\*{2,}', '', text)
-    
-    # Fix spacing around punctuation
-    text = re.sub(r'\s+([.,!?])', r'\1', text)
-    
-    # Remove excessive newlines
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    
-    # Clean up bullet points with excessive asterisks
-    text = re.sub(r'^\*{2,}\s+', '• ', text, flags=re.MULTILINE)
-    
-    # Remove other markdown formatting
-    text = re.sub(r'__(.*?)__', r'\1', text)
-    text = re.sub(r'_(.*?)_', r'\1', text)
-    text = re.sub(r'`(.*?)`', r'\1', text)
-    text = re.sub(r'~~(.*?)~~', r'\1', text)
-    
-    return text.strip()
+def _lesson_id_candidates(lesson_ids):
+    """Mỗi id thử cả dạng ObjectId lẫn chuỗi gốc"""
+    candidates = []
+    for lesson_id in lesson_ids:
+        candidates.append(lesson_id)
+        if ObjectId is not None:
+            try:
+                candidates.append(ObjectId(lesson_id))
+            except Exception:
+                pass
+    return candidates
+
+
+def index_lessons_by_id(lesson_ids):
+    """Upsert các lesson theo id: một query $in, encode một batch, ghi một delta segment"""
+    docs = list(lessons_coll.find({'_id': {'$in': _lesson_id_candidates(lesson_ids)}}, LESSON_PROJECTION))
+    found = {str(doc.get('_id')) for doc in docs}
+    # Đổi cấu hình passage: encode lại toàn bộ qua full sync, các lesson yêu cầu nằm trong đó
+    rebuilt = passage_config_changed() and sync_courses_from_mongodb(full=True) is True
+
+    with index_writer():
+        known, _ = current_lesson_state()
+        upserts = embed_changed_lessons(docs, known, sentence_model)
+        if not upserts.empty:
+            publish_lesson_changes(upserts, set())
+
+    indexed = set(upserts['lesson_id']) if not upserts.empty else set()
+    if rebuilt:
+        indexed |= found
+    return {
+        'indexed': [lid for lid in lesson_ids if lid in indexed],
+        'unchanged': [lid for lid in lesson_ids if lid in found and lid not in indexed],
+        'not_found': [lid for lid in lesson_ids if lid not in found],
+    }
+
+
+def _check_index_ready():
+    if lessons_coll is None:
+        raise HTTPException(status_code=503, detail='MongoDB not available')
+    if sentence_model is None:
+        raise HTTPException(status_code=500, detail='Sentence model not loaded')
 
 
 @admin_router.post('/index_lesson')
 async def index_lesson(payload: dict):
-    """Index a single lesson from MongoDB into the lesson parquet and update in-memory df.
+    """Index (upsert) a single lesson from MongoDB into the lesson store and update in-memory index.
     payload expects: { 'lesson_id': '<id string>' }
     """
-    if lessons_coll is None:
-        raise HTTPException(status_code=503, detail='MongoDB not available')
-    
     lesson_id = payload.get('lesson_id')
     if not lesson_id:
         raise HTTPException(status_code=400, detail='lesson_id required')
+    _check_index_ready()
 
-    # try to convert to ObjectId
     try:
-        oid = ObjectId(lesson_id)
-    except Exception:
-        # use as string id
-        oid = lesson_id
+        result = await asyncio.get_running_loop().run_in_executor(None, index_lessons_by_id, [str(lesson_id)])
+    except Exception as e:
+        logger.error(f'Failed to index lesson {lesson_id}: {e}')
+        raise HTTPException(status_code=500, detail='Failed to save lesson embedding')
 
-    doc = lessons_coll.find_one({'_id': oid}) if isinstance(oid, ObjectId) else lessons_coll.find_one({'_id': lesson_id})
-    if not doc:
+    if result['not_found']:
         raise HTTPException(status_code=404, detail='Lesson not found in MongoDB')
+    return {'ok': True, 'lesson_id': str(lesson_id), 'unchanged': bool(result['unchanged'])}
 
-    # Build text and create embedding
-    if sentence_model is None:
-        raise HTTPException(status_code=500, detail='Sentence model not loaded')
-
-    text = build_text_for_embedding(doc)
-    embedding = sentence_model.encode([text])[0].astype(np.float32)
-
-    new_row = {
-        'question': text,
-        'answer': (doc.get('content') or doc.get('description') or doc.get('explanation') or '')[:2000],
-        'category': doc.get('category', 'lessons'),
-        'embedding': embedding.tolist(),
-        'meta': {'lesson_id': str(doc.get('_id')), 'title': doc.get('title'), 'source': 'lessons'},
-        'source_type': 'lessons'
-    }
 
-    # Append to lessons_parquet
-    try:
-        if os.path.exists(lessons_parquet):
-            df_existing = pd.read_parquet(lessons_parquet)
-            df_new = pd.concat([df_existing, pd.DataFrame([new_row])], ignore_index=True)
-        else:
-            df_new = pd.DataFrame([new_row])
-        df_new.to_parquet(lessons_parquet, index=False)
-    except Exception as e:
-        logger.error(f'Failed to append lesson parquet: {e}')
-        raise HTTPException(status_code=500, detail='Failed to save lesson embedding')
+@admin_router.post('/index_lessons')
+async def index_lessons(payload: dict):
+    """Bulk index nhiều lesson trong một batch embedding.
+    payload expects: { 'lesson_ids': ['<id string>', ...] }
+    """
+    lesson_ids = payload.get('lesson_ids')
+    if not isinstance(lesson_ids, list) or not lesson_ids:
+        raise HTTPException(status_code=400, detail='lesson_ids (non-empty list) required')
+    _check_index_ready()
 
-    # Update in-memory df
-    global df
+    lesson_ids = list(dict.fromkeys(str(lid) for lid in lesson_ids))
     try:
-        if df is None or df.empty:
-            df = pd.DataFrame([new_row])
-        else:
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+        result = await asyncio.get_running_loop().run_in_executor(None, index_lessons_by_id, lesson_ids)
     except Exception as e:
-        logger.warning(f'Failed to update in-memory df: {e}')
-
-    return {'ok': True, 'lesson_id': str(doc.get('_id'))}
+        logger.error(f'Failed to bulk index lessons: {e}')
+        raise HTTPException(status_code=500, detail='Failed to save lesson embeddings')
+    return {'ok': True, **result}
 
 
 @asynccontextmanager
@@ -339,22 +598,50 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("🚀 Starting English Learning RAG Chatbot...")
     
-    # Start background sync task
-    if AUTO_SYNC_ENABLED and lessons_coll is not None:
+    global change_stream_watcher, initial_sync_done
+    initial_sync = False
+    is_leader = sync_leader is None or sync_leader.try_acquire()
+    if shared_index is not None:
+        threading.Thread(target=shared_index_watch_task, daemon=True).start()
+        logger.info(f"🔗 Shared index mode (pid {os.getpid()}, {'sync leader' if is_leader else 'follower'})")
+    
+    # Change stream mode: resume từ token trên đĩa nếu có, không cần initial sync
+    if AUTO_SYNC_ENABLED and lessons_coll is not None and SYNC_MODE == 'change_stream' and is_leader:
+        watcher = LessonChangeStreamWatcher(
+            lessons_coll,
+            on_changes=apply_lesson_events,
+            on_resync=lambda: sync_courses_from_mongodb(full=True),
+            token_path=RESUME_TOKEN_PATH
+        )
+        if watcher.start():
+            change_stream_watcher = watcher
+            initial_sync = not watcher.resumed
+    
+    # Start background sync task (polling, hoặc fallback khi change stream không khả dụng)
+    if AUTO_SYNC_ENABLED and lessons_coll is not None and change_stream_watcher is None:
         sync_thread = threading.Thread(target=background_sync_task, daemon=True)
         sync_thread.start()
         logger.info("🔄 Background sync task started")
-        
-        # Initial sync
-        try:
-            sync_courses_from_mongodb()
-        except Exception as e:
-            logger.warning(f"Initial sync failed: {e}")
+        initial_sync = is_leader
+    
+    if STARTUP_MODE == 'fast':
+        # Nhận traffic ngay; /health/ready báo 503 cho tới khi model load xong
+        threading.Thread(target=warm_up, args=(initial_sync,), daemon=True).start()
+    else:
+        if initial_sync:
+            run_initial_sync()
+        initial_sync_done = True
+        mark_ready_if_needed()
     
     yield
     
     # Shutdown
     logger.info("👋 Shutting down English Learning RAG Chatbot...")
+    if change_stream_watcher is not None:
+        change_stream_watcher.stop()
+    if sync_leader is not None:
+        sync_leader.release()
+    await query_encoder.stop()
 
 
 app = FastAPI(
@@ -374,14 +661,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """Đo thời gian request theo route; các stage (with stage(...)) ghi vào timings của request này"""
+    timings = begin_request()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(timings.elapsed(), route=getattr(route, "path", "unmatched"),
+                            status=response.status_code)
+    if SERVER_TIMING_ENABLED and timings.stages:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
 # Register admin router
 app.include_router(admin_router)
 
 # Load dữ liệu khi khởi động
-load_data()
+load_data(load_model=STARTUP_MODE != 'fast')
+
+# Encoder gom batch các câu hỏi đồng thời, encode trên worker thread thay vì event loop
+query_encoder = BatchingQueryEncoder(lambda: sentence_model)
+
+# /metrics: các bộ đếm đã có sẵn được đọc lúc render
+CallbackMetric('chatbot_cache_events_total', 'Lượt tra cache theo kết quả (hit, miss)', 'counter',
+               lambda: {(name, result): cache.stats()[key]
+                        for name, cache in (('answer', answer_cache), ('query_embedding', query_embedding_cache))
+                        for result, key in (('hit', 'hits'), ('miss', 'misses'))}, labels=('cache', 'result'))
+CallbackMetric('chatbot_llm_upstream_calls_total', 'Số call thật tới LLM backend (sau khi gộp prompt trùng)',
+               'counter', lambda: llm_client.upstream_calls)
+CallbackMetric('chatbot_llm_coalesced_total', 'Số request dùng chung call LLM đang chạy', 'counter',
+               lambda: llm_client.coalesced)
+CallbackMetric('chatbot_llm_active', 'Số call LLM đang chạy', 'gauge', lambda: llm_client.active)
+CallbackMetric('chatbot_query_encoder_batches_total', 'Số batch encode câu hỏi', 'counter',
+               lambda: query_encoder.batches)
+CallbackMetric('chatbot_index_rows', 'Số dòng trong index hiện tại theo source_type', 'gauge',
+               lambda: {name: len(rows) for name, rows in index_snapshots.current.store.partitions['source_type'].items()},
+               labels=('source_type',))
+CallbackMetric('chatbot_index_version', 'Version của snapshot index hiện tại', 'gauge',
+               lambda: index_snapshots.current.version)
+CallbackMetric('chatbot_ready', '1 khi model và index đã sẵn sàng', 'gauge', lambda: int(is_ready()))
+
+
+async def encode_question(question: str) -> np.ndarray:
+    """Lấy embedding câu hỏi: tra cache trước, chỉ encode khi cache miss"""
+    embedding = query_embedding_cache.get(question)
+    if embedding is None:
+        with stage('encode'):
+            embedding = await query_encoder.encode(question)
+        query_embedding_cache.put(question, embedding)
+    return embedding
 
 class Question(BaseModel):
     question: str
+    # Giới hạn retrieval trong một partition, vd. trang khoá học chỉ dùng lesson của khoá đó
+    category: Optional[str] = None
+    source_type: Optional[str] = None
 
 class ChatResponse(BaseModel):
     llm_answers: str
@@ -390,101 +726,74 @@ class ChatResponse(BaseModel):
     score: Optional[float] = None
     similar_questions: Optional[List[dict]] = []
 
-def search_similar_embeddings(query_embedding: np.ndarray, df: pd.DataFrame, top_k: int = 5, threshold: float = 0.3) -> pd.DataFrame:
-    """Tìm kiếm câu hỏi tương đồng sử dụng cosine similarity"""
-    if df.empty:
-        return pd.DataFrame()
+class QuestionBatch(BaseModel):
+    questions: List[str]
+    category: Optional[str] = None
+    source_type: Optional[str] = None
+
+class BatchAnswer(ChatResponse):
+    index: int
+    question: str
+
+def search_similar_embeddings(query_embedding: np.ndarray, store: VectorStore, top_k: int = 5, threshold: float = 0.3,
+                              question: Optional[str] = None, category: Optional[str] = None,
+                              source_type: Optional[str] = None) -> List[Hit]:
+    """Tìm kiếm câu hỏi tương đồng: cosine similarity trên vector store đã chuẩn hoá, gộp với BM25
+    trên question/answer/tags khi có `question` (RETRIEVAL_MODE=hybrid); `category` / `source_type`
+    chỉ tìm trong partition tương ứng. Mỗi lesson chỉ giữ passage khớp nhất; với RERANK_MODE, top-k được
+    chọn lại từ một pool lớn hơn (xem rerank). Chỉ các dòng top-k được materialize (Hit)."""
+    if store is None or len(store) == 0:
+        return []
     
     try:
-        query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
-        embedding_matrix = np.array(df['embedding'].tolist(), dtype=np.float32)
-        
-        similarities = cosine_similarity(query_vector, embedding_matrix)[0]
-        
-        # Gán similarity vào DataFrame
-        df_with_similarity = df.copy()
-        df_with_similarity['similarity'] = similarities
-        
-        # Lọc theo ngưỡng và sắp xếp
-        result = (
-            df_with_similarity[df_with_similarity['similarity'] >= threshold]
-            .sort_values(by='similarity', ascending=False)
-            .head(top_k)
-        )
-        
-        return result[['question', 'answer', 'category', 'similarity']]
+        pool = reranker.pool_size(top_k)
+        with stage('search'):
+            indices, scores = store.search(query_embedding, top_k=store.fetch_k(pool), threshold=threshold,
+                                           text=question, category=category, source_type=source_type)
+            indices, scores = store.collapse_passages(indices, scores, pool)
+        if reranker.enabled:
+            with stage('rerank'):
+                indices, scores = reranker.rerank(store, query_embedding, indices, scores, top_k, text=question)
+        return store.hits(indices, scores) if len(indices) else []
     
     except Exception as e:
         logger.error(f"Lỗi trong search_similar_embeddings: {e}")
-        return pd.DataFrame()
+        return []
 
-@app.post("/ask", response_model=ChatResponse)
-async def receive_question(data: Question, background_tasks: BackgroundTasks):
-    """API endpoint để xử lý câu hỏi từ chatbot"""
-    try:
-        question = data.question.strip()
-        
-        if not question:
-            raise HTTPException(status_code=400, detail="Câu hỏi không được để trống")
-        
-        logger.info(f"📝 Nhận câu hỏi: {question}")
-        
-        # Trigger sync if needed (non-blocking)
-        if should_sync():
-            background_tasks.add_task(sync_courses_from_mongodb)
-        
-        # Kiểm tra model và dữ liệu
-        if sentence_model is None or df.empty:
-            return ChatResponse(
-                llm_answers="Xin lỗi, hệ thống đang gặp sự cố. Vui lòng thử lại sau! 😅",
-                source="error",
-                suggestions=["Thử lại", "Hỏi câu khác"]
-            )
-        
-        # Tạo embedding cho câu hỏi
-        question_embedding = sentence_model.encode([question])[0]
+def build_retrieval_context(retrieval_docs: List[Hit]):
+    """Từ kết quả retrieval: (document cho prompt, suggestions, similar_questions, max_similarity).
+    Document được giới hạn theo ngân sách token prompt_context.PROMPT_CONTEXT_TOKENS."""
+    document, context_tokens = assemble_context(retrieval_docs)
+    PROMPT_CONTEXT_TOKENS_HIST.observe(context_tokens)
+    if retrieval_docs:
+        # Tạo suggestions từ các câu hỏi tương đồng
+        suggestions = [
+            hit.label[:50] + "..." if len(hit.label) > 50 else hit.label
+            for hit in retrieval_docs[:3]
+        ]
         
-        # Tìm kiếm câu hỏi tương đồng
-        retrieval_docs = search_similar_embeddings(
-            query_embedding=question_embedding, 
-            df=df, 
-            top_k=5, 
-            threshold=0.3
-        )
+        similar_questions = [
+            {
+                "question": hit.label,
+                "answer": hit.answer[:100] + "..." if len(hit.answer) > 100 else hit.answer,
+                "similarity": hit.similarity,
+                "category": hit.category
+            }
+            for hit in retrieval_docs[:3]
+        ]
         
-        # Tạo context từ các câu hỏi tương đồng
-        if not retrieval_docs.empty:
-            document = "\n\n".join(
-                f"Câu hỏi: {row['question']}\nTrả lời: {row['answer']}\nDanh mục: {row['category']}"
-                for _, row in retrieval_docs.iterrows()
-            )
-            
-            # Tạo suggestions từ các câu hỏi tương đồng
-            suggestions = [
-                row['question'][:50] + "..." if len(row['question']) > 50 else row['question']
-                for _, row in retrieval_docs.head(3).iterrows()
-            ]
-            
-            similar_questions = [
-                {
-                    "question": row['question'],
-                    "answer": row['answer'][:100] + "..." if len(row['answer']) > 100 else row['answer'],
-                    "similarity": float(row['similarity']),
-                    "category": row['category']
-                }
-                for _, row in retrieval_docs.head(3).iterrows()
-            ]
-            
-            max_similarity = float(retrieval_docs['similarity'].max())
-            
-        else:
-            document = "Không tìm thấy thông tin liên quan trong cơ sở dữ liệu."
-            suggestions = ["Ngữ pháp cơ bản", "Từ vựng thông dụng", "Phát âm tiếng Anh"]
-            similar_questions = []
-            max_similarity = 0.0
+        max_similarity = max(hit.similarity for hit in retrieval_docs)
         
-        # Tạo prompt cho Gemini
-        prompt = f"""
+    else:
+        suggestions = ["Ngữ pháp cơ bản", "Từ vựng thông dụng", "Phát âm tiếng Anh"]
+        similar_questions = []
+        max_similarity = 0.0
+    return document, suggestions, similar_questions, max_similarity
+
+
+def build_prompt(question: str, document: str) -> str:
+    """Prompt cho Gemini"""
+    return f"""
 Bạn là English AI Assistant - một trợ lý ảo chuyên về học tiếng Anh. 
 Hãy trả lời câu hỏi của người dùng một cách thân thiện, hữu ích và chính xác.
 
@@ -509,29 +818,22 @@ Thông tin tham khảo:
 
 Hãy trả lời một cách ngắn gọn, dễ hiểu và hữu ích cho việc học tiếng Anh.
 """
-        
-        # Gọi Gemini API với retry logic
-        try:
-            raw_answer = await retry_gemini_call(prompt, max_retries=3, base_delay=2.0)
-            # Clean up markdown formatting
-            answer = clean_markdown_response(raw_answer)
-            source = "rag" if not retrieval_docs.empty else "general"
-            
-        except Exception as gemini_error:
-            logger.error(f"Lỗi Gemini API: {gemini_error}")
-            # Enhanced fallback response
-            if not retrieval_docs.empty:
-                # Use the best matching answer from RAG
-                best_match = retrieval_docs.iloc[0]
-                answer = f"""Dựa trên thông tin tôi có về "{best_match['category']}":
 
-{best_match['answer']}
+
+def fallback_answer(retrieval_docs: List[Hit]):
+    """Câu trả lời dự phòng khi LLM không khả dụng: (answer, source)"""
+    if retrieval_docs:
+        # Use the best matching answer from RAG
+        best_match = retrieval_docs[0]
+        answer = f"""Dựa trên thông tin tôi có về "{best_match.category}":
+
+{best_match.answer}
 
 💡 Lưu ý: Đây là câu trả lời từ cơ sở dữ liệu do hệ thống AI tạm thời không khả dụng."""
-                source = "fallback_rag"
-            else:
-                # Generic helpful response when no RAG data available
-                answer = """Xin lỗi, hệ thống AI tạm thời không khả dụng. 
+        source = "fallback_rag"
+    else:
+        # Generic helpful response when no RAG data available
+        answer = """Xin lỗi, hệ thống AI tạm thời không khả dụng. 
 
 Tuy nhiên, tôi có thể gợi ý một số chủ đề học tiếng Anh phổ biến:
 • Ngữ pháp cơ bản (Basic Grammar)
@@ -540,17 +842,165 @@ Tuy nhiên, tôi có thể gợi ý một số chủ đề học tiếng Anh ph
 • Giao tiếp cơ bản (Basic Communication)
 
 Vui lòng thử lại sau hoặc hỏi về các chủ đề cụ thể! 😊"""
-                source = "fallback_general"
+        source = "fallback_general"
+    return answer, source
+
+
+def accept_question(data: Question, background_tasks: BackgroundTasks):
+    """Validate câu hỏi, trigger sync nền nếu cần; trả về (question, snapshot) cho request"""
+    question = data.question.strip()
+    
+    if not question:
+        raise HTTPException(status_code=400, detail="Câu hỏi không được để trống")
+    
+    logger.info(f"📝 Nhận câu hỏi: {question}")
+    if data.category is not None or data.source_type is not None:
+        logger.info(f"🔎 Filter: category={data.category}, source_type={data.source_type}")
+    
+    # Trigger sync if needed (non-blocking)
+    if should_sync():
+        background_tasks.add_task(sync_courses_from_mongodb)
+    
+    # Đọc snapshot một lần: cả request dùng cùng một phiên bản ma trận + metadata
+    snapshot = index_snapshots.current
+    
+    # Model vẫn đang load nền (STARTUP_MODE=fast)
+    if sentence_model is None and model_loading.is_set():
+        raise HTTPException(status_code=503, detail="Hệ thống đang khởi động, vui lòng thử lại sau giây lát",
+                            headers={"Retry-After": "5"})
+    return question, snapshot
+
+
+async def retrieve(question: str, store: VectorStore, category: Optional[str] = None,
+                   source_type: Optional[str] = None):
+    """Embedding câu hỏi + top-k tài liệu tương đồng; trả về (embedding, retrieval_docs, context_key)"""
+    # Tạo embedding cho câu hỏi
+    question_embedding = await encode_question(question)
+    
+    # Tìm kiếm câu hỏi tương đồng
+    search = functools.partial(
+        search_similar_embeddings,
+        query_embedding=question_embedding, 
+        store=store, 
+        top_k=5, 
+        threshold=0.3,
+        question=question,
+        category=category,
+        source_type=source_type
+    )
+    if reranker.enabled:
+        # Re-rank (cross-encoder / MMR) chạy cùng search trên thread pool, không chặn event loop;
+        # copy context để stage() vẫn ghi vào Server-Timing của request
+        retrieval_docs = await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, search)
+    else:
+        retrieval_docs = search()
+    # Khoá answer cache: cùng tập context
+    context_key = tuple(hit.question for hit in retrieval_docs)
+    return question_embedding, retrieval_docs, context_key
+
+
+async def answer_question(question: str, question_embedding: np.ndarray, retrieval_docs: List[Hit],
+                          context_key) -> ChatResponse:
+    """Answer cache -> prompt -> LLM (fallback nếu lỗi) cho một câu hỏi đã retrieval"""
+    # Answer cache: câu hỏi gần giống + cùng tập context -> trả lời ngay, không gọi Gemini
+    cached = answer_cache.get(question_embedding, context_key)
+    if cached is not None:
+        logger.info("⚡ Trả lời từ answer cache")
+        ANSWERS.inc(source="cache")
+        return ChatResponse(**cached)
+    
+    with stage('prompt'):
+        document, suggestions, similar_questions, max_similarity = build_retrieval_context(retrieval_docs)
+        prompt = build_prompt(question, document)
+    
+    # Gọi Gemini API với retry logic
+    try:
+        with stage('llm'):
+            raw_answer = await retry_gemini_call(prompt, max_retries=3, base_delay=2.0)
+        # Clean up markdown formatting
+        with stage('postprocess'):
+            answer = clean_markdown_response(raw_answer)
+        source = "rag" if retrieval_docs else "general"
+        
+    except Exception as gemini_error:
+        logger.error(f"Lỗi Gemini API: {gemini_error}")
+        answer, source = fallback_answer(retrieval_docs)
+    ANSWERS.inc(source=source)
+    
+    logger.info(f"✅ Trả lời thành công với similarity: {max_similarity:.3f}")
+    
+    response = ChatResponse(
+        llm_answers=answer,
+        suggestions=suggestions,
+        source=source,
+        score=max_similarity,
+        similar_questions=similar_questions
+    )
+    # Chỉ cache câu trả lời thật từ LLM, không cache fallback
+    if source in ("rag", "general"):
+        answer_cache.put(question_embedding, context_key, response.model_dump())
+    return response
+
+
+async def retrieve_many(questions: List[str], store: VectorStore, category: Optional[str] = None,
+                        source_type: Optional[str] = None) -> list:
+    """retrieve() cho cả batch: một lần encode các câu chưa có trong cache, một phép nhân (Q, d) x (d, N)"""
+    embeddings: List[Optional[np.ndarray]] = [query_embedding_cache.get(q) for q in questions]
+    missing = [i for i, e in enumerate(embeddings) if e is None]
+    if missing:
+        with stage('encode'):
+            encoded = await query_encoder.encode_many([questions[i] for i in missing])
+        for i, embedding in zip(missing, encoded):
+            query_embedding_cache.put(questions[i], embedding)
+            embeddings[i] = embedding
+
+    matrix = np.stack(embeddings)
+    pool = reranker.pool_size(5)
+
+    def search_and_rerank():
+        with stage('search'):
+            results = store.search_batch(matrix, top_k=store.fetch_k(pool), threshold=0.3, texts=questions,
+                                         category=category, source_type=source_type)
+        ranked = []
+        for question, embedding, (indices, scores) in zip(questions, embeddings, results):
+            indices, scores = store.collapse_passages(indices, scores, pool)
+            if reranker.enabled:
+                with stage('rerank'):
+                    indices, scores = reranker.rerank(store, embedding, indices, scores, 5, text=question)
+            ranked.append((indices, scores))
+        return ranked
+
+    # Q x N điểm + re-rank: chạy ngoài event loop để batch lớn không chặn các request /ask khác
+    results = await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, search_and_rerank)
+    retrieved = []
+    for embedding, (indices, scores) in zip(embeddings, results):
+        retrieval_docs = store.hits(indices, scores)
+        context_key = tuple(hit.question for hit in retrieval_docs)
+        retrieved.append((embedding, retrieval_docs, context_key))
+    return retrieved
+
+
+SERVICE_UNAVAILABLE_ANSWER = {
+    "llm_answers": "Xin lỗi, hệ thống đang gặp sự cố. Vui lòng thử lại sau! 😅",
+    "source": "error",
+    "suggestions": ["Thử lại", "Hỏi câu khác"],
+}
+
+@app.post("/ask", response_model=ChatResponse)
+async def receive_question(data: Question, background_tasks: BackgroundTasks):
+    """API endpoint để xử lý câu hỏi từ chatbot"""
+    try:
+        question, snapshot = accept_question(data, background_tasks)
+        
+        # Kiểm tra model và dữ liệu
+        if sentence_model is None or len(snapshot.store) == 0:
+            ANSWERS.inc(source="error")
+            return ChatResponse(**SERVICE_UNAVAILABLE_ANSWER)
         
-        logger.info(f"✅ Trả lời thành công với similarity: {max_similarity:.3f}")
+        question_embedding, retrieval_docs, context_key = await retrieve(
+            question, snapshot.store, data.category, data.source_type)
         
-        return ChatResponse(
-            llm_answers=answer,
-            suggestions=suggestions,
-            source=source,
-            score=max_similarity,
-            similar_questions=similar_questions
-        )
+        return await answer_question(question, question_embedding, retrieval_docs, context_key)
         
     except HTTPException:
         raise
@@ -561,20 +1011,239 @@ Vui lòng thử lại sau hoặc hỏi về các chủ đề cụ thể! 😊"""
             detail="Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại!"
         )
 
+# /ask_batch: số câu hỏi tối đa mỗi request, số LLM call đồng thời của một batch (thấp hơn
+# LLM_MAX_CONCURRENCY để job hàng loạt không chiếm hết upstream của học viên đang dùng /ask)
+ASK_BATCH_MAX_QUESTIONS = int(os.getenv('ASK_BATCH_MAX_QUESTIONS', '500'))
+ASK_BATCH_LLM_CONCURRENCY = int(os.getenv('ASK_BATCH_LLM_CONCURRENCY', '4'))
+
+
+@app.post("/ask_batch")
+async def ask_batch(data: QuestionBatch, background_tasks: BackgroundTasks, stream: bool = False):
+    """Trả lời nhiều câu hỏi trong một request (tooling của giáo viên, job kiểm tra chất lượng).
+
+    Câu hỏi trùng nhau (sau normalize_question) chỉ được trả lời một lần; encode một batch, retrieval
+    một phép nhân ma trận, LLM chạy song song tối đa ASK_BATCH_LLM_CONCURRENCY call.
+    Mặc định trả về {"results": [...]} theo đúng thứ tự; `?stream=true` trả NDJSON, mỗi dòng một
+    BatchAnswer (có `index`) ngay khi câu đó xong.
+    """
+    if not data.questions:
+        raise HTTPException(status_code=400, detail="Danh sách câu hỏi không được để trống")
+    if len(data.questions) > ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"Tối đa {ASK_BATCH_MAX_QUESTIONS} câu hỏi mỗi batch")
+
+    logger.info(f"📝 Nhận batch {len(data.questions)} câu hỏi")
+    if should_sync():
+        background_tasks.add_task(sync_courses_from_mongodb)
+    snapshot = index_snapshots.current
+    if sentence_model is None and model_loading.is_set():
+        raise HTTPException(status_code=503, detail="Hệ thống đang khởi động, vui lòng thử lại sau giây lát",
+                            headers={"Retry-After": "5"})
+
+    # De-dup: mỗi câu hỏi duy nhất -> các vị trí trong batch
+    texts: List[str] = []
+    positions: Dict[str, List[int]] = {}
+    empty_positions = []
+    for i, raw in enumerate(data.questions):
+        text = raw.strip()
+        if not text:
+            empty_positions.append(i)
+            continue
+        key = normalize_question(text)
+        if key not in positions:
+            positions[key] = []
+            texts.append(text)
+        positions[key].append(i)
+    groups = list(positions.values())
+
+    def items(group: List[int], response: ChatResponse) -> List[BatchAnswer]:
+        return [BatchAnswer(index=i, question=data.questions[i], **response.model_dump()) for i in group]
+
+    empty_answer = ChatResponse(llm_answers="Câu hỏi không được để trống", source="error", suggestions=[])
+    unavailable = sentence_model is None or len(snapshot.store) == 0
+    semaphore = asyncio.Semaphore(max(1, ASK_BATCH_LLM_CONCURRENCY))
+
+    async def answer_one(u: int, retrieved) -> List[BatchAnswer]:
+        try:
+            async with semaphore:
+                response = await answer_question(texts[u], *retrieved)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi trả lời câu hỏi trong batch: {e}")
+            ANSWERS.inc(source="error")
+            response = ChatResponse(llm_answers="Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại!",
+                                    source="error", suggestions=[])
+        return items(groups[u], response)
+
+    async def answer_all():
+        """Yield danh sách BatchAnswer của từng câu hỏi duy nhất theo thứ tự hoàn thành"""
+        yield items(empty_positions, empty_answer)
+        if not texts:
+            return
+        if unavailable:
+            ANSWERS.inc(len(groups), source="error")
+            for group in groups:
+                yield items(group, ChatResponse(**SERVICE_UNAVAILABLE_ANSWER))
+            return
+        retrieved = await retrieve_many(texts, snapshot.store, data.category, data.source_type)
+        tasks = [asyncio.ensure_future(answer_one(u, r)) for u, r in enumerate(retrieved)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()  # Client ngắt kết nối giữa chừng: không gọi LLM cho phần còn lại
+
+    if stream:
+        async def ndjson():
+            async for answers in answer_all():
+                for answer in answers:
+                    yield answer.model_dump_json() + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    results: List[Optional[BatchAnswer]] = [None] * len(data.questions)
+    async for answers in answer_all():
+        for answer in answers:
+            results[answer.index] = answer
+    return {"results": results, "total": len(results), "unique_questions": len(texts)}
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Một server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/ask/stream")
+async def stream_question(data: Question, background_tasks: BackgroundTasks):
+    """Như /ask nhưng trả về server-sent events để học viên thấy câu trả lời ngay khi LLM sinh ra:
+
+    - `meta`: suggestions, similar_questions, score, source, gửi ngay sau retrieval
+    - `delta`: {"text": ...} từng đoạn câu trả lời đã làm sạch markdown (StreamingMarkdownCleaner)
+    - `done`: {"source": ...} khi kết thúc; `error` nếu LLM lỗi giữa chừng
+    """
+    question, snapshot = accept_question(data, background_tasks)
+
+    async def events():
+        if sentence_model is None or len(snapshot.store) == 0:
+            ANSWERS.inc(source="error")
+            unavailable = ChatResponse(**SERVICE_UNAVAILABLE_ANSWER).model_dump()
+            yield sse_event("meta", {k: v for k, v in unavailable.items() if k != "llm_answers"})
+            yield sse_event("delta", {"text": unavailable["llm_answers"]})
+            yield sse_event("done", {"source": unavailable["source"]})
+            return
+
+        question_embedding, retrieval_docs, context_key = await retrieve(
+            question, snapshot.store, data.category, data.source_type)
+        cached = answer_cache.get(question_embedding, context_key)
+        if cached is not None:
+            logger.info("⚡ Trả lời từ answer cache")
+            ANSWERS.inc(source="cache")
+            yield sse_event("meta", {k: v for k, v in cached.items() if k != "llm_answers"})
+            yield sse_event("delta", {"text": cached["llm_answers"]})
+            yield sse_event("done", {"source": cached["source"]})
+            return
+
+        with stage('prompt'):
+            document, suggestions, similar_questions, max_similarity = build_retrieval_context(retrieval_docs)
+            prompt = build_prompt(question, document)
+        source = "rag" if retrieval_docs else "general"
+        yield sse_event("meta", {"suggestions": suggestions, "source": source, "score": max_similarity,
+                                 "similar_questions": similar_questions})
+
+        cleaner = StreamingMarkdownCleaner()
+        parts = []
+        started, first_chunk = time.perf_counter(), True
+        try:
+            async for chunk in llm_client.stream(prompt, max_retries=3, base_delay=2.0):
+                if first_chunk:
+                    record_stage('llm_first_chunk', time.perf_counter() - started)
+                    first_chunk = False
+                text = cleaner.feed(chunk)
+                if text:
+                    parts.append(text)
+                    yield sse_event("delta", {"text": text})
+            text = cleaner.flush()
+            if text:
+                parts.append(text)
+                yield sse_event("delta", {"text": text})
+        except Exception as gemini_error:
+            logger.error(f"Lỗi Gemini API (stream): {gemini_error}")
+            if parts:
+                # Đã gửi một phần câu trả lời, không thể thay bằng fallback
+                ANSWERS.inc(source="error")
+                yield sse_event("error", {"detail": "Câu trả lời bị gián đoạn, vui lòng thử lại!"})
+                return
+            answer, source = fallback_answer(retrieval_docs)
+            ANSWERS.inc(source=source)
+            yield sse_event("delta", {"text": answer})
+            yield sse_event("done", {"source": source})
+            return
+
+        record_stage('llm', time.perf_counter() - started)
+        ANSWERS.inc(source=source)
+        logger.info(f"✅ Stream trả lời thành công với similarity: {max_similarity:.3f}")
+        yield sse_event("done", {"source": source})
+        response = ChatResponse(llm_answers="".join(parts), suggestions=suggestions, source=source,
+                                score=max_similarity, similar_questions=similar_questions)
+        answer_cache.put(question_embedding, context_key, response.model_dump())
+
+    # X-Accel-Buffering: nginx không gom response lại, token tới trình duyệt ngay
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/health")
 async def health_check():
     """Enhanced health check endpoint"""
+    snapshot = index_snapshots.current
     return {
         "status": "healthy",
+        "ready": is_ready(),
+        "startup_mode": STARTUP_MODE,
+        "startup_timings": startup_timings,
         "model_loaded": sentence_model is not None,
-        "data_loaded": not df.empty if df is not None else False,
-        "total_questions": len(df) if df is not None and not df.empty else 0,
+        "data_loaded": len(snapshot.store) > 0,
+        "total_questions": len(snapshot.store),
+        "index_version": snapshot.version,
         "mongodb_connected": lessons_coll is not None,
         "auto_sync_enabled": AUTO_SYNC_ENABLED,
         "last_sync": LAST_SYNC_TIME.isoformat() if LAST_SYNC_TIME else None,
-        "gemini_api_configured": GOOGLE_API_KEY is not None
+        "gemini_api_configured": GOOGLE_API_KEY is not None,
+        "index_backend": snapshot.store.index_name,
+        "worker": {
+            "pid": os.getpid(),
+            "shared_index": shared_index is not None,
+            "shared_index_version": shared_index.loaded_version if shared_index is not None else None,
+            "sync_leader": sync_leader.is_leader if sync_leader is not None else True
+        },
+        "query_encoder": query_encoder.stats(),
+        "rerank": reranker.stats(),
+        "llm": llm_client.stats(),
+        "answer_cache": answer_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics dạng Prometheus text format: thời gian từng stage, cache, LLM retry / fallback, sync"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness probe: process còn chạy và event loop còn phản hồi"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness probe: 200 khi model đã load và index có dữ liệu, ngược lại 503"""
+    ready = is_ready()
+    body = {
+        "ready": ready,
+        "model_loaded": sentence_model is not None,
+        "model_loading": model_loading.is_set(),
+        "index_loaded": len(index_snapshots.current.store) > 0,
+        "initial_sync_done": initial_sync_done,
+        "startup_timings": startup_timings
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -585,6 +1254,9 @@ async def root():
         "endpoints": {
             "/ask": "POST - Gửi câu hỏi về tiếng Anh",
             "/health": "GET - Kiểm tra trạng thái",
+            "/health/live": "GET - Liveness probe",
+            "/health/ready": "GET - Readiness probe (503 khi đang khởi động)",
+            "/metrics": "GET - Prometheus metrics (latency từng stage, cache, LLM, sync)",
             "/sync": "POST - Trigger manual sync from MongoDB",
             "/sync/status": "GET - Check sync status",
             "/docs": "GET - API documentation"
@@ -593,16 +1265,28 @@ async def root():
 
 
 @app.post("/sync")
-async def manual_sync():
-    """Manually trigger sync from MongoDB"""
+async def manual_sync(full: bool = False):
+    """Manually trigger sync from MongoDB (full=true để so hash trên toàn bộ collection)"""
+    if sync_lock.locked():
+        return {
+            "status": "in_progress",
+            "message": "A sync is already running"
+        }
     try:
-        result = sync_courses_from_mongodb()
+        # Chạy trên thread pool để không chặn event loop trong lúc encode
+        result = await asyncio.get_running_loop().run_in_executor(None, sync_courses_from_mongodb, full)
+        if result == SYNC_SKIPPED:
+            return {
+                "status": "in_progress",
+                "message": "A sync is already running"
+            }
         if result:
             return {
                 "status": "success",
                 "message": "Sync completed successfully",
                 "last_sync": LAST_SYNC_TIME.isoformat() if LAST_SYNC_TIME else None,
-                "total_records": len(df) if df is not None else 0
+                "total_records": len(index_snapshots.current.store),
+                "index_version": index_snapshots.current.version
             }
         else:
             return {
@@ -617,13 +1301,21 @@ async def manual_sync():
 @app.get("/sync/status")
 async def sync_status():
     """Get current sync status"""
+    snapshot = index_snapshots.current
+    source_types = snapshot.store.partitions['source_type']
     return {
         "auto_sync_enabled": AUTO_SYNC_ENABLED,
         "sync_interval_minutes": SYNC_INTERVAL_MINUTES,
         "last_sync_time": LAST_SYNC_TIME.isoformat() if LAST_SYNC_TIME else None,
         "next_sync_due": should_sync(),
+        "sync_mode": change_stream_watcher.stats() if change_stream_watcher is not None else {"mode": "poll"},
         "mongodb_connected": lessons_coll is not None,
-        "total_records": len(df) if df is not None and not df.empty else 0,
-        "lesson_records": len(df[df['source_type'] == 'lessons']) if df is not None and not df.empty and 'source_type' in df.columns else 0,
-        "faq_records": len(df[df['source_type'] == 'faq']) if df is not None and not df.empty and 'source_type' in df.columns else 0
+        "sync_in_progress": sync_lock.locked(),
+        "index_version": snapshot.version,
+        "total_records": len(snapshot.store),
+        "lessons": snapshot.store.lesson_count,
+        "lesson_records": len(source_types.get('lessons', ())),
+        "faq_records": len(source_types.get('faq', ())),
+        # Giá trị dùng được cho filter category của /ask
+        "categories": {name: len(rows) for name, rows in snapshot.store.partitions['category'].items()}
     }
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Snapshot index có version, bất biến sau khi publish.
+
+Writer (sync thread, BackgroundTasks, /sync, /admin/index_lesson, change stream) dựng
+snapshot mới ở bên ngoài rồi publish bằng một phép gán duy nhất; request handler đọc
+`registry.current` một lần ở đầu request nên luôn thấy ma trận + metadata nhất quán.
+`write_lock` đảm bảo tại mỗi thời điểm chỉ một writer dựng snapshot (single-flight).
+"""
+import threading
+import time
+
+from vector_store import VectorStore
+
+
+class IndexSnapshot:
+    """Một phiên bản corpus (FAQ + lessons): vector store là nguồn duy nhất, không giữ DataFrame"""
+    __slots__ = ('version', 'store', 'published_at')
+
+    def __init__(self, version: int, store: VectorStore):
+        self.version = version
+        self.store = store
+        self.published_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+class SnapshotRegistry:
+    """Giữ snapshot hiện tại và publish snapshot mới bằng atomic swap"""
+
+    def __init__(self):
+        self._current = IndexSnapshot(0, VectorStore.empty())
+        self._publish_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    @property
+    def current(self) -> IndexSnapshot:
+        return self._current
+
+    def publish(self, store: VectorStore) -> IndexSnapshot:
+        with self._publish_lock:
+            snapshot = IndexSnapshot(self._current.version + 1, store)
+            self._current = snapshot
+        return snapshot
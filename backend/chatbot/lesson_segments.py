@@ -0,0 +1,137 @@
+"""
+Lưu trữ lesson embeddings dạng base file + delta log (append-only).
+
+- Base: english_lessons_embeddings.parquet (bản đã compact)
+- Delta: thư mục english_lessons_delta/ gồm các segment parquet nhỏ, mỗi segment là
+  một lần upsert/xoá (cột `op` = 'upsert' | 'delete'), ghi O(K) thay vì ghi lại cả file
+- Khi load: replay base + các segment theo thứ tự, khoá theo lesson_id: segment mới nhất có
+  lesson đó thắng, giữ mọi dòng (passage) của lesson trong segment ấy
+- Compaction: khi số segment hoặc số dòng delta vượt ngưỡng thì ghi lại base và xoá delta
+- Base ghi kèm cấu hình chia passage (PASSAGE_CONFIG) trong schema metadata: khác cấu hình hiện tại
+  thì writer phải encode lại toàn bộ và ghi lại base (xem passage_config)
+"""
+import glob
+import logging
+import os
+import time
+from typing import Iterable, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from lesson_sync import PASSAGE_CONFIG, lesson_ids_of, write_lessons_parquet
+
+logger = logging.getLogger(__name__)
+
+LESSON_LOG_MAX_SEGMENTS = int(os.getenv('LESSON_LOG_MAX_SEGMENTS', '32'))
+LESSON_LOG_MAX_DELTA_RATIO = float(os.getenv('LESSON_LOG_MAX_DELTA_RATIO', '0.2'))
+
+
+class LessonSegmentLog:
+    """Base parquet + các delta segment append-only cho bảng lesson"""
+
+    def __init__(self, base_path: str, delta_dir: Optional[str] = None):
+        self.base_path = base_path
+        self.delta_dir = delta_dir or os.path.splitext(base_path)[0].replace('_embeddings', '') + '_delta'
+        self._seq = 0
+        self.delta_rows = 0
+        self.base_rows = 0
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.delta_dir, 'seg-*.parquet')))
+
+    @property
+    def passage_config(self) -> Optional[str]:
+        """Cấu hình chia passage của base hiện tại; None nếu chưa có base hoặc base ghi trước khi có
+        metadata này (chỉ đọc footer parquet)"""
+        if not os.path.exists(self.base_path):
+            return None
+        try:
+            metadata = pq.read_schema(self.base_path).metadata or {}
+        except Exception:
+            return None
+        value = metadata.get(b'passage_config')
+        return value.decode() if value else None
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments())
+
+    def load(self) -> pd.DataFrame:
+        """Đọc base + replay delta, trả về bảng lesson mới nhất (các passage của mỗi lesson_id)"""
+        frames = []
+        if os.path.exists(self.base_path):
+            base = pd.read_parquet(self.base_path)
+            if not base.empty:
+                base['lesson_id'] = lesson_ids_of(base)
+                base['op'] = 'upsert'
+                base['seq'] = 0
+                frames.append(base)
+        self.base_rows = sum(len(f) for f in frames)
+
+        segments = self._segments()
+        self.delta_rows = 0
+        for path in segments:
+            try:
+                seg = pd.read_parquet(path)
+            except Exception as e:
+                # Segment ghi dở (crash giữa chừng) thì bỏ qua
+                logger.warning(f"⚠️ Bỏ qua segment lỗi {path}: {e}")
+                continue
+            self.delta_rows += len(seg)
+            seg['seq'] = len(frames) + 1
+            frames.append(seg)
+
+        if not frames:
+            return pd.DataFrame()
+        merged = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        latest = merged.groupby('lesson_id', sort=False)['seq'].transform('max')
+        merged = merged[(merged['seq'] == latest) & (merged['op'] == 'upsert')].drop(columns=['op', 'seq'])
+        if 'chunk' not in merged.columns:
+            merged['chunk'] = 0  # Bảng lesson cũ: mỗi lesson một dòng
+        merged['chunk'] = merged['chunk'].fillna(0).astype('int32')
+        if segments:
+            logger.info(f"📚 Replay {len(segments)} delta segments ({self.delta_rows} rows)")
+        return merged.reset_index(drop=True)
+
+    def append(self, upserts: Optional[pd.DataFrame], deleted_ids: Iterable[str]):
+        """Ghi một segment mới chứa các upsert và tombstone (chi phí O(K))"""
+        parts = []
+        if upserts is not None and not upserts.empty:
+            parts.append(upserts.assign(op='upsert'))
+        deleted = sorted(set(deleted_ids))
+        if deleted:
+            parts.append(pd.DataFrame({'lesson_id': deleted, 'op': 'delete'}))
+        if not parts:
+            return
+        segment = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+        os.makedirs(self.delta_dir, exist_ok=True)
+        self._seq += 1
+        name = f"seg-{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}.parquet"
+        path = os.path.join(self.delta_dir, name)
+        tmp = path + '.tmp'
+        segment.to_parquet(tmp, index=False)
+        os.replace(tmp, path)  # Segment chỉ xuất hiện khi đã ghi xong
+        self.delta_rows += len(segment)
+
+    def needs_compaction(self) -> bool:
+        if self.segment_count >= LESSON_LOG_MAX_SEGMENTS:
+            return True
+        return self.delta_rows > max(1000, self.base_rows * LESSON_LOG_MAX_DELTA_RATIO)
+
+    def compact(self, lessons):
+        """Ghi bảng lesson hiện tại (DataFrame hoặc iterator các block, vd. VectorStore.lesson_frames())
+        thành base mới (atomic) rồi xoá các segment đã gộp"""
+        segments = self._segments()
+        tmp = self.base_path + '.tmp'
+        rows = write_lessons_parquet(lessons, tmp, metadata={'passage_config': PASSAGE_CONFIG})
+        os.replace(tmp, self.base_path)
+        for path in segments:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.base_rows = rows
+        self.delta_rows = 0
+        logger.info(f"🗜️ Compacted lesson log: {rows} rows, {len(segments)} segments merged")
@@ -0,0 +1,267 @@
+"""
+Đồng bộ lesson từ MongoDB theo kiểu incremental (diff-based).
+
+Mỗi lesson đã index được lưu kèm `lesson_id`, `content_hash` (hash của text từ
+build_text_for_embedding) và `updated_at`. Mỗi lần sync chỉ query các document đã
+đổi kể từ watermark `updatedAt`, bỏ qua document có hash không đổi, encode lại các
+document thay đổi theo batch và phát hiện lesson đã bị xoá.
+
+Lesson dài được chia thành các passage chồng lấn (LESSON_PASSAGE_CHARS / LESSON_PASSAGE_OVERLAP),
+mỗi passage là một dòng riêng (cột `chunk`) cùng `lesson_id` của lesson cha, nên phần cuối của
+lesson cũng được embed thay vì bị cắt ở 2000 ký tự. Upsert / xoá luôn thay toàn bộ passage của lesson.
+
+Pipeline chạy kiểu streaming: cursor MongoDB có projection + batch_size, dựng text và
+encode theo từng chunk (SYNC_CHUNK_SIZE), mỗi chunk được ghi ra đĩa ngay nên bộ nhớ
+tạm không phụ thuộc kích thước collection.
+"""
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from metrics import LESSONS_EMBEDDED
+
+logger = logging.getLogger(__name__)
+
+SYNC_ENCODE_BATCH_SIZE = int(os.getenv('SYNC_ENCODE_BATCH_SIZE', '32'))
+SYNC_CURSOR_BATCH_SIZE = int(os.getenv('SYNC_CURSOR_BATCH_SIZE', '500'))
+SYNC_CHUNK_SIZE = int(os.getenv('SYNC_CHUNK_SIZE', '256'))
+# Sắp xếp text theo độ dài trước khi encode để giảm padding trong mỗi batch
+SYNC_SORT_BY_LENGTH = os.getenv('SYNC_SORT_BY_LENGTH', 'true').lower() == 'true'
+# Chia nội dung lesson thành passage: độ dài (ký tự, ~ giới hạn 128 token của model mặc định),
+# phần chồng lấn giữa hai passage liền nhau, và số passage tối đa mỗi lesson
+LESSON_PASSAGE_CHARS = int(os.getenv('LESSON_PASSAGE_CHARS', '800'))
+LESSON_PASSAGE_OVERLAP = int(os.getenv('LESSON_PASSAGE_OVERLAP', '150'))
+LESSON_MAX_PASSAGES = int(os.getenv('LESSON_MAX_PASSAGES', '32'))
+# Cấu hình chia passage: nằm trong lesson_hash và trong metadata của base lesson log. Đổi cấu hình thì
+# mọi lesson phải encode lại, qua một lần full sync ghi lại base (không phải upsert từng lesson vào delta)
+PASSAGE_CONFIG = f"{LESSON_PASSAGE_CHARS}:{LESSON_PASSAGE_OVERLAP}:{LESSON_MAX_PASSAGES}"
+
+# Chỉ lấy các field cần để dựng text/metadata, không kéo cả document
+LESSON_PROJECTION = {
+    'title': 1, 'name': 1, 'topics': 1, 'content': 1, 'description': 1,
+    'explanation': 1, 'category': 1, 'updatedAt': 1,
+}
+
+# Schema cố định của bảng lesson, dùng khi ghi parquet theo từng row group
+LESSON_SCHEMA = pa.schema([
+    ('question', pa.string()),
+    ('answer', pa.string()),
+    ('category', pa.string()),
+    ('embedding', pa.list_(pa.float32())),
+    ('meta', pa.struct([('lesson_id', pa.string()), ('title', pa.string()), ('source', pa.string())])),
+    ('source_type', pa.string()),
+    ('lesson_id', pa.string()),
+    ('chunk', pa.int32()),
+    ('content_hash', pa.string()),
+    ('updated_at', pa.timestamp('ms')),
+])
+
+
+def _lesson_header(lesson) -> str:
+    title = lesson.get('title') or lesson.get('name') or ''
+    topics = lesson.get('topics', [])
+    if isinstance(topics, list):
+        topics_text = ', '.join([str(t) for t in topics])
+    else:
+        topics_text = str(topics)
+    return f"Title: {title}\nTopics: {topics_text}\n"
+
+
+def lesson_content(lesson) -> str:
+    return lesson.get('content') or lesson.get('description') or lesson.get('explanation') or ''
+
+
+def build_text_for_embedding(lesson):
+    """Toàn bộ text của lesson (dùng cho content_hash); phần được encode là các passage"""
+    return f"{_lesson_header(lesson)}Content: {lesson_content(lesson)}"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def lesson_hash(text: str) -> str:
+    """Hash của lesson, gồm cả cấu hình chia passage (PASSAGE_CONFIG)"""
+    return content_hash(f"passages:{PASSAGE_CONFIG}\n{text}")
+
+
+def _boundary(text: str, start: int, end: int) -> int:
+    """Vị trí cắt đẹp nhất trong nửa sau của [start, end): hết đoạn, hết câu, rồi khoảng trắng"""
+    floor = start + (end - start) // 2
+    for sep in ('\n', '. ', ' '):
+        cut = text.rfind(sep, floor, end)
+        if cut != -1:
+            return cut + len(sep)
+    return end
+
+
+def split_passages(text: str, size: int = LESSON_PASSAGE_CHARS, overlap: int = LESSON_PASSAGE_OVERLAP,
+                   max_passages: int = LESSON_MAX_PASSAGES) -> List[str]:
+    """Chia text thành các passage <= `size` ký tự, passage sau lặp lại ~`overlap` ký tự cuối của
+    passage trước; cắt ở ranh giới đoạn / câu / từ khi có thể"""
+    text = text.strip()
+    if len(text) <= size:
+        return [text]
+    overlap = min(max(overlap, 0), size // 2)
+    passages, start = [], 0
+    while start < len(text) and len(passages) < max_passages:
+        end = len(text) if start + size >= len(text) else _boundary(text, start, start + size)
+        passages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        # Passage tiếp theo bắt đầu ở đầu một từ, lùi lại `overlap` ký tự
+        next_start = max(end - overlap, start + 1)
+        space = text.find(' ', next_start, end)
+        start = space + 1 if space != -1 and overlap else next_start
+    return [p for p in passages if p]
+
+
+def lesson_passages(lesson) -> List[str]:
+    return split_passages(lesson_content(lesson)) or ['']
+
+
+def make_lesson_rows(docs: List[dict], passages: List[List[str]], embeddings: np.ndarray) -> List[dict]:
+    """Dựng các dòng lesson (schema của english_lessons_embeddings.parquet), một dòng mỗi passage;
+    `embeddings` theo thứ tự các passage đã nối liền"""
+    rows = []
+    position = 0
+    for doc, doc_passages in zip(docs, passages):
+        lesson_id = str(doc.get('_id'))
+        header = _lesson_header(doc)
+        digest = lesson_hash(build_text_for_embedding(doc))
+        for chunk, passage in enumerate(doc_passages):
+            rows.append({
+                'question': f"{header}Content: {passage}",
+                'answer': passage,
+                'category': doc.get('category', 'lessons'),
+                'embedding': np.asarray(embeddings[position], dtype=np.float32),
+                'meta': {'lesson_id': lesson_id, 'title': doc.get('title'), 'source': 'lessons'},
+                'source_type': 'lessons',
+                'lesson_id': lesson_id,
+                'chunk': chunk,
+                'content_hash': digest,
+                'updated_at': doc.get('updatedAt'),
+            })
+            position += 1
+    return rows
+
+
+def encode_texts(model, texts: List[str], batch_size: int = SYNC_ENCODE_BATCH_SIZE,
+                 sort_by_length: bool = SYNC_SORT_BY_LENGTH) -> np.ndarray:
+    """Encode theo batch thay vì từng document một; kết quả giữ đúng thứ tự `texts`"""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    order = np.argsort([-len(t) for t in texts], kind='stable') if sort_by_length else np.arange(len(texts))
+    encoded = np.asarray(
+        model.encode([texts[i] for i in order], batch_size=batch_size, show_progress_bar=False,
+                     convert_to_numpy=True),
+        dtype=np.float32,
+    )
+    result = np.empty_like(encoded)
+    result[order] = encoded
+    return result
+
+
+def lesson_ids_of(lessons_df: pd.DataFrame) -> pd.Series:
+    """Cột lesson_id, suy ra từ meta với parquet cũ chưa có cột này"""
+    if lessons_df is None or lessons_df.empty:
+        return pd.Series([], dtype=object)
+    if 'lesson_id' in lessons_df.columns:
+        ids = lessons_df['lesson_id']
+        if ids.notna().all():
+            return ids.astype(str)
+    metas = lessons_df['meta'] if 'meta' in lessons_df.columns else pd.Series([None] * len(lessons_df), index=lessons_df.index)
+    return pd.Series([m.get('lesson_id') if isinstance(m, dict) else None for m in metas],
+                     index=lessons_df.index, dtype=object)
+
+
+def plan_lesson_sync(coll, known: Dict[str, str], watermark, full: bool = False) -> Tuple[dict, Set[str]]:
+    """Trả về (query lấy document cần kiểm tra, tập lesson_id đã bị xoá khỏi MongoDB).
+
+    `full=True` bỏ qua watermark và so hash trên toàn bộ collection.
+    """
+    # Danh sách id hiện có (chỉ projection _id) để phát hiện lesson bị xoá / lesson mới
+    current_ids = {str(d['_id']): d['_id'] for d in coll.find({}, {'_id': 1}).batch_size(SYNC_CURSOR_BATCH_SIZE * 10)}
+    deleted = set(known) - set(current_ids)
+
+    if full or watermark is None:
+        return {}, deleted
+    unseen = [raw for lid, raw in current_ids.items() if lid not in known]
+    clauses = [{'updatedAt': {'$gte': watermark}}, {'updatedAt': {'$exists': False}}]
+    if unseen:
+        clauses.append({'_id': {'$in': unseen}})
+    return {'$or': clauses}, deleted
+
+
+def iter_lesson_docs(coll, query: dict, cursor_batch_size: int = SYNC_CURSOR_BATCH_SIZE) -> Iterator[dict]:
+    """Cursor có projection và batch_size, không load cả collection vào list"""
+    return coll.find(query, LESSON_PROJECTION).batch_size(cursor_batch_size)
+
+
+def _encode_lessons(docs: List[dict], passages: List[List[str]], model, batch_size: int) -> pd.DataFrame:
+    header = [_lesson_header(doc) for doc in docs]
+    texts = [f"{h}Content: {p}" for h, doc_passages in zip(header, passages) for p in doc_passages]
+    embeddings = encode_texts(model, texts, batch_size=batch_size)
+    LESSONS_EMBEDDED.inc(len(docs))
+    return pd.DataFrame(make_lesson_rows(docs, passages, embeddings))
+
+
+def iter_changed_lesson_chunks(docs: Iterable[dict], known: Dict[str, str], model,
+                               chunk_size: int = SYNC_CHUNK_SIZE,
+                               batch_size: int = SYNC_ENCODE_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+    """Stream các document, yield từng chunk (~chunk_size passage) lesson mới/thay đổi đã encode.
+    Các passage của một lesson luôn nằm trong cùng một chunk."""
+    changed, passages, pending = [], [], 0
+    for doc in docs:
+        try:
+            text = build_text_for_embedding(doc)
+            doc_passages = lesson_passages(doc)
+        except Exception as e:
+            logger.warning(f"Failed to process lesson {doc.get('_id')}: {e}")
+            continue
+        if known.get(str(doc.get('_id'))) == lesson_hash(text):
+            continue  # Nội dung không đổi, không cần encode lại
+        changed.append(doc)
+        passages.append(doc_passages)
+        pending += len(doc_passages)
+        if pending >= chunk_size:
+            yield _encode_lessons(changed, passages, model, batch_size)
+            changed, passages, pending = [], [], 0
+    if changed:
+        yield _encode_lessons(changed, passages, model, batch_size)
+
+
+def embed_changed_lessons(docs: Iterable[dict], known: Dict[str, str], model,
+                          batch_size: int = SYNC_ENCODE_BATCH_SIZE) -> pd.DataFrame:
+    """Encode (theo batch) các document có hash khác với `known`, trả về các dòng lesson"""
+    chunks = list(iter_changed_lesson_chunks(docs, known, model, batch_size=batch_size))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def write_lessons_parquet(lessons, path: str, row_group_size: int = 10000,
+                          metadata: Optional[Dict[str, str]] = None) -> int:
+    """Ghi bảng lesson theo từng row group với LESSON_SCHEMA (không chuyển cả bảng sang Arrow một lần).
+    `lessons` là một DataFrame hoặc iterator các DataFrame (block), để bảng không phải nằm trọn trong bộ
+    nhớ; `metadata` được ghi vào schema metadata của file. Trả về số dòng đã ghi."""
+    import pyarrow.parquet as pq
+
+    frames = [lessons] if isinstance(lessons, pd.DataFrame) else lessons
+    schema = LESSON_SCHEMA.with_metadata(metadata) if metadata else LESSON_SCHEMA
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for frame in frames:
+            frame = frame.reindex(columns=LESSON_SCHEMA.names)
+            for start in range(0, len(frame), row_group_size):
+                part = frame.iloc[start:start + row_group_size]
+                writer.write_table(pa.Table.from_pandas(part, schema=LESSON_SCHEMA, preserve_index=False))
+            rows += len(frame)
+        if not rows:
+            writer.write_table(LESSON_SCHEMA.empty_table())
+    return rows
@@ -0,0 +1,216 @@
+"""
+Index lesson theo thời gian thực bằng MongoDB change stream (SYNC_MODE=change_stream).
+
+Watcher subscribe change stream của collection lessons, gom các event đến dồn dập
+trong CHANGE_STREAM_BATCH_MS rồi áp dụng một lần (upsert/xoá), và lưu resume token
+xuống đĩa sau mỗi batch để khởi động lại không phải full resync.
+Change stream cần replica set; với mongod standalone `start()` trả về False và
+server dùng lại cơ chế polling cũ.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SYNC_MODE = os.getenv('SYNC_MODE', 'poll').lower()
+CHANGE_STREAM_BATCH_MS = float(os.getenv('CHANGE_STREAM_BATCH_MS', '500'))
+CHANGE_STREAM_MAX_BATCH = int(os.getenv('CHANGE_STREAM_MAX_BATCH', '256'))
+# Full resync không chạy được (đang có sync khác, hoặc lỗi): chờ rồi thử lại, stream vẫn mở
+CHANGE_STREAM_RESYNC_RETRY_SECONDS = float(os.getenv('CHANGE_STREAM_RESYNC_RETRY_SECONDS', '5'))
+
+# Mã lỗi MongoDB khi resume token đã trôi khỏi oplog (ChangeStreamHistoryLost, ...)
+_HISTORY_LOST_CODES = {260, 280, 286}
+
+
+def _json_util():
+    from bson import json_util
+    return json_util
+
+
+class LessonChangeStreamWatcher:
+    """Thread nghe change stream và gọi `on_changes(upsert_docs, deleted_ids)` theo batch.
+    `on_resync()` chạy full resync, trả về True khi đã sync xong; khác True thì watcher thử lại sau."""
+
+    def __init__(self, coll, on_changes: Callable[[List[dict], Set[str]], None],
+                 on_resync: Callable[[], bool], token_path: str,
+                 batch_ms: float = CHANGE_STREAM_BATCH_MS, max_batch: int = CHANGE_STREAM_MAX_BATCH):
+        self.coll = coll
+        self.on_changes = on_changes
+        self.on_resync = on_resync
+        self.token_path = token_path
+        self.batch_window = batch_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.resumed = False  # True nếu stream được mở lại từ token trên đĩa
+        self.active = False
+        self.events = 0
+        self.batches = 0
+        self.last_event_at: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Resume token ---------------------------------------------------------
+
+    def load_token(self):
+        if not os.path.exists(self.token_path):
+            return None
+        try:
+            with open(self.token_path, 'r', encoding='utf-8') as f:
+                return _json_util().loads(f.read())
+        except Exception as e:
+            logger.warning(f"⚠️ Resume token không đọc được ({e}), bỏ qua")
+            return None
+
+    def save_token(self, token):
+        if token is None:
+            return
+        tmp = self.token_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(_json_util().dumps(token))
+        os.replace(tmp, self.token_path)
+
+    def clear_token(self):
+        if os.path.exists(self.token_path):
+            os.remove(self.token_path)
+
+    # Stream ---------------------------------------------------------------
+
+    def _open(self, token=None):
+        kwargs = {'full_document': 'updateLookup', 'max_await_time_ms': 1000}
+        if token is not None:
+            kwargs['resume_after'] = token
+        return self.coll.watch(**kwargs)
+
+    def start(self) -> bool:
+        """Mở change stream; trả về False nếu MongoDB không hỗ trợ (cần fallback sang polling)"""
+        from pymongo.errors import OperationFailure, PyMongoError
+
+        token = self.load_token()
+        try:
+            stream = self._open(token)
+            self.resumed = token is not None
+        except OperationFailure as e:
+            if e.code in _HISTORY_LOST_CODES and token is not None:
+                logger.warning("⚠️ Resume token đã quá hạn, mở stream mới và full resync")
+                self.clear_token()
+                return self.start()
+            logger.warning(f"⚠️ Change stream không khả dụng ({e}), dùng polling")
+            return False
+        except PyMongoError as e:
+            logger.warning(f"⚠️ Change stream không khả dụng ({e}), dùng polling")
+            return False
+
+        self.active = True
+        self._thread = threading.Thread(target=self._run, args=(stream,), daemon=True)
+        self._thread.start()
+        logger.info(f"📡 Change stream watcher started ({'resumed from token' if self.resumed else 'new stream'})")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self.active = False
+
+    def _collect(self, stream) -> List[dict]:
+        """Chờ event đầu tiên rồi gom thêm các event đến trong cửa sổ batch"""
+        first = stream.try_next()
+        if first is None:
+            return []
+        events = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(events) < self.max_batch and time.monotonic() < deadline:
+            event = stream.try_next()
+            if event is None:
+                break
+            events.append(event)
+        return events
+
+    def _apply(self, events: List[dict]) -> bool:
+        """Gộp event theo _id (event sau cùng thắng) rồi áp dụng một lần; trả về False nếu cần resync"""
+        latest: Dict[str, Optional[dict]] = {}
+        for event in events:
+            op = event.get('operationType')
+            if op in ('insert', 'update', 'replace'):
+                doc = event.get('fullDocument')
+                key = str(event.get('documentKey', {}).get('_id'))
+                latest[key] = doc  # None nếu document đã bị xoá ngay sau update
+            elif op == 'delete':
+                latest[str(event.get('documentKey', {}).get('_id'))] = None
+            elif op in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                return False
+
+        upserts = [doc for doc in latest.values() if doc is not None]
+        deleted = {key for key, doc in latest.items() if doc is None}
+        self.on_changes(upserts, deleted)
+        self.events += len(events)
+        self.batches += 1
+        self.last_event_at = datetime.now()
+        return True
+
+    def _resync(self) -> bool:
+        try:
+            return self.on_resync() is True
+        except Exception as e:
+            logger.error(f"Lỗi khi full resync: {e}")
+            return False
+
+    def _run(self, stream):
+        from pymongo.errors import OperationFailure, PyMongoError
+
+        backoff = 1.0
+        needs_resync = False
+        while not self._stop.is_set():
+            try:
+                if needs_resync:
+                    # Stream mới đã mở trước khi resync nên không bỏ lỡ thay đổi trong lúc resync
+                    if not self._resync():
+                        logger.warning(f"⚠️ Full resync chưa chạy được, thử lại sau {CHANGE_STREAM_RESYNC_RETRY_SECONDS}s")
+                        self._stop.wait(CHANGE_STREAM_RESYNC_RETRY_SECONDS)
+                        continue
+                    needs_resync = False
+                with stream:
+                    while not self._stop.is_set() and stream.alive:
+                        events = self._collect(stream)
+                        if not events:
+                            continue
+                        if not self._apply(events):
+                            logger.warning("⚠️ Collection bị drop/invalidate, full resync")
+                            self.clear_token()
+                            needs_resync = True
+                            break
+                        self.save_token(stream.resume_token)
+                        backoff = 1.0
+            except OperationFailure as e:
+                if e.code in _HISTORY_LOST_CODES:
+                    logger.warning("⚠️ Resume token đã quá hạn, full resync")
+                    self.clear_token()
+                    needs_resync = True
+                else:
+                    logger.error(f"Change stream error: {e}")
+            except PyMongoError as e:
+                logger.error(f"Change stream error: {e}")
+            except Exception as e:
+                logger.error(f"Lỗi khi áp dụng change stream batch: {e}")
+
+            if self._stop.is_set():
+                break
+            if not needs_resync:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+            try:
+                stream = self._open(self.load_token())
+            except PyMongoError as e:
+                logger.error(f"Không mở lại được change stream: {e}")
+        self.active = False
+
+    def stats(self) -> dict:
+        return {
+            "mode": "change_stream",
+            "active": self.active,
+            "resumed": self.resumed,
+            "events": self.events,
+            "batches": self.batches,
+            "last_event_at": self.last_event_at.isoformat() if self.last_event_at else None,
+        }
@@ -0,0 +1,272 @@
+"""
+Inverted index BM25 (numpy thuần) trên question / answer / tags, dùng cho hybrid retrieval.
+
+Embedding hay bỏ sót thuật ngữ tiếng Anh chính xác ("past participle", "IELTS band 7") mà học viên
+gõ lẫn trong câu tiếng Việt. Mỗi dòng của VectorStore giữ danh sách term (id + tf có trọng số theo
+field) để upsert/xoá lesson chỉ phải tokenize các dòng đổi. Inverted index gồm các segment bất biến:
+upsert chỉ dựng postings cho các dòng nối thêm (segment nhỏ, gộp dần theo kích thước); dòng bị thay /
+xoá bị loại khi tìm (tombstone) cho tới khi store compact.
+
+Token: bỏ dấu + chữ thường (khớp cả câu gõ không dấu), từ đơn và cặp từ liền nhau (bigram) để cụm
+như "past participle" được ưu tiên hơn hai từ rời. Field answer (dài nhất) chỉ lấy từ đơn để giữ
+chi phí tokenize khi index cả corpus lesson.
+"""
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ann_index import in_sorted
+
+logger = logging.getLogger(__name__)
+
+# RETRIEVAL_MODE=hybrid: thêm BM25 (fusion với vector); mặc định chỉ dùng embedding như trước
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector').lower()
+BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+# Term xuất hiện trong hơn tỉ lệ này của corpus bị bỏ khỏi query (gần như stopword, postings rất dài)
+LEXICAL_MAX_DF_RATIO = float(os.getenv('LEXICAL_MAX_DF_RATIO', '0.5'))
+FIELD_WEIGHTS = {'question': 2.0, 'tags': 2.0, 'answer': 1.0}
+# Fusion: mỗi phía lấy top_k * HYBRID_DEPTH ứng viên, gộp bằng reciprocal rank fusion
+RRF_K = float(os.getenv('RRF_K', '60'))
+HYBRID_DEPTH = int(os.getenv('HYBRID_DEPTH', '4'))
+# Khớp lexical mạnh (HYBRID_LEXICAL_TOP dòng BM25 cao nhất) chỉ cần cosine >= HYBRID_LEXICAL_FLOOR thay vì
+# threshold: thuật ngữ gõ nguyên văn ("past participle") mà embedding chấm thấp vẫn được trả về
+HYBRID_LEXICAL_TOP = int(os.getenv('HYBRID_LEXICAL_TOP', '2'))
+HYBRID_LEXICAL_FLOOR = float(os.getenv('HYBRID_LEXICAL_FLOOR', '0.15'))
+# Corpus lớn: chỉ chấm vector trên các ứng viên lexical (khi có đủ) thay vì quét cả ma trận
+HYBRID_PREFILTER_MIN_ROWS = int(os.getenv('HYBRID_PREFILTER_MIN_ROWS', '100000'))
+HYBRID_PREFILTER_CANDIDATES = int(os.getenv('HYBRID_PREFILTER_CANDIDATES', '2000'))
+
+_TOKEN_RE = re.compile(r'\w+')
+_COMBINING_RE = re.compile('[\u0300-\u036f]')
+_EMPTY_TERMS = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+
+
+def fold(text: str) -> str:
+    """Bỏ dấu + chữ thường như caches.normalize_question, nhưng bằng regex (nhanh hơn khi index cả corpus)"""
+    return _COMBINING_RE.sub('', unicodedata.normalize('NFD', text)).replace('đ', 'd').replace('Đ', 'D').lower()
+
+
+def tokenize(text: Optional[str], bigrams: bool = True) -> List[str]:
+    """Từ đơn (+ bigram) của văn bản đã bỏ dấu, chữ thường"""
+    words = _TOKEN_RE.findall(fold(text or ''))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])] if bigrams else words
+
+
+class Vocabulary:
+    """term -> id, chỉ thêm không xoá; dùng chung giữa các bản copy của store (writer thêm dưới lock)"""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, term: str) -> Optional[int]:
+        return self._ids.get(term)
+
+    def add(self, term: str) -> int:
+        term_id = self._ids.get(term)
+        if term_id is None:
+            with self._lock:
+                term_id = self._ids.setdefault(term, len(self._ids))
+        return term_id
+
+
+def document_terms(vocab: Vocabulary, question: Optional[str], answer: Optional[str],
+                   tags: Optional[Iterable[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """(term ids, tf có trọng số theo field) của một dòng"""
+    counts: Counter = Counter()
+    tag_text = ' '.join(str(t) for t in tags) if tags is not None and not isinstance(tags, str) else tags
+    for field, text in (('question', question), ('answer', answer), ('tags', tag_text)):
+        if not text:
+            continue
+        weight = FIELD_WEIGHTS[field]
+        for term, count in Counter(tokenize(text, bigrams=field != 'answer')).items():
+            counts[term] += count * weight
+    if not counts:
+        return _EMPTY_TERMS
+    return np.fromiter((vocab.add(term) for term in counts), dtype=np.int32, count=len(counts)), \
+        np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+
+
+def build_terms(vocab: Vocabulary, questions: Sequence, answers: Sequence, tags: Sequence) -> np.ndarray:
+    """Mảng object: mỗi phần tử là (term ids, tf) của một dòng"""
+    terms = np.empty(len(questions), dtype=object)
+    terms[:] = [document_terms(vocab, q, a, t) for q, a, t in zip(questions, answers, tags)]
+    return terms
+
+
+class _Segment:
+    """Postings sắp theo term (kiểu CSC) của các dòng [start, start + n_docs): offsets[t]:offsets[t + 1]
+    là các dòng (tính từ start) chứa term t"""
+
+    __slots__ = ('start', 'n_docs', 'postings', 'tfs', 'offsets', 'doc_lengths', 'total_length')
+
+    def __init__(self, start: int, postings: np.ndarray, tfs: np.ndarray, offsets: np.ndarray,
+                 doc_lengths: np.ndarray):
+        self.start = start
+        self.n_docs = len(doc_lengths)
+        self.postings = postings
+        self.tfs = tfs
+        self.offsets = offsets
+        self.doc_lengths = doc_lengths
+        self.total_length = float(doc_lengths.sum())
+
+    @classmethod
+    def build(cls, terms: np.ndarray, n_terms: int, start: int = 0) -> '_Segment':
+        n_docs = len(terms)
+        sizes = np.fromiter((len(ids) for ids, _ in terms), dtype=np.int64, count=n_docs)
+        if sizes.sum():
+            term_ids = np.concatenate([ids for ids, _ in terms])
+            tfs = np.concatenate([tf for _, tf in terms])
+        else:
+            term_ids, tfs = _EMPTY_TERMS
+        docs = np.repeat(np.arange(n_docs, dtype=np.int32), sizes)
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=n_terms))]).astype(np.int64)
+        return cls(start, docs[order], tfs[order], offsets,
+                   np.bincount(docs, weights=tfs, minlength=n_docs).astype(np.float32))
+
+    @classmethod
+    def merge(cls, first: '_Segment', second: '_Segment') -> '_Segment':
+        """Gộp hai segment liền nhau (second bắt đầu ngay sau first) từ chính postings của chúng"""
+        n_terms = max(len(first.offsets), len(second.offsets)) - 1
+        docs, tfs, term_ids = [], [], []
+        for seg in (first, second):
+            docs.append(seg.postings + np.int32(seg.start - first.start))
+            tfs.append(seg.tfs)
+            term_ids.append(np.repeat(np.arange(len(seg.offsets) - 1, dtype=np.int32), np.diff(seg.offsets)))
+        term_ids = np.concatenate(term_ids)
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=n_terms))]).astype(np.int64)
+        return cls(first.start, np.concatenate(docs)[order], np.concatenate(tfs)[order], offsets,
+                   np.concatenate([first.doc_lengths, second.doc_lengths]))
+
+    def shifted(self, start: int) -> '_Segment':
+        return _Segment(start, self.postings, self.tfs, self.offsets, self.doc_lengths)
+
+    def df(self, term_id: int) -> int:
+        if term_id + 1 >= len(self.offsets):
+            return 0  # Term chỉ có trong dòng thêm sau khi segment này được dựng
+        return int(self.offsets[term_id + 1] - self.offsets[term_id])
+
+    def term(self, term_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(row toàn cục, tf, độ dài tài liệu) của các dòng chứa term"""
+        if term_id + 1 >= len(self.offsets):
+            return _NO_POSTINGS
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        docs = self.postings[start:end]
+        return docs.astype(np.int64) + self.start, self.tfs[start:end], self.doc_lengths[docs]
+
+    @property
+    def nbytes(self) -> int:
+        return self.postings.nbytes + self.tfs.nbytes + self.offsets.nbytes + self.doc_lengths.nbytes
+
+
+_NO_POSTINGS = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32))
+
+
+class LexicalIndex:
+    """BM25 trên các segment bất biến; df, số tài liệu và độ dài trung bình tính trên mọi segment
+    (kể cả dòng đã bị thay / xoá cho tới khi store compact, giống Lucene)"""
+
+    def __init__(self, vocab: Vocabulary, terms: np.ndarray, start: int = 0):
+        self.vocab = vocab
+        self._set_segments([_Segment.build(terms, len(vocab), start)])
+
+    def _set_segments(self, segments: List[_Segment]):
+        self.segments = tuple(segments)
+        self.n_docs = sum(seg.n_docs for seg in segments)
+        self.avg_length = sum(seg.total_length for seg in segments) / self.n_docs if self.n_docs else 0.0
+
+    def append(self, other: 'LexicalIndex', start: int) -> 'LexicalIndex':
+        """Index mới gồm các segment của index này + các dòng của `other` (dựng trên các dòng nối thêm,
+        cùng vocab) đặt từ row `start`. Segment sau được gộp vào segment trước khi không nhỏ hơn một nửa
+        của nó, nên số segment ~ log2(số dòng) và mỗi dòng chỉ bị gộp lại O(log N) lần."""
+        segments = list(self.segments)
+        for seg in other.segments:
+            if not seg.n_docs:
+                continue
+            segments.append(seg.shifted(start + seg.start))
+            while len(segments) > 1 and segments[-2].n_docs <= 2 * segments[-1].n_docs:
+                last = segments.pop()
+                segments[-1] = _Segment.merge(segments[-1], last)
+        clone = object.__new__(LexicalIndex)
+        clone.vocab = self.vocab
+        clone._set_segments(segments)
+        return clone
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    @property
+    def nbytes(self) -> int:
+        return sum(seg.nbytes for seg in self.segments)
+
+    def _query_terms(self, text: str) -> List[Tuple[int, float]]:
+        """(term id, idf) của các term trong query có trong corpus, bỏ term quá phổ biến"""
+        result = []
+        for term in dict.fromkeys(tokenize(text)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            df = sum(seg.df(term_id) for seg in self.segments)
+            if df == 0 or df > LEXICAL_MAX_DF_RATIO * self.n_docs:
+                continue
+            result.append((term_id, math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))))
+        return result
+
+    def search(self, text: str, k: int, allowed: Optional[np.ndarray] = None,
+               excluded: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k theo BM25: (rows, điểm BM25); `allowed` (row đã sắp xếp) giới hạn kết quả trong một
+        partition của store, `excluded` (row đã sắp xếp) là các dòng đã bị xoá"""
+        query = self._query_terms(text)
+        if not query or k <= 0 or self.n_docs == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        docs, contributions = [], []
+        for term_id, idf in query:
+            for seg in self.segments:
+                rows, tf, lengths = seg.term(term_id)
+                if not len(rows):
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self.avg_length)
+                docs.append(rows)
+                contributions.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        rows, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+        keep = None
+        if allowed is not None:
+            keep = in_sorted(rows, allowed)
+        if excluded is not None and len(excluded):
+            keep = ~in_sorted(rows, excluded) if keep is None else keep & ~in_sorted(rows, excluded)
+        if keep is not None:
+            rows, scores = rows[keep], scores[keep]
+            if len(rows) == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return rows[top].astype(np.int64), scores[top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: float = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """Gộp các danh sách row đã xếp hạng: điểm = sum 1 / (k + rank); trả về (rows, điểm) giảm dần"""
+    rankings = [np.asarray(r, dtype=np.int64) for r in rankings if len(r)]
+    if not rankings:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    rows, inverse = np.unique(np.concatenate(rankings), return_inverse=True)
+    ranks = np.concatenate([np.arange(1, len(r) + 1) for r in rankings])
+    scores = np.bincount(inverse, weights=1.0 / (k + ranks))
+    order = np.argsort(-scores, kind='stable')
+    return rows[order], scores[order]
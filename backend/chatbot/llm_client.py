@@ -0,0 +1,251 @@
+"""
+LLM client chạy ngoài event loop, giới hạn số call đồng thời và gộp các prompt trùng nhau.
+
+- Lời gọi đồng bộ `generate_content` của Gemini chạy trên executor riêng, không chặn uvicorn loop
+- Semaphore giới hạn số call upstream đồng thời (LLM_MAX_CONCURRENCY)
+- Các prompt giống hệt nhau đến cùng lúc dùng chung một call upstream (in-flight de-duplication)
+- LLM_BACKEND=fake dùng backend giả lập cục bộ để load-test mà không cần mạng
+- `stream()` trả về từng chunk token ngay khi upstream sinh ra (cho /ask/stream)
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from metrics import LLM_BACKOFF_SECONDS, LLM_ERRORS, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini').lower()
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+FAKE_LLM_LATENCY_MS = float(os.getenv('FAKE_LLM_LATENCY_MS', '800'))
+FAKE_LLM_FAIL_RATE = float(os.getenv('FAKE_LLM_FAIL_RATE', '0'))
+# Fake backend streaming: tỉ lệ latency trước chunk đầu tiên, phần còn lại chia đều cho các token
+FAKE_LLM_FIRST_TOKEN_RATIO = float(os.getenv('FAKE_LLM_FIRST_TOKEN_RATIO', '0.2'))
+
+_STREAM_END = object()
+
+
+class QuotaExceededError(Exception):
+    """Lỗi 429 / quota từ upstream (được retry với exponential backoff)"""
+
+
+def is_quota_error(error: Exception) -> bool:
+    if isinstance(error, QuotaExceededError):
+        return True
+    error_msg = str(error)
+    return "429" in error_msg or "quota" in error_msg.lower()
+
+
+class GeminiBackend:
+    """Backend gọi Gemini qua google-generativeai (API đồng bộ)"""
+    name = 'gemini'
+
+    def __init__(self, model):
+        self.model = model
+
+    def generate(self, prompt: str) -> str:
+        response = self.model.generate_content(prompt)
+        return response.text
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:  # Chunk không có text (vd. chỉ có safety ratings)
+                continue
+            if text:
+                yield text
+
+
+class FakeLLMBackend:
+    """Backend giả lập: ngủ `latency_ms` (± jitter) rồi trả lời cố định, có thể giả lập lỗi quota"""
+    name = 'fake'
+
+    def __init__(self, latency_ms: float = FAKE_LLM_LATENCY_MS, jitter: float = 0.2,
+                 fail_rate: float = FAKE_LLM_FAIL_RATE):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.calls = 0
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        delay = self.latency_ms / 1000.0 * (1 + random.uniform(-self.jitter, self.jitter))
+        time.sleep(max(0.0, delay))
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise QuotaExceededError("429 fake quota exceeded")
+        return self._answer(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Như generate() nhưng trả từng token: chunk đầu sau một phần latency, các token sau rải đều"""
+        self.calls += 1
+        delay = self.latency_ms / 1000.0 * (1 + random.uniform(-self.jitter, self.jitter))
+        time.sleep(max(0.0, delay * FAKE_LLM_FIRST_TOKEN_RATIO))
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise QuotaExceededError("429 fake quota exceeded")
+        tokens = self._answer(prompt).split(' ')
+        per_token = max(0.0, delay * (1 - FAKE_LLM_FIRST_TOKEN_RATIO)) / max(1, len(tokens) - 1)
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(per_token)
+            yield token if i == 0 else ' ' + token
+
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        question = prompt.split("Câu hỏi:", 1)[-1].strip().splitlines()[0] if "Câu hỏi:" in prompt else prompt[:80]
+        return f"Đây là câu trả lời giả lập cho: {question}"
+
+
+def create_backend(name: str = LLM_BACKEND, gemini_model=None):
+    if name == 'fake':
+        logger.info("🧪 Dùng fake LLM backend (không gọi mạng)")
+        return FakeLLMBackend()
+    return GeminiBackend(gemini_model)
+
+
+class LLMClient:
+    """Gọi backend trên executor, giới hạn concurrency và gộp các prompt đang chạy trùng nhau"""
+
+    def __init__(self, backend, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.backend = backend
+        self.max_concurrency = max(1, max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='llm')
+        self._loop = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.streams = 0
+        self.active = 0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+        return loop
+
+    async def generate(self, prompt: str, max_retries: int = 3, base_delay: float = 1.0) -> str:
+        """Sinh câu trả lời; prompt trùng với một call đang chạy sẽ chờ chung kết quả"""
+        loop = self._bind_loop()
+        key = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            return await asyncio.shield(shared)
+
+        task = loop.create_task(self._generate_with_retry(prompt, max_retries, base_delay))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _generate_with_retry(self, prompt: str, max_retries: int, base_delay: float) -> str:
+        """Retry với exponential backoff khi gặp lỗi quota; lỗi khác raise ngay"""
+        for attempt in range(max_retries):
+            try:
+                return await self._call_backend(prompt)
+            except Exception as e:
+                logger.warning(f"LLM API attempt {attempt + 1} failed: {e}")
+                LLM_ERRORS.inc(kind='quota' if is_quota_error(e) else 'other')
+                if is_quota_error(e) and attempt < max_retries - 1:
+                    delay = base_delay * (2 ** attempt)
+                    logger.info(f"Quota exceeded, waiting {delay} seconds before retry...")
+                    LLM_RETRIES.inc()
+                    LLM_BACKOFF_SECONDS.inc(delay)
+                    await asyncio.sleep(delay)
+                    continue
+                if is_quota_error(e):
+                    logger.error("Max retries reached for LLM API")
+                raise
+        raise Exception("Max retries exceeded")
+
+    async def stream(self, prompt: str, max_retries: int = 3, base_delay: float = 1.0) -> AsyncIterator[str]:
+        """Stream từng chunk của câu trả lời. Lỗi quota chỉ được retry khi chưa nhận chunk nào;
+        stream không được gộp với prompt trùng (mỗi client cần nhận token của riêng mình)."""
+        self._bind_loop()
+        for attempt in range(max_retries):
+            received = False
+            try:
+                async with self._semaphore:
+                    self.upstream_calls += 1
+                    self.streams += 1
+                    self.active += 1
+                    try:
+                        async for chunk in self._stream_backend(prompt):
+                            received = True
+                            yield chunk
+                    finally:
+                        self.active -= 1
+                return
+            except Exception as e:
+                logger.warning(f"LLM stream attempt {attempt + 1} failed: {e}")
+                LLM_ERRORS.inc(kind='quota' if is_quota_error(e) else 'other')
+                if received or not is_quota_error(e) or attempt == max_retries - 1:
+                    raise
+                delay = base_delay * (2 ** attempt)
+                logger.info(f"Quota exceeded, waiting {delay} seconds before retry...")
+                LLM_RETRIES.inc()
+                LLM_BACKOFF_SECONDS.inc(delay)
+                await asyncio.sleep(delay)
+
+    async def _stream_backend(self, prompt: str) -> AsyncIterator[str]:
+        """Chạy generator đồng bộ của backend trên executor, chuyển chunk về event loop qua queue"""
+        loop = self._loop
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # Event loop đã đóng
+                cancelled.set()
+
+        def produce():
+            try:
+                for chunk in self.backend.stream(prompt):
+                    if cancelled.is_set():
+                        return  # Client đã ngắt kết nối: dừng đọc upstream
+                    put(chunk)
+            except Exception as e:
+                put(e)
+            finally:
+                put(_STREAM_END)
+
+        loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+
+    async def _call_backend(self, prompt: str) -> str:
+        async with self._semaphore:
+            self.upstream_calls += 1
+            self.active += 1
+            try:
+                return await self._loop.run_in_executor(self._executor, self.backend.generate, prompt)
+            finally:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "in_flight_prompts": len(self._inflight),
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "streams": self.streams,
+        }
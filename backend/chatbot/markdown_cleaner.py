@@ -0,0 +1,138 @@
+"""
+Làm sạch markdown trong câu trả lời của LLM, cho cả câu trả lời đầy đủ và câu trả lời streaming.
+
+`clean_markdown_response` xử lý cả đoạn văn bản. `StreamingMarkdownCleaner` nhận từng chunk token:
+các rule regex (trừ gộp xuống dòng, khoảng trắng trước dấu câu và strip) chỉ tác động trong một dòng,
+nên cleaner giữ lại phần cuối dòng còn có thể đổi (marker **, _, `, ~~ chưa đóng, khoảng trắng cuối)
+và phát ngay phần đã chắc chắn. Ghép các phần trả ra cho đúng kết quả của clean_markdown_response,
+trừ vài trường hợp hiếm khi marker vắt qua dòng mới.
+"""
+import os
+import re
+
+_TRAILING_HOLD = ' \t\r\f\v*_`~'
+# Phần tiếp theo của dòng có thể đóng marker đang mở: chỉ phát phần chung của mọi khả năng
+_CONTINUATIONS = ('', '*', '**', '_', '__', '`', '~~')
+
+
+# Remove excessive newlines
+_EXCESS_NEWLINES = re.compile(r'\n{3,}')
+# Các rule theo thứ tự áp dụng, dùng chung cho clean_markdown_response (cả văn bản) và
+# clean_markdown_line (từng dòng khi streaming). Chỉ rule gộp xuống dòng và rule khoảng trắng trước
+# dấu câu (\s có thể là xuống dòng) tác động qua nhiều dòng; trên một dòng rule gộp xuống dòng không làm gì.
+_RULES = (
+    # Remove excessive bold formatting (more than 2 consecutive **)
+    (re.compile(r'\*{3,}'), ''),
+    # Convert proper bold (**text**) to normal text for cleaner display
+    (re.compile(r'\*\*(.*?)\*\*'), r'\1'),
+    # Remove excessive asterisks at line beginnings
+    (re.compile(r'^\*\s+', re.MULTILINE), ''),
+    # Clean up multiple consecutive asterisks (but keep single ones for emphasis)
+    (re.compile(r'\*{2,}'), ''),
+    # Fix spacing around punctuation
+    (re.compile(r'\s+([.,!?])'), r'\1'),
+    (_EXCESS_NEWLINES, '\n\n'),
+    # Clean up bullet points with excessive asterisks
+    (re.compile(r'^\*{2,}\s+', re.MULTILINE), '• '),
+    # Remove other markdown formatting
+    (re.compile(r'__(.*?)__'), r'\1'),
+    (re.compile(r'_(.*?)_'), r'\1'),
+    (re.compile(r'`(.*?)`'), r'\1'),
+    (re.compile(r'~~(.*?)~~'), r'\1'),
+)
+
+
+def clean_markdown_line(text: str) -> str:
+    """Các rule của clean_markdown_response áp dụng trên một dòng (không strip)"""
+    for pattern, replacement in _RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def clean_markdown_response(text):
+    """Clean up excessive markdown formatting from AI responses"""
+    if not text:
+        return text
+    return clean_markdown_line(text).strip()
+
+
+def _unclosed_marker(line: str) -> int:
+    """Vị trí marker mở chưa được đóng trong dòng (len(line) nếu không có)"""
+    hold = len(line)
+    for char in ('`', '_'):
+        if line.count(char) % 2:
+            hold = min(hold, line.rindex(char))
+    if line.count('~~') % 2:
+        hold = min(hold, line.rindex('~~'))
+    bold = [m.start() for m in re.finditer(r'(?<!\*)\*\*(?!\*)', line)]
+    if len(bold) % 2:
+        hold = min(hold, bold[-1])
+    return hold
+
+
+class StreamingMarkdownCleaner:
+    """clean_markdown_response cho văn bản đến theo từng chunk.
+
+    feed() trả về phần văn bản đã làm sạch có thể gửi ngay, flush() trả về phần còn lại khi hết stream;
+    ghép tất cả lại bằng clean_markdown_response(toàn bộ văn bản).
+    """
+
+    def __init__(self):
+        self._line = ''          # Dòng raw đang nhận dở
+        self._line_emitted = ''  # Phần đã làm sạch của dòng đó đã phát
+        self._whitespace = ''    # Khoảng trắng đang giữ lại (có thể bị xoá trước dấu câu / cuối văn bản)
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        lines = chunk.split('\n')
+        for i, part in enumerate(lines):
+            self._line += part
+            if i < len(lines) - 1:
+                out.append(self._finish_line())
+                out.append(self._emit('\n'))
+            else:
+                out.append(self._advance_line())
+        return ''.join(out)
+
+    def flush(self) -> str:
+        out = self._finish_line()
+        self._whitespace = ''  # strip() cuối văn bản
+        return out
+
+    def _advance_line(self) -> str:
+        """Phát phần đầu dòng không còn bị thay đổi bởi phần sau của dòng"""
+        safe = self._line.rstrip(_TRAILING_HOLD)
+        while True:  # Cắt ở một marker có thể làm lộ marker chưa đóng khác phía trước
+            hold = _unclosed_marker(safe)
+            if hold == len(safe):
+                break
+            safe = safe[:hold].rstrip(_TRAILING_HOLD)
+        cleaned = os.path.commonprefix([clean_markdown_line(safe + tail) for tail in _CONTINUATIONS])
+        if not cleaned.startswith(self._line_emitted):
+            return ''
+        delta = cleaned[len(self._line_emitted):]
+        self._line_emitted = cleaned
+        return self._emit(delta)
+
+    def _finish_line(self) -> str:
+        cleaned = clean_markdown_line(self._line)
+        emitted = self._line_emitted
+        self._line, self._line_emitted = '', ''
+        # Phần đã gửi không rút lại được; nếu lệch (marker lồng nhau hiếm gặp) thì chỉ gửi phần còn thiếu
+        return self._emit(cleaned[len(emitted):])
+
+    def _emit(self, text: str) -> str:
+        """Gộp xuống dòng, bỏ khoảng trắng trước dấu câu ở dòng mới và strip đầu văn bản"""
+        buffer = self._whitespace + text
+        end = len(buffer.rstrip())
+        self._whitespace = buffer[end:]
+        head = buffer[:end]
+        if not head:
+            return ''
+        if not self._started:
+            head = head.lstrip()
+            self._started = True
+        head = re.sub(r'\s*\n\s*([.,!?])', r'\1', head)
+        return _EXCESS_NEWLINES.sub('\n\n', head)
+
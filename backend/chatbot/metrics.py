@@ -0,0 +1,233 @@
+"""
+Metrics dạng Prometheus (text exposition format 0.0.4) cho endpoint /metrics, không cần thêm dependency.
+
+- Counter / Histogram có label, thread-safe (sync chạy trên thread nền, /ask trên event loop).
+- CallbackMetric đọc giá trị lúc render từ các bộ đếm đã có sẵn (stats của cache, llm_client)
+  thay vì đếm lại lần nữa.
+- `with stage('search'):` ghi thời gian một stage vào histogram chatbot_stage_seconds và vào
+  RequestTimings của request hiện tại (ContextVar, do middleware tạo), dùng cho header Server-Timing.
+  Trong /ask_batch nhiều câu hỏi dùng chung một RequestTimings nên thời gian được cộng dồn.
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SERVER_TIMING=true: gắn header Server-Timing (thời gian từng stage) vào response
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SYNC_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+_registry: List['_Metric'] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {} if self.label_names else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [số quan sát theo bucket (không cộng dồn, phần tử cuối là +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)  # Bucket đầu tiên có le >= value
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def mean(self, **labels) -> Optional[float]:
+        series = self._series.get(self._key(labels))
+        return series[1] / series[2] if series and series[2] else None
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Giá trị lấy lúc render: `fn()` trả về một số, hoặc dict {giá trị label (tuple hoặc str): số}"""
+
+    def __init__(self, name: str, documentation: str, kind: str, fn: Callable, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được metric {self.name}: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_labels(self.label_names, key if isinstance(key, tuple) else (key,))} {_number(value)}"
+                for key, value in values.items() if value is not None]
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Timing theo request -------------------------------------------------------
+
+
+class RequestTimings:
+    """Thời gian cộng dồn của từng stage trong một request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Giá trị header Server-Timing, vd. `encode;dur=12.3, search;dur=1.1, total;dur=850.2`"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(parts)
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+def begin_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+# Metrics dùng chung --------------------------------------------------------
+
+REQUEST_SECONDS = Histogram('chatbot_request_seconds',
+                            'Thời gian tới khi trả header response, theo route và status code',
+                            labels=('route', 'status'))
+STAGE_SECONDS = Histogram('chatbot_stage_seconds',
+                          'Thời gian từng stage của /ask (encode, search, prompt, llm, postprocess, ...)',
+                          labels=('stage',))
+ANSWERS = Counter('chatbot_answers_total',
+                  'Câu trả lời theo nguồn (rag, general, cache, fallback_rag, fallback_general, error)',
+                  labels=('source',))
+LLM_RETRIES = Counter('chatbot_llm_retries_total', 'Số lần retry LLM sau lỗi quota')
+LLM_BACKOFF_SECONDS = Counter('chatbot_llm_backoff_seconds_total', 'Tổng thời gian chờ backoff trước khi retry LLM')
+LLM_ERRORS = Counter('chatbot_llm_errors_total', 'Lỗi từ LLM backend theo loại (quota, other)', labels=('kind',))
+SYNC_SECONDS = Histogram('chatbot_sync_seconds', 'Thời gian một lần sync lessons từ MongoDB', labels=('mode',),
+                         buckets=SYNC_BUCKETS)
+SYNC_RUNS = Counter('chatbot_sync_runs_total', 'Số lần sync theo kết quả (ok, failed, skipped)',
+                    labels=('mode', 'result'))
+LESSONS_EMBEDDED = Counter('chatbot_lessons_embedded_total',
+                           'Số lesson đã encode (sync, change stream, /admin/index_lessons)')
+RERANKS = Counter('chatbot_rerank_total',
+                  'Lượt re-rank theo bước (mmr, cross_encoder, all) và kết quả (applied, skipped_budget, skipped_load)',
+                  labels=('stage', 'result'))
+PROMPT_CONTEXT_TOKENS_HIST = Histogram('chatbot_prompt_context_tokens',
+                                       'Số token (ước lượng) của phần context tài liệu trong prompt',
+                                       buckets=(64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192))
@@ -0,0 +1,131 @@
+"""
+Ma trận embedding FAQ dạng nhị phân (.npy) được memory-map khi khởi động.
+
+Lần đầu (hoặc khi file parquet thay đổi) ma trận được chuẩn hoá L2 và ghi ra
+`english_qa_embeddings.npy` cạnh file parquet (hoặc trong EMBEDDINGS_CACHE_DIR), kèm file `.json`
+ghi fingerprint của parquet nguồn. Các lần sau chỉ đọc các cột metadata từ parquet và `np.load(mmap_mode='r')`
+ma trận: không phải parse cột embedding, và các uvicorn worker dùng chung trang nhớ
+qua page cache của hệ điều hành thay vì mỗi worker giữ một bản sao. File .npy được ghi theo từng
+block đọc từ parquet, nên lần build đầu cũng không cần giữ cả ma trận trong bộ nhớ.
+"""
+import json
+import logging
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from quantization import iter_embedding_blocks, read_embedding_matrix
+from vector_store import l2_normalize
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_MMAP = os.getenv('EMBEDDINGS_MMAP', 'true').lower() == 'true'
+# Thư mục chứa file .npy (+ .json) sinh ra lúc chạy; rỗng = cạnh file parquet
+EMBEDDINGS_CACHE_DIR = os.getenv('EMBEDDINGS_CACHE_DIR', '')
+
+
+def matrix_path_for(parquet_path: str, cache_dir: str = EMBEDDINGS_CACHE_DIR) -> str:
+    """english_qa_embeddings.parquet -> english_qa_embeddings.npy (trong cache_dir nếu có)"""
+    root = os.path.splitext(parquet_path)[0]
+    if cache_dir:
+        root = os.path.join(cache_dir, os.path.basename(root))
+    return root + '.npy'
+
+
+def _source_fingerprint(parquet_path: str) -> dict:
+    stat = os.stat(parquet_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def _read_meta(path: str) -> Optional[dict]:
+    try:
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path: str, meta: dict, shape: Tuple[int, int]):
+    with open(path + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump({**meta, 'rows': int(shape[0]), 'dim': int(shape[1])}, f)
+    os.replace(path + '.json.tmp', path + '.json')
+
+
+def write_matrix(matrix: np.ndarray, path: str, meta: dict):
+    """Ghi ma trận + meta theo kiểu atomic (tmp rồi os.replace) để worker khác không đọc file dở"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    os.replace(tmp, path)
+    _write_meta(path, meta, matrix.shape)
+
+
+def write_matrix_from_parquet(parquet_path: str, path: str, meta: dict, rows: int) -> bool:
+    """Chuẩn hoá + ghi cột embedding của parquet ra .npy theo từng block (atomic như write_matrix).
+    False nếu các block không cùng số chiều (parquet cũ có dòng rỗng), khi đó phải đọc cả ma trận"""
+    tmp = path + '.tmp'
+    out, start = None, 0
+    try:
+        for block in iter_embedding_blocks(parquet_path):
+            if out is None:
+                out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(rows, block.shape[1]))
+            if block.shape[1] != out.shape[1]:
+                return False
+            out[start:start + len(block)] = l2_normalize(block)
+            start += len(block)
+        if out is None or start != rows:
+            return False
+        out.flush()
+        shape = out.shape
+    finally:
+        del out
+        if start != rows and os.path.exists(tmp):
+            os.remove(tmp)
+    os.replace(tmp, path)
+    _write_meta(path, meta, shape)
+    return True
+
+
+def _read_metadata_columns(parquet_path: str) -> pd.DataFrame:
+    import pyarrow.parquet as pq
+
+    columns = [c for c in pq.read_schema(parquet_path).names if c != 'embedding']
+    return pd.read_parquet(parquet_path, columns=columns)
+
+
+def load_faq_table(parquet_path: str, use_mmap: bool = EMBEDDINGS_MMAP) -> Tuple[pd.DataFrame, Optional[np.ndarray]]:
+    """Trả về (DataFrame FAQ không có cột embedding, ma trận đã chuẩn hoá hoặc None nếu không có embedding).
+
+    Khi dùng mmap, ma trận là np.memmap chỉ đọc; ngược lại là ma trận trong bộ nhớ.
+    Cột embedding float32/float16/int8 (xem quantization) đều được đọc về float32.
+    """
+    if not use_mmap:
+        df = _read_metadata_columns(parquet_path)
+        return df, (l2_normalize(read_embedding_matrix(parquet_path)) if len(df) else None)
+
+    path = matrix_path_for(parquet_path)
+    fingerprint = _source_fingerprint(parquet_path)
+    meta = _read_meta(path)
+    if meta is not None and os.path.exists(path) and all(meta.get(k) == v for k, v in fingerprint.items()):
+        df = _read_metadata_columns(parquet_path)
+        matrix = np.load(path, mmap_mode='r')
+        if len(df) == len(matrix):
+            logger.info(f"✅ Memory-mapped {matrix.shape[0]}x{matrix.shape[1]} embeddings từ {path}")
+            return df, matrix
+        logger.warning(f"⚠️ {path} không khớp số dòng với {parquet_path}, ghi lại")
+
+    # Lần đầu hoặc parquet đã đổi: đọc cột embedding một lần rồi ghi file nhị phân
+    df = _read_metadata_columns(parquet_path)
+    if df.empty:
+        return df, None
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if not write_matrix_from_parquet(parquet_path, path, fingerprint, len(df)):
+            write_matrix(l2_normalize(read_embedding_matrix(parquet_path)), path, fingerprint)
+        logger.info(f"💾 Đã ghi ma trận embedding nhị phân {path}")
+        return df, np.load(path, mmap_mode='r')
+    except OSError as e:
+        logger.warning(f"⚠️ Không ghi được {path} ({e}), dùng ma trận trong bộ nhớ")
+        return df, l2_normalize(read_embedding_matrix(parquet_path))
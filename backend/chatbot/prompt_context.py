@@ -0,0 +1,62 @@
+"""
+Dựng phần "Thông tin tham khảo" của prompt từ các hit retrieval, trong giới hạn token.
+
+Các hit đã được gộp theo lesson (mỗi lesson một passage, xem VectorStore.collapse_passages) và
+sắp giảm dần theo điểm. Hit được thêm lần lượt tới khi hết PROMPT_CONTEXT_TOKENS; hit đầu tiên
+không vừa thì được cắt ở ranh giới từ (nếu còn đủ chỗ cho một đoạn có nghĩa) rồi dừng.
+
+Không có tokenizer của Gemini ở phía server nên số token được ước lượng theo số ký tự
+(PROMPT_CHARS_PER_TOKEN), đủ để giữ kích thước prompt ổn định.
+"""
+import os
+from typing import List, Tuple
+
+from corpus import Hit
+
+PROMPT_CONTEXT_TOKENS = int(os.getenv('PROMPT_CONTEXT_TOKENS', '1200'))
+PROMPT_CHARS_PER_TOKEN = float(os.getenv('PROMPT_CHARS_PER_TOKEN', '3.5'))
+# Phần còn lại của budget nhỏ hơn mức này thì không cắt thêm hit nữa
+PROMPT_MIN_SNIPPET_TOKENS = int(os.getenv('PROMPT_MIN_SNIPPET_TOKENS', '48'))
+
+NO_CONTEXT = "Không tìm thấy thông tin liên quan trong cơ sở dữ liệu."
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / PROMPT_CHARS_PER_TOKEN) + 1
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(' ', max_chars // 2, max_chars)
+    return text[:cut if cut != -1 else max_chars].rstrip() + "..."
+
+
+def format_hit(hit: Hit, answer: str) -> str:
+    """FAQ: câu hỏi + trả lời; lesson: tiêu đề + nội dung passage (question của passage là text đã embed)"""
+    if hit.lesson_id is not None:
+        return f"Bài học: {hit.label}\nNội dung: {answer}\nDanh mục: {hit.category}"
+    return f"Câu hỏi: {hit.question}\nTrả lời: {answer}\nDanh mục: {hit.category}"
+
+
+def assemble_context(hits: List[Hit], budget: int = PROMPT_CONTEXT_TOKENS) -> Tuple[str, int]:
+    """Trả về (document cho prompt, số token ước lượng)"""
+    if not hits:
+        return NO_CONTEXT, estimate_tokens(NO_CONTEXT)
+    blocks: List[str] = []
+    used = 0
+    for hit in hits:
+        separator = 1 if blocks else 0  # "\n\n"
+        block = format_hit(hit, hit.answer)
+        cost = estimate_tokens(block) + separator
+        if used + cost <= budget:
+            blocks.append(block)
+            used += cost
+            continue
+        remaining = budget - used - separator - estimate_tokens(format_hit(hit, ''))
+        if remaining >= PROMPT_MIN_SNIPPET_TOKENS or not blocks:
+            block = format_hit(hit, _truncate(hit.answer, max(int(remaining * PROMPT_CHARS_PER_TOKEN), 0)))
+            blocks.append(block)
+            used += estimate_tokens(block) + separator
+        break
+    return "\n\n".join(blocks), used
@@ -0,0 +1,324 @@
+"""
+Embedding lượng tử hoá (float16 / int8) cho lưu trữ và tìm kiếm.
+
+Lưu trữ: `create_embeddings_st.py --dtype` ghi cột embedding của parquet dạng
+fixed_size_list<float32|halffloat|int8>[dim] (file cũ dạng list<...> vẫn đọc được). Với int8, vector
+được chuẩn hoá L2 rồi lượng tử hoá đối xứng theo từng chiều (scale_j = max|x_j| / 127), mảng scale
+nằm trong metadata của file parquet. `read_embedding_matrix` / `iter_embedding_blocks` đọc cột này
+thẳng sang numpy (không qua list Python) và giải lượng tử; `EmbeddingParquetWriter` ghi từng row group
+để dataset lớn không phải nằm trọn trong bộ nhớ.
+
+Tìm kiếm (EMBEDDING_DTYPE=float16|int8): first pass top-k trên ma trận lượng tử hoá (quét theo
+block để bộ nhớ tạm không phụ thuộc N), lấy shortlist k * RESCORE_FACTOR rồi chấm lại bằng
+ma trận float32. Ma trận float32 chỉ bị đọc ở các dòng trong shortlist, nên khi nó được
+memory-map (file .npy, shared index) phần nằm thường trú trong RAM chủ yếu là ma trận lượng tử hoá.
+int8 là lựa chọn khuyến nghị: numpy đổi float16 -> float32 khá chậm nên first pass float16 tiết kiệm
+bộ nhớ nhưng chậm hơn float32 (xem `python -m benchmarks.quantization`).
+"""
+import json
+import logging
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ann_index import _EMPTY, query_blocks, top_k_from_scores, top_k_rows
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', 'float32').lower()
+RESCORE_FACTOR = int(os.getenv('RESCORE_FACTOR', '8'))
+QUANTIZED_DTYPES = ('float16', 'int8')
+SCAN_BLOCK_ROWS = int(os.getenv('QUANTIZED_SCAN_BLOCK_ROWS', '1024'))  # Block nhỏ để nằm trong cache CPU
+_METADATA_KEY = b'embedding_quantization'
+# Model / số chiều / hash nguồn mà create_embeddings_st.py ghi vào file (để build incremental)
+EMBEDDING_INFO_KEY = b'embedding_model'
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Lượng tử hoá đối xứng theo từng chiều: trả về (codes int8, scales float32)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=0) / 127.0 if len(matrix) else np.ones(matrix.shape[1], dtype=np.float32)
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+class QuantizedMatrix:
+    """Ma trận float16, hoặc int8 + scale theo chiều, với phép nhân ma trận-vector theo block"""
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_float(cls, matrix: np.ndarray, dtype: str) -> 'QuantizedMatrix':
+        if dtype == 'int8':
+            return cls(*quantize_int8(matrix))
+        if dtype == 'float16':
+            return cls(np.asarray(matrix, dtype=np.float16))
+        raise ValueError(f"Unsupported quantized dtype: {dtype}")
+
+    @property
+    def dtype(self) -> str:
+        return str(self.codes.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def scores(self, query: np.ndarray, block_rows: int = SCAN_BLOCK_ROWS) -> np.ndarray:
+        """Điểm xấp xỉ codes @ query (query (d,) -> (N,), batch (Q, d) -> (N, Q));
+        mỗi block được đổi sang float32 một lần rồi nhân bằng BLAS cho cả batch"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.scales is not None:
+            query = query * self.scales  # (codes * scales) @ q == codes @ (scales * q)
+        out = np.empty((len(self.codes),) + query.shape[:-1], dtype=np.float32)
+        for start in range(0, len(self.codes), block_rows):
+            block = self.codes[start:start + block_rows]
+            np.dot(block.astype(np.float32), query.T, out=out[start:start + len(block)])
+        return out
+
+
+class QuantizedIndex:
+    """Brute-force trên ma trận lượng tử hoá + rescoring float32 trên shortlist"""
+
+    def __init__(self, matrix: np.ndarray, quantized: QuantizedMatrix, rescore_factor: int = RESCORE_FACTOR):
+        self.matrix = matrix
+        self.quantized = quantized
+        self.rescore_factor = max(1, rescore_factor)
+        self.name = f"flat-{quantized.dtype}"
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, dtype: str = EMBEDDING_DTYPE,
+              rescore_factor: int = RESCORE_FACTOR) -> 'QuantizedIndex':
+        return cls(matrix, QuantizedMatrix.from_float(matrix, dtype), rescore_factor)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.matrix) == 0:
+            return _EMPTY
+        shortlist, _ = top_k_from_scores(self.quantized.scores(query), k * self.rescore_factor)
+        shortlist = np.sort(shortlist)  # Đọc memmap theo thứ tự tăng dần
+        return top_k_from_scores(self.matrix[shortlist] @ query, k, ids=shortlist)
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """First pass cho cả batch trong một lượt quét ma trận lượng tử hoá, rescoring từng query"""
+        if len(self.matrix) == 0:
+            return [_EMPTY] * len(queries)
+        results = []
+        for block in query_blocks(len(queries), len(self.matrix)):
+            shortlists = top_k_rows(self.quantized.scores(queries[block]).T, k * self.rescore_factor)
+            for query, (shortlist, _) in zip(queries[block], shortlists):
+                shortlist = np.sort(shortlist)
+                results.append(top_k_from_scores(self.matrix[shortlist] @ query, k, ids=shortlist))
+        return results
+
+    def save(self, path: str, fingerprint: str):
+        """Ghi codes (.npy) + scale / fingerprint (.json). Chỉ shared index dùng: các worker memory-map
+        chung một bản codes thay vì mỗi worker giữ một bản (một process thì dựng lại rẻ hơn đọc từ đĩa)"""
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, self.quantized.codes)
+        os.replace(path + '.tmp', path)
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': fingerprint, 'dtype': self.quantized.dtype,
+                       'scales': None if self.quantized.scales is None else self.quantized.scales.tolist()}, f)
+
+    @classmethod
+    def load(cls, path: str, matrix: np.ndarray, fingerprint: str) -> Optional['QuantizedIndex']:
+        if not (os.path.exists(path) and os.path.exists(path + '.json')):
+            return None
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        codes = np.load(path, mmap_mode='r')
+        if info.get('fingerprint') != fingerprint or len(codes) != len(matrix):
+            return None
+        scales = None if info.get('scales') is None else np.asarray(info['scales'], dtype=np.float32)
+        return cls(matrix, QuantizedMatrix(codes, scales))
+
+
+def quantized_index_path(base_path: str, dtype: str) -> str:
+    """File codes của QuantizedIndex đặt cạnh `base_path`, vd. static-<fp>.int8.npy"""
+    return os.path.splitext(base_path)[0] + f'.{dtype}.npy'
+
+
+# Lưu trữ parquet ---------------------------------------------------------
+
+
+_STORAGE_NUMPY_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+
+def _encode_values(matrix: np.ndarray, dtype: str, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if dtype == 'int8':
+        return np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+    if dtype not in _STORAGE_NUMPY_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    return matrix.astype(_STORAGE_NUMPY_DTYPES[dtype], copy=False)
+
+
+def _scales_metadata(scales: np.ndarray) -> dict:
+    return {_METADATA_KEY: json.dumps({'dtype': 'int8', 'scales': np.asarray(scales).tolist()}).encode()}
+
+
+def embedding_column(matrix: np.ndarray, dtype: str = 'float32', scales: Optional[np.ndarray] = None):
+    """Cột embedding fixed_size_list<dtype>[dim], kèm metadata lượng tử hoá (nếu có).
+    int8: `scales` cho trước (ghi theo chunk với scale chung của cả file) hoặc tính từ chính `matrix`"""
+    import pyarrow as pa
+
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    metadata = {}
+    if dtype == 'int8':
+        if scales is None:
+            _, scales = quantize_int8(matrix)
+        metadata = _scales_metadata(scales)
+    values = _encode_values(matrix, dtype, scales)
+    return pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), matrix.shape[1]), metadata
+
+
+def write_embeddings_parquet(df, matrix: np.ndarray, path: str, dtype: str = 'float32', info: Optional[dict] = None):
+    """Ghi DataFrame (không có cột embedding) + ma trận embedding với dtype lưu trữ đã chọn;
+    `info` (model, dim, ...) được lưu trong metadata của file, đọc lại bằng read_embedding_info"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    column, metadata = embedding_column(matrix, dtype)
+    if info is not None:
+        metadata[EMBEDDING_INFO_KEY] = json.dumps(info).encode()
+    table = pa.Table.from_pandas(df.drop(columns=['embedding'], errors='ignore'), preserve_index=False)
+    table = table.append_column('embedding', column)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    pq.write_table(table, path)
+
+
+class EmbeddingParquetWriter:
+    """Ghi parquet từng row group: các cột metadata (dict tên -> pyarrow array / list) + ma trận embedding.
+
+    Schema (và metadata của file) cố định lúc mở, nên với int8 `scales` phải biết trước
+    (xem `requantize_embeddings_parquet`).
+    """
+
+    def __init__(self, path: str, fields: List[Tuple[str, object]], dim: int, dtype: str = 'float32',
+                 info: Optional[dict] = None, scales: Optional[np.ndarray] = None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if dtype == 'int8' and scales is None:
+            raise ValueError("int8 storage needs precomputed scales")
+        if dtype not in _STORAGE_NUMPY_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.dtype = dtype
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        self.rows = 0
+        metadata = _scales_metadata(self.scales) if dtype == 'int8' else {}
+        if info is not None:
+            metadata[EMBEDDING_INFO_KEY] = json.dumps(info).encode()
+        value_type = pa.from_numpy_dtype(_STORAGE_NUMPY_DTYPES[dtype])
+        self.schema = pa.schema([pa.field(name, type_) for name, type_ in fields]
+                                + [pa.field('embedding', pa.list_(value_type, dim))], metadata=metadata)
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, columns: dict, matrix: np.ndarray):
+        import pyarrow as pa
+
+        values = _encode_values(matrix, self.dtype, self.scales)
+        embedding = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1])
+        arrays = [pa.array(columns[field.name], type=field.type) for field in self.schema
+                  if field.name != 'embedding']
+        self._writer.write_table(pa.Table.from_arrays(arrays + [embedding], schema=self.schema))
+        self.rows += len(values)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self) -> 'EmbeddingParquetWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def requantize_embeddings_parquet(src: str, dst: str, dtype: str, info: Optional[dict] = None):
+    """Ghi lại `src` (float32) với dtype lưu trữ khác, hai lượt đọc theo row group:
+    lượt đầu tìm max|x_j| (scale int8 của cả file), lượt sau lượng tử hoá và ghi"""
+    import pyarrow.parquet as pq
+
+    scales = None
+    if dtype == 'int8':
+        max_abs = None
+        for block in iter_embedding_blocks(src):
+            block_max = np.abs(block).max(axis=0)
+            max_abs = block_max if max_abs is None else np.maximum(max_abs, block_max)
+        scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+    source = pq.ParquetFile(src)
+    fields = [(field.name, field.type) for field in source.schema_arrow if field.name != 'embedding']
+    dim = source.schema_arrow.field('embedding').type.list_size
+    with EmbeddingParquetWriter(dst, fields, dim, dtype=dtype, info=info, scales=scales) as writer:
+        for i in range(source.num_row_groups):
+            group = source.read_row_group(i)
+            writer.write({name: group.column(name) for name, _ in fields}, _embedding_values(group.column('embedding')))
+
+
+def read_embedding_info(path: str) -> Optional[dict]:
+    """Metadata model của file embedding (None nếu file cũ không có)"""
+    import pyarrow.parquet as pq
+
+    info = (pq.read_schema(path).metadata or {}).get(EMBEDDING_INFO_KEY)
+    return json.loads(info) if info is not None else None
+
+
+def embedding_storage_dtype(path: str) -> Optional[str]:
+    """Kiểu lưu cột embedding: 'float32' | 'float16' | 'int8' (None nếu không phải list số)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    field = pq.read_schema(path).field('embedding')
+    if not (pa.types.is_list(field.type) or pa.types.is_fixed_size_list(field.type)):
+        return None
+    return {pa.float32(): 'float32', pa.float16(): 'float16', pa.int8(): 'int8'}.get(field.type.value_type)
+
+
+def _embedding_values(column) -> np.ndarray:
+    """Cột embedding pyarrow -> ma trận theo dtype lưu trữ (chưa giải lượng tử)"""
+    from vector_store import embeddings_to_matrix
+
+    if hasattr(column, 'combine_chunks'):
+        column = column.combine_chunks()
+    n = len(column)
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    if column.null_count or (n and values.size % n):
+        # Dòng rỗng / độ dài không đều (parquet cũ): đi đường chậm qua list Python
+        return embeddings_to_matrix(column.to_pylist())
+    return values.reshape(n, values.size // n if n else 0)
+
+
+def _dequantize(matrix: np.ndarray, metadata: Optional[dict]) -> np.ndarray:
+    info = (metadata or {}).get(_METADATA_KEY)
+    if info is not None:
+        scales = np.asarray(json.loads(info)['scales'], dtype=np.float32)
+        return matrix.astype(np.float32) * scales
+    return np.ascontiguousarray(matrix, dtype=np.float32)
+
+
+def read_embedding_matrix(path: str) -> np.ndarray:
+    """Đọc cột embedding của parquet thành ma trận float32 (giải lượng tử nếu file lưu int8)"""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=['embedding'])
+    if table.num_rows == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return _dequantize(_embedding_values(table.column('embedding')), table.schema.metadata)
+
+
+def iter_embedding_blocks(path: str) -> Iterator[np.ndarray]:
+    """Như read_embedding_matrix nhưng trả về từng row group dạng float32 (bộ nhớ tạm cỡ một row group).
+    Đọc bằng read_row_group chứ không iter_batches: reader của pyarrow đọc trước nhiều row group một lúc"""
+    import pyarrow.parquet as pq
+
+    source = pq.ParquetFile(path)
+    metadata = source.schema_arrow.metadata
+    for i in range(source.num_row_groups):
+        yield _dequantize(_embedding_values(source.read_row_group(i, columns=['embedding']).column(0)), metadata)
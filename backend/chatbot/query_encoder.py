@@ -0,0 +1,129 @@
+"""
+Query encoder gom batch (micro-batching) cho các request /ask đồng thời.
+
+Các câu hỏi đến trong vòng vài ms được gom lại và encode bằng một lần gọi
+`SentenceTransformer.encode` trên worker thread, nên event loop không bị chặn
+và mỗi request không phải trả chi phí transformer cho batch size 1.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUERY_BATCH_MAX_SIZE = int(os.getenv('QUERY_BATCH_MAX_SIZE', '32'))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv('QUERY_BATCH_MAX_WAIT_MS', '5'))
+# Batch size bên trong model.encode (giới hạn bộ nhớ khi encode_many nhận hàng trăm câu)
+ENCODE_BATCH_SIZE = int(os.getenv('ENCODE_BATCH_SIZE', '64'))
+
+
+class BatchingQueryEncoder:
+    """Gom các câu hỏi thành batch rồi encode trên một worker thread riêng"""
+
+    def __init__(self, model_getter: Callable, max_batch: int = QUERY_BATCH_MAX_SIZE,
+                 max_wait_ms: float = QUERY_BATCH_MAX_WAIT_MS):
+        self._model_getter = model_getter
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query-encoder')
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+        self.batches = 0
+        self.encoded = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Encode một câu hỏi; được gom batch cùng các request đến gần cùng lúc"""
+        if self._model_getter() is None:
+            raise RuntimeError('Sentence model not loaded')
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def encode_many(self, texts: List[str]) -> np.ndarray:
+        """Encode cả danh sách (vd. /ask_batch) bằng một lần gọi model.encode trên worker thread"""
+        if self._model_getter() is None:
+            raise RuntimeError('Sentence model not loaded')
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        embeddings = await loop.run_in_executor(self._executor, self._encode_sync, list(texts))
+        self.batches += 1
+        self.encoded += len(texts)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Lấy ngay các item đã chờ sẵn (tích luỹ trong lúc batch trước đang encode)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._encode_batch(batch)
+
+    async def _encode_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        pending = [(text, fut) for text, fut in batch if not fut.done()]
+        if not pending:
+            return
+        texts = [text for text, _ in pending]
+        try:
+            embeddings = await self._loop.run_in_executor(self._executor, self._encode_sync, texts)
+        except Exception as e:
+            logger.error(f"Lỗi khi encode batch {len(texts)} câu hỏi: {e}")
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        self.batches += 1
+        self.encoded += len(texts)
+        for (_, fut), embedding in zip(pending, embeddings):
+            if not fut.done():
+                fut.set_result(embedding)
+
+    def _encode_sync(self, texts: List[str]) -> np.ndarray:
+        model = self._model_getter()
+        if model is None:
+            raise RuntimeError('Sentence model not loaded')
+        return model.encode(texts, batch_size=min(len(texts), ENCODE_BATCH_SIZE), convert_to_numpy=True,
+                            show_progress_bar=False)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+        }
+
+    async def stop(self):
+        """Dừng task gom batch (executor được giữ lại để có thể khởi động lại)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
@@ -0,0 +1,197 @@
+"""
+Re-rank các ứng viên retrieval trước khi dựng prompt (RERANK_MODE, mặc định tắt).
+
+Khi bật, search lấy một pool RERANK_POOL ứng viên (đã gộp passage theo lesson) thay vì top_k, rồi:
+- `mmr`: maximal marginal relevance trên embedding của pool (một phép nhân pool x pool rồi chọn
+  tham lam), thay các FAQ gần trùng nhau bằng tài liệu bổ sung thông tin cho nhau. Ứng viên đầu tiên
+  của retriever (hoặc của cross-encoder) luôn được giữ ở vị trí đầu.
+- `cross_encoder`: chấm lại pool bằng một cross-encoder nhỏ chạy local (RERANK_CROSS_ENCODER_MODEL,
+  load cùng SentenceTransformer lúc khởi động); cần câu hỏi dạng text.
+- `cross_encoder+mmr`: thứ tự và relevance từ cross-encoder, rồi đa dạng hoá bằng MMR.
+
+Re-rank chạy cùng search trên thread pool (không chạy trên event loop) và có budget: mỗi bước đo chi
+phí trên một ứng viên (EWMA, ms / cặp với cross-encoder, ms / ứng viên với MMR). Trước khi chạy, pool
+được cắt còn số ứng viên đầu (theo retriever) mà tổng chi phí ước lượng vừa RERANK_BUDGET_MS; nếu
+không còn chỗ cho top_k + 1 ứng viên thì bỏ bước đắt nhất (cứ _PROBE_AFTER_SKIPS lần bỏ qua thì chạy
+một lần với top_k + 1 ứng viên để đo lại). Khi đang tải cao (số call LLM đang chạy >= RERANK_MAX_LOAD)
+thì bỏ qua toàn bộ, chỉ cắt về top_k. Điểm trả về vẫn là cosine của retriever.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import RERANKS
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODE = os.getenv('RERANK_MODE', 'none')
+RERANK_POOL = int(os.getenv('RERANK_POOL', '20'))
+# 1.0 = chỉ relevance (không đa dạng hoá), 0.0 = chỉ đa dạng
+RERANK_MMR_LAMBDA = float(os.getenv('RERANK_MMR_LAMBDA', '0.7'))
+RERANK_CROSS_ENCODER_MODEL = os.getenv('RERANK_CROSS_ENCODER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '25'))
+RERANK_MAX_LOAD = int(os.getenv('RERANK_MAX_LOAD', '8'))
+RERANK_PASSAGE_CHARS = 512  # Độ dài text (question + answer) đưa vào cross-encoder
+_COST_ALPHA = 0.2  # Trọng số của lần đo mới trong EWMA
+_PROBE_AFTER_SKIPS = 100  # Sau ngần này lần bỏ qua vì budget, chạy lại một lần (pool nhỏ nhất) để đo lại
+_STAGES = ('mmr', 'cross_encoder')
+
+
+def mmr_order(candidates: np.ndarray, relevance: np.ndarray, k: int, mmr_lambda: float = RERANK_MMR_LAMBDA,
+              first: int = 0) -> np.ndarray:
+    """Vị trí (trong pool) của k ứng viên theo MMR: λ·relevance − (1 − λ)·max cosine với các ứng viên đã chọn.
+    `candidates` là embedding đã chuẩn hoá (n, d); ứng viên `first` được chọn đầu tiên."""
+    n = len(candidates)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    similarity = candidates @ candidates.T
+    chosen = [first]
+    available = np.ones(n, dtype=bool)
+    available[first] = False
+    redundancy = similarity[first].copy()  # Cosine lớn nhất tới các ứng viên đã chọn
+    while len(chosen) < k:
+        score = mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        chosen.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return np.asarray(chosen, dtype=np.int64)
+
+
+class Reranker:
+    """Pool lớn + MMR / cross-encoder, có budget latency và ngưỡng tải"""
+
+    def __init__(self, mode: str = RERANK_MODE, pool: int = RERANK_POOL, mmr_lambda: float = RERANK_MMR_LAMBDA,
+                 budget_ms: float = RERANK_BUDGET_MS, max_load: int = RERANK_MAX_LOAD,
+                 load: Optional[Callable[[], int]] = None):
+        self.stages = {name for name in mode.replace(' ', '').split('+') if name in _STAGES}
+        unknown = {name for name in mode.replace(' ', '').split('+') if name and name not in _STAGES + ('none',)}
+        if unknown:
+            logger.warning(f"⚠️ RERANK_MODE không hợp lệ: {sorted(unknown)} (dùng: none, mmr, cross_encoder, cross_encoder+mmr)")
+        self.pool = pool
+        self.mmr_lambda = mmr_lambda
+        self.budget_ms = budget_ms
+        self.max_load = max_load
+        self.load = load
+        self.cross_encoder = None
+        self.cost_ms = {name: 0.0 for name in _STAGES}  # ms mỗi ứng viên, 0 = chưa đo
+        self._skips = {name: 0 for name in _STAGES}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.stages)
+
+    def pool_size(self, top_k: int) -> int:
+        return max(self.pool, top_k) if self.enabled else top_k
+
+    def load_cross_encoder(self, model_name: str = RERANK_CROSS_ENCODER_MODEL):
+        """Load cross-encoder (nếu RERANK_MODE có cross_encoder); lỗi thì chỉ còn MMR"""
+        if 'cross_encoder' not in self.stages or self.cross_encoder is not None:
+            return
+        try:
+            from sentence_transformers import CrossEncoder
+
+            self.cross_encoder = CrossEncoder(model_name)
+            logger.info(f"✅ Đã load cross-encoder {model_name}")
+        except Exception as e:
+            logger.warning(f"⚠️ Không load được cross-encoder {model_name} ({e}), chỉ dùng MMR nếu bật")
+
+    def _plan(self, stages: List[str], n: int, top_k: int) -> Tuple[List[str], int]:
+        """(các bước sẽ chạy, số ứng viên đầu của pool) sao cho tổng chi phí ước lượng vừa budget"""
+        stages = list(stages)
+        while stages:
+            per_item = sum(self.cost_ms[name] for name in stages)
+            fits = self.budget_ms / per_item if per_item > 0.0 else float('inf')
+            cap = n if fits >= n else int(fits)
+            if cap >= min(n, top_k + 1):  # Cần top_k + 1 ứng viên (hoặc cả pool) mới đổi được top_k
+                return stages, cap
+            expensive = max(stages, key=lambda name: self.cost_ms[name])
+            with self._lock:
+                self._skips[expensive] += 1
+                probe = self._skips[expensive] >= _PROBE_AFTER_SKIPS
+                if probe:
+                    self._skips[expensive] = 0
+            if probe:
+                return stages, min(n, top_k + 1)
+            RERANKS.inc(stage=expensive, result='skipped_budget')
+            stages.remove(expensive)
+        return stages, n
+
+    def _record(self, name: str, started: float, items: int):
+        per_item = (time.perf_counter() - started) * 1000 / max(items, 1)
+        with self._lock:
+            cost = self.cost_ms[name]
+            self.cost_ms[name] = per_item if cost == 0.0 else (1 - _COST_ALPHA) * cost + _COST_ALPHA * per_item
+            self._skips[name] = 0
+        RERANKS.inc(stage=name, result='applied')
+
+    def _cross_scores(self, store, indices: np.ndarray, text: str) -> np.ndarray:
+        questions = store.questions.to_list(indices)
+        answers = store.answers.to_list(indices)
+        pairs = [(text, f"{q or ''}\n{a or ''}"[:RERANK_PASSAGE_CHARS]) for q, a in zip(questions, answers)]
+        logits = np.asarray(self.cross_encoder.predict(pairs, show_progress_bar=False), dtype=np.float32).reshape(-1)
+        return 1.0 / (1.0 + np.exp(-logits))  # Cùng thang [0, 1] với cosine cho MMR
+
+    def rerank(self, store, query_embedding: np.ndarray, indices: np.ndarray, scores: np.ndarray, top_k: int,
+               text: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Chọn top_k trong pool (indices đã sắp theo retriever), trả về (indices, cosine) theo thứ tự mới"""
+        if not self.enabled or len(indices) <= 1:
+            return indices[:top_k], scores[:top_k]
+        if self.load is not None and self.load() >= self.max_load:
+            RERANKS.inc(stage='all', result='skipped_load')
+            return indices[:top_k], scores[:top_k]
+
+        wanted = []
+        if 'cross_encoder' in self.stages and self.cross_encoder is not None and text:
+            wanted.append('cross_encoder')
+        if 'mmr' in self.stages and len(indices) > top_k:
+            wanted.append('mmr')
+        stages, n = self._plan(wanted, len(indices), top_k)
+        indices, scores = indices[:n], scores[:n]
+
+        order = np.arange(len(indices))
+        relevance: Optional[np.ndarray] = None
+        if 'cross_encoder' in stages:
+            started = time.perf_counter()
+            cross = self._cross_scores(store, indices, text)
+            order = np.argsort(-cross, kind='stable')
+            relevance = cross[order]
+            self._record('cross_encoder', started, len(indices))
+
+        if 'mmr' in stages and len(order) > top_k:
+            started = time.perf_counter()
+            candidates = store.vectors(indices[order])
+            if relevance is None:
+                query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+                relevance = candidates @ (query / max(float(np.linalg.norm(query)), 1e-12))
+            order = order[mmr_order(candidates, relevance, top_k, self.mmr_lambda)]
+            self._record('mmr', started, len(indices))
+
+        order = order[:top_k]
+        return indices[order], scores[order]
+
+    def stats(self) -> dict:
+        return {
+            'mode': '+'.join(sorted(self.stages)) or 'none',
+            'pool': self.pool,
+            'budget_ms': self.budget_ms,
+            'cost_ms_per_candidate': {name: round(cost, 4) for name, cost in self.cost_ms.items() if name in self.stages},
+            'cross_encoder_loaded': self.cross_encoder is not None,
+        }
+
+
+def redundancy(store, indices: List[int]) -> float:
+    """Cosine trung bình giữa các cặp tài liệu trong một kết quả (càng thấp càng ít trùng lặp)"""
+    if len(indices) < 2:
+        return 0.0
+    vectors = store.vectors(indices)
+    similarity = vectors @ vectors.T
+    n = len(indices)
+    return float((similarity.sum() - np.trace(similarity)) / (n * (n - 1)))
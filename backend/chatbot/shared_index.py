@@ -0,0 +1,266 @@
+"""
+Chia sẻ index giữa nhiều uvicorn worker (SHARED_INDEX=true, bật bởi `start_server.py --workers N`).
+
+- Phần tĩnh (FAQ) được ghi một lần theo fingerprint: ma trận `static-<fp>.npy` + index đã dựng của nó
+  (`static-<fp>.ivf.npz`, `.hnsw.bin` hoặc codes lượng tử hoá `static-<fp>.int8.npy`), nên worker khác
+  không phải dựng lại ANN / lượng tử hoá và không phục vụ bằng flat index.
+- Mỗi lần một process publish snapshot mới, nó ghi snapshot đó ra SHARED_INDEX_DIR thành một
+  version bất biến: ma trận các dòng lesson (`v00000012.npy`) + metadata mọi dòng
+  (`v00000012.meta.parquet`, schema metadata ghi fingerprint phần tĩnh), rồi trỏ manifest
+  `CURRENT.json` sang version mới bằng os.replace.
+- Các worker khác poll manifest và memory-map version mới, nên N worker dùng chung một bản
+  ma trận qua page cache thay vì mỗi worker giữ một bản.
+- Mọi thao tác ghi (sync, index lesson) chạy dưới file lock `write.lock`, nên không còn
+  race khi ghi lesson log / parquet.
+- Leader election: chỉ process giữ được `sync.lock` (flock không chặn) mới chạy sync định kỳ /
+  change stream; lock tự nhả khi process chết nên worker khác sẽ lên thay.
+- Chỉ index được chia sẻ: mỗi worker vẫn tự load SentenceTransformer (và cross-encoder nếu bật
+  re-rank), nên bộ nhớ model tăng tuyến tính theo số worker (xem README).
+"""
+import glob
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from ann_index import matrix_fingerprint
+from vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+SHARED_INDEX = os.getenv('SHARED_INDEX', 'false').lower() == 'true'
+SHARED_INDEX_DIR = os.getenv('SHARED_INDEX_DIR', './index_store')
+SHARED_INDEX_POLL_SECONDS = float(os.getenv('SHARED_INDEX_POLL_SECONDS', '2'))
+SHARED_INDEX_KEEP_VERSIONS = int(os.getenv('SHARED_INDEX_KEEP_VERSIONS', '3'))
+
+try:
+    import fcntl
+
+    def _lock_fd(fd: int, blocking: bool) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock_fd(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock_fd(fd: int, blocking: bool) -> bool:
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.05)
+
+    def _unlock_fd(fd: int):
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Lock độc quyền giữa các process dựa trên flock (msvcrt trên Windows)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not _lock_fd(fd, blocking):
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            _unlock_fd(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class SharedIndexStore:
+    """Các version index trên đĩa + manifest CURRENT.json + write lock giữa các process"""
+
+    def __init__(self, directory: str = SHARED_INDEX_DIR, keep_versions: int = SHARED_INDEX_KEEP_VERSIONS):
+        self.directory = directory
+        self.keep_versions = max(2, keep_versions)
+        self.manifest_path = os.path.join(directory, 'CURRENT.json')
+        self.loaded_version = 0  # Version trên đĩa mà process này đang phục vụ
+        self._write_lock = FileLock(os.path.join(directory, 'write.lock'))
+        # (fingerprint, static_matrix, static_index) của phần tĩnh gần nhất đã ghi / load: các snapshot
+        # dùng chung object static_matrix nên chỉ hash một lần và version sau dùng lại index đã có
+        self._static: Optional[Tuple[str, np.ndarray, object]] = None
+
+    @contextmanager
+    def write_lock(self):
+        self._write_lock.acquire(blocking=True)
+        try:
+            yield
+        finally:
+            self._write_lock.release()
+
+    def current_version(self) -> int:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return int(json.load(f)['version'])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _paths(self, version: int) -> Tuple[str, str]:
+        base = os.path.join(self.directory, f"v{version:08d}")
+        return base + '.npy', base + '.meta.parquet'
+
+    def _static_base(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, f"static-{fingerprint}.npy")
+
+    def _save_static(self, store: VectorStore) -> str:
+        """Ghi phần tĩnh + index của nó nếu chưa có trên đĩa, trả về fingerprint"""
+        if self._static is not None and self._static[1] is store.static_matrix:
+            fingerprint = self._static[0]
+        else:
+            fingerprint = matrix_fingerprint(store.static_matrix)
+            self._static = (fingerprint, store.static_matrix, store.static_index)
+        path = self._static_base(fingerprint)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(store.static_matrix, dtype=np.float32))
+            os.replace(path + '.tmp', path)
+            try:
+                store.save_static_index(path, fingerprint)
+            except Exception as e:
+                logger.warning(f"⚠️ Không lưu được index phần tĩnh ({store.static_index.name}): {e}")
+            logger.info(f"💾 Shared index: phần tĩnh {len(store.static_matrix)} vectors ({store.static_index.name}) -> {path}")
+        return fingerprint
+
+    def save(self, store: VectorStore) -> int:
+        """Ghi snapshot thành version mới và trỏ manifest sang nó. Caller giữ write_lock()."""
+        os.makedirs(self.directory, exist_ok=True)
+        version = self.current_version() + 1
+        matrix_path, meta_path = self._paths(version)
+        fingerprint = self._save_static(store)
+
+        # Metadata theo thứ tự dòng của store (phần tĩnh rồi các passage lesson còn sống), ma trận
+        # version chỉ gồm các dòng lesson nên version load lại tự nhất quán
+        rows = store.live_rows()
+        lesson_rows = rows[store.n_static:]
+        with open(matrix_path + '.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(store.vectors(lesson_rows), dtype=np.float32))
+        os.replace(matrix_path + '.tmp', matrix_path)
+        table = store.to_arrow(rows)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b'static_fingerprint': fingerprint.encode(),
+                                               b'static_rows': str(store.n_static).encode(),
+                                               b'static_index': store.static_index.name.encode()})
+        pq.write_table(table, meta_path + '.tmp')
+        os.replace(meta_path + '.tmp', meta_path)
+
+        with open(self.manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'rows': int(len(rows)), 'static': fingerprint, 'pid': os.getpid(),
+                       'published_at': time.time()}, f)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+        self.loaded_version = version
+        self._prune(version)
+        logger.info(f"💾 Shared index v{version}: {len(rows)} vectors ({len(lesson_rows)} lesson) -> {self.directory}")
+        return version
+
+    def load(self, version: Optional[int] = None) -> Tuple[int, VectorStore]:
+        """Memory-map một version (mặc định version hiện tại), trả về (version, store) đã có index phần
+        tĩnh: dùng lại của version trước nếu cùng fingerprint, không thì load file index đã lưu, cuối
+        cùng mới dựng lại (build_index)"""
+        version = version or self.current_version()
+        matrix_path, meta_path = self._paths(version)
+        table = pq.read_table(meta_path)
+        metadata = table.schema.metadata or {}
+        fingerprint = metadata[b'static_fingerprint'].decode()
+        n_static = int(metadata[b'static_rows'])
+        lessons = np.load(matrix_path, mmap_mode='r')
+        if table.num_rows != n_static + len(lessons):
+            raise ValueError(f"Shared index v{version} hỏng: {table.num_rows} rows vs {n_static} + {len(lessons)} vectors")
+
+        reuse = self._static is not None and self._static[0] == fingerprint
+        if reuse:
+            static = self._static[1]
+        elif n_static:
+            static = np.load(self._static_base(fingerprint), mmap_mode='r')
+        else:
+            static = np.zeros((0, 0), dtype=np.float32)
+        store = VectorStore.from_arrow(table, static, lesson_matrix=lessons)
+        if reuse:
+            store.static_index = self._static[2]
+        elif n_static and not store.load_static_index(self._static_base(fingerprint),
+                                                      metadata[b'static_index'].decode(), fingerprint):
+            logger.warning(f"⚠️ Shared index v{version}: không có index phần tĩnh trên đĩa, dựng lại")
+            store.build_index()
+        self._static = (fingerprint, store.static_matrix, store.static_index)
+        self.loaded_version = version
+        return version, store
+
+    def _prune(self, current: int):
+        """Xoá các version cũ và phần tĩnh không còn version nào dùng; worker đang mmap file đã xoá vẫn
+        đọc được tới khi chuyển version"""
+        for path in glob.glob(os.path.join(self.directory, 'v*.npy')) + glob.glob(os.path.join(self.directory, 'v*.meta.parquet')):
+            try:
+                version = int(os.path.basename(path)[1:9])
+            except ValueError:
+                continue
+            if version <= current - self.keep_versions:
+                _remove(path)
+        used = set()
+        for path in glob.glob(os.path.join(self.directory, 'v*.meta.parquet')):
+            try:
+                used.add(pq.read_schema(path).metadata[b'static_fingerprint'].decode())
+            except Exception:
+                pass  # Version cũ (không có phần tĩnh riêng) hoặc đang bị xoá
+        for path in glob.glob(os.path.join(self.directory, 'static-*')):
+            if os.path.basename(path).split('.')[0][len('static-'):] not in used:
+                _remove(path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # Windows: file còn đang được map
+
+
+class SyncLeader:
+    """Leader election qua flock không chặn: process đầu tiên giữ lock là syncer duy nhất"""
+
+    def __init__(self, directory: str = SHARED_INDEX_DIR):
+        self._lock = FileLock(os.path.join(directory, 'sync.lock'))
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock.held
+
+    def try_acquire(self) -> bool:
+        if self._lock.held:
+            return True
+        if self._lock.acquire(blocking=False):
+            logger.info(f"👑 Worker {os.getpid()} là sync leader")
+            return True
+        return False
+
+    def release(self):
+        self._lock.release()
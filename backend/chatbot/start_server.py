@@ -1,6 +1,7 @@
 """
 Script để khởi động server với cấu hình tự động
 """
+import argparse
 import os
 import sys
 import subprocess
@@ -89,12 +90,20 @@ def setup_environment():
         load_dotenv()
         print("✅ Đã load environment variables")
 
-def start_server():
+def start_server(workers=1, host='0.0.0.0', port=8000):
     """Khởi động FastAPI server"""
     print("🚀 Khởi động English Learning RAG Chatbot Server...")
-    print("📡 Server sẽ chạy tại: http://localhost:8000")
-    print("📖 API docs tại: http://localhost:8000/docs")
-    print("❤️ Health check tại: http://localhost:8000/health")
+    print(f"📡 Server sẽ chạy tại: http://localhost:{port}")
+    print(f"📖 API docs tại: http://localhost:{port}/docs")
+    print(f"❤️ Health check tại: http://localhost:{port}/health")
+    
+    env = os.environ.copy()
+    if workers > 1:
+        # Các worker dùng chung index trên đĩa (memory-map), chỉ một worker làm sync leader
+        env.setdefault('SHARED_INDEX', 'true')
+        env.setdefault('STARTUP_MODE', 'fast')
+        print(f"👥 Chạy {workers} workers (shared index, một sync leader)")
+        print(f"⚠️ Mỗi worker load model riêng: bộ nhớ model ~ {workers}x một worker (index thì dùng chung)")
     print("\n" + "="*50)
     
     try:
@@ -102,17 +111,27 @@ def start_server():
         subprocess.run([
             sys.executable, '-m', 'uvicorn', 
             'improved_main:app',
-            '--host', '0.0.0.0',
-            '--port', '8000',
+            '--host', host,
+            '--port', str(port),
+            '--workers', str(workers),
             '--log-level', 'info'
-        ])
+        ], env=env)
     except KeyboardInterrupt:
         print("\n👋 Server đã dừng")
     except Exception as e:
         print(f"❌ Lỗi khi khởi động server: {e}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Khởi động English Learning RAG Chatbot Server')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', '1')),
+                        help='Số uvicorn worker process (mặc định: WEB_CONCURRENCY hoặc 1)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    return parser.parse_args()
+
 def main():
     """Main function"""
+    args = parse_args()
     print("📚 English Learning RAG Chatbot Server Setup")
     print("="*45)
     
@@ -130,7 +149,7 @@ def main():
         return
     
     # Khởi động server
-    start_server()
+    start_server(workers=max(1, args.workers), host=args.host, port=args.port)
 
 if __name__ == "__main__":
     main()
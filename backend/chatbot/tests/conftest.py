@@ -0,0 +1,38 @@
+"""
+Cấu hình chung của test: không cần MongoDB, mạng hay model (fake LLM + FakeSentenceModel).
+    cd backend/chatbot && python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+CHATBOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Đọc lúc import improved_main: không load model thật, không chờ MongoDB
+os.environ.setdefault('LLM_BACKEND', 'fake')
+os.environ.setdefault('FAKE_LLM_LATENCY_MS', '5')
+os.environ.setdefault('STARTUP_MODE', 'fast')
+os.environ.setdefault('MONGODB_URI', 'mongodb://127.0.0.1:1')
+# Ma trận FAQ memory-map được ghi vào thư mục tạm, không vào source tree
+os.environ.setdefault('EMBEDDINGS_CACHE_DIR', tempfile.mkdtemp(prefix='chatbot-embeddings-'))
+sys.path.insert(0, CHATBOT_DIR)
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    """improved_main với lesson store tạm trong tmp_path, FakeSentenceModel và snapshot chỉ có FAQ"""
+    monkeypatch.chdir(CHATBOT_DIR)  # improved_main đọc file FAQ theo đường dẫn tương đối
+    import improved_main
+    from benchmarks.fakes import FakeSentenceModel
+    from lesson_segments import LessonSegmentLog
+
+    lessons_parquet = str(tmp_path / 'english_lessons_embeddings.parquet')
+    monkeypatch.setattr(improved_main, 'sentence_model', FakeSentenceModel())
+    monkeypatch.setattr(improved_main, 'lessons_parquet', lessons_parquet)
+    monkeypatch.setattr(improved_main, 'lesson_log', LessonSegmentLog(lessons_parquet))
+    monkeypatch.setattr(improved_main, 'AUTO_SYNC_ENABLED', False)
+    with improved_main.index_snapshots.write_lock:
+        improved_main.publish_snapshot()
+    return improved_main
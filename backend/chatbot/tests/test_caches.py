@@ -0,0 +1,112 @@
+"""SemanticAnswerCache (theo độ tương đồng embedding) và QueryEmbeddingCache (LRU theo câu hỏi)"""
+import numpy as np
+
+from caches import QueryEmbeddingCache, SemanticAnswerCache
+
+
+def _unit(seed: int, dim: int = 32) -> np.ndarray:
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def _near(vec: np.ndarray, seed: int, noise: float = 0.05) -> np.ndarray:
+    other = vec + noise * _unit(seed, len(vec))
+    return other / np.linalg.norm(other)
+
+
+def test_answer_cache_hits_similar_question_with_same_context():
+    cache = SemanticAnswerCache(max_entries=8, threshold=0.95)
+    question = _unit(1)
+    cache.put(question, ('v1', 'en'), {'answer': 'cached'})
+
+    assert cache.get(_near(question, 2), ('v1', 'en')) == {'answer': 'cached'}
+    assert cache.get(_near(question, 2), ('v2', 'en')) is None  # context (vd. version index) khác
+    assert cache.get(_unit(3), ('v1', 'en')) is None  # câu hỏi khác hẳn
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+
+def test_answer_cache_returns_most_similar_entry():
+    cache = SemanticAnswerCache(max_entries=8, threshold=0.9)
+    base = _unit(1)
+    cache.put(_near(base, 2, noise=0.3), 'ctx', {'answer': 'far'})
+    cache.put(_near(base, 3, noise=0.01), 'ctx', {'answer': 'close'})
+
+    assert cache.get(base, 'ctx') == {'answer': 'close'}
+
+
+def test_answer_cache_evicts_least_recently_used():
+    cache = SemanticAnswerCache(max_entries=2, threshold=0.99)
+    a, b, c = _unit(1), _unit(2), _unit(3)
+    cache.put(a, 'ctx', {'answer': 'a'})
+    cache.put(b, 'ctx', {'answer': 'b'})
+    assert cache.get(a, 'ctx') == {'answer': 'a'}  # a mới dùng, b là LRU
+    cache.put(c, 'ctx', {'answer': 'c'})
+
+    assert cache.get(b, 'ctx') is None
+    assert cache.get(a, 'ctx') == {'answer': 'a'} and cache.get(c, 'ctx') == {'answer': 'c'}
+    assert cache.stats()['evictions'] == 1
+
+
+def test_answer_cache_expires_entries_and_invalidates(monkeypatch):
+    import caches
+
+    now = [1000.0]
+    monkeypatch.setattr(caches.time, 'monotonic', lambda: now[0])
+    cache = SemanticAnswerCache(max_entries=4, ttl_seconds=60, threshold=0.99)
+    question = _unit(1)
+    cache.put(question, 'ctx', {'answer': 'old'})
+    now[0] += 61
+    assert cache.get(question, 'ctx') is None
+    assert cache.stats()['size'] == 0
+
+    cache.put(question, 'ctx', {'answer': 'new'})
+    cache.invalidate()
+    assert cache.get(question, 'ctx') is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_answer_cache_respects_memory_limit():
+    cache = SemanticAnswerCache(max_entries=100, max_mb=0.01, threshold=0.99)
+    for seed in range(20):
+        cache.put(_unit(seed), 'ctx', {'answer': 'x' * 1000})
+
+    stats = cache.stats()
+    assert stats['memory_bytes'] <= 0.01 * 1024 * 1024
+    assert stats['size'] < 20 and stats['evictions'] > 0
+
+
+def test_query_embedding_cache_normalizes_question_and_evicts_lru():
+    cache = QueryEmbeddingCache(max_size=2)
+    cache.put("  Thì HIỆN TẠI   hoàn thành? ", _unit(1))
+
+    hit = cache.get("thi hien tai hoan thanh?")
+    assert hit is not None and np.allclose(hit, _unit(1))
+    assert not hit.flags.writeable  # dùng chung giữa các request
+
+    cache.put("second", _unit(2))
+    cache.get("thi hien tai hoan thanh?")
+    cache.put("third", _unit(3))
+    assert cache.get("second") is None
+    assert cache.get("third") is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_query_embedding_cache_disabled_and_clear():
+    disabled = QueryEmbeddingCache(max_size=0)
+    disabled.put("q", _unit(1))
+    assert disabled.get("q") is None
+
+    cache = QueryEmbeddingCache(max_size=4)
+    cache.put("q", _unit(1))
+    cache.clear()
+    assert cache.get("q") is None and cache.stats()['size'] == 0
+
+
+def test_loading_a_new_model_clears_query_embeddings(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'SentenceTransformer', lambda name: app_module.sentence_model)
+    monkeypatch.setattr(app_module.reranker, 'stages', ())
+    app_module.query_embedding_cache.put("stale question", _unit(1))
+
+    app_module.load_sentence_model()
+
+    assert app_module.query_embedding_cache.get("stale question") is None
@@ -0,0 +1,93 @@
+"""LessonSegmentLog: append segment, replay base + delta (segment mới nhất thắng), compaction"""
+import os
+
+import pandas as pd
+
+import lesson_segments
+from benchmarks.fakes import FakeLessonsCollection, FakeSentenceModel, make_lessons
+from lesson_segments import LessonSegmentLog
+from lesson_sync import embed_changed_lessons, iter_lesson_docs
+from vector_store import VectorStore
+
+MODEL = FakeSentenceModel(dim=16)
+
+
+def _rows(coll, lesson_ids=None) -> pd.DataFrame:
+    query = {} if lesson_ids is None else {'_id': {'$in': list(lesson_ids)}}
+    return embed_changed_lessons(iter_lesson_docs(coll, query), {}, MODEL)
+
+
+def _passages(frame: pd.DataFrame) -> dict:
+    """lesson_id -> [(chunk, question)] theo thứ tự chunk"""
+    out = {}
+    for lid, chunk, question in sorted(zip(frame['lesson_id'], frame['chunk'], frame['question'])):
+        out.setdefault(lid, []).append((int(chunk), question))
+    return out
+
+
+def test_replay_keeps_latest_segment_per_lesson_and_applies_deletes(tmp_path):
+    log = LessonSegmentLog(str(tmp_path / 'english_lessons_embeddings.parquet'))
+    coll = FakeLessonsCollection(make_lessons(10))  # lesson 9 có nhiều passage
+    ids = coll.ids()
+    log.append(_rows(coll), ())
+
+    coll.update_one(ids[9], {'content': 'Bài học ngắn về mạo từ.'})
+    log.append(_rows(coll, [ids[9]]), [ids[2]])
+    coll.delete_one(ids[2])
+
+    loaded = log.load()
+    expected = _rows(coll)
+    assert _passages(loaded) == _passages(expected)
+    assert len(_passages(loaded)[ids[9]]) == 1  # passage cũ của lesson 9 không còn
+    assert log.segment_count == 2
+
+    # Log mới trên cùng thư mục (process khác / restart) replay ra cùng kết quả
+    assert _passages(LessonSegmentLog(log.base_path).load()) == _passages(expected)
+
+
+def test_partial_segment_is_skipped(tmp_path):
+    log = LessonSegmentLog(str(tmp_path / 'english_lessons_embeddings.parquet'))
+    coll = FakeLessonsCollection(make_lessons(3))
+    log.append(_rows(coll), ())
+    with open(os.path.join(log.delta_dir, 'seg-99999999999999999999-0-000001.parquet'), 'wb') as f:
+        f.write(b'not a parquet file')
+
+    assert sorted(log.load()['lesson_id'].unique()) == sorted(coll.ids())
+
+
+def test_compaction_rewrites_base_from_store_blocks_and_drops_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(lesson_segments, 'LESSON_LOG_MAX_SEGMENTS', 3)
+    log = LessonSegmentLog(str(tmp_path / 'english_lessons_embeddings.parquet'))
+    coll = FakeLessonsCollection(make_lessons(12))
+    ids = coll.ids()
+    for start in range(0, 12, 4):
+        log.append(_rows(coll, ids[start:start + 4]), ())
+    log.append(None, [ids[0]])
+    coll.delete_one(ids[0])
+    assert log.needs_compaction()
+
+    before = log.load()
+    store = VectorStore.from_dataframe(before)
+    log.compact(store.lesson_frames(block_rows=5))
+
+    assert log.segment_count == 0 and not log.needs_compaction()
+    assert log.base_rows == len(before) and log.delta_rows == 0
+    after = LessonSegmentLog(log.base_path).load()
+    assert _passages(after) == _passages(before)
+    assert ids[0] not in set(after['lesson_id'])
+
+    # Sau compaction, delta mới vẫn được replay trên base mới
+    coll.update_one(ids[1], {'content': 'Câu điều kiện loại 2.'})
+    log.append(_rows(coll, [ids[1]]), ())
+    assert _passages(log.load()) == _passages(_rows(coll))
+
+
+def test_compaction_of_empty_store_writes_empty_base(tmp_path):
+    log = LessonSegmentLog(str(tmp_path / 'english_lessons_embeddings.parquet'))
+    coll = FakeLessonsCollection(make_lessons(2))
+    log.append(_rows(coll), ())
+    log.append(None, coll.ids())
+
+    log.compact(VectorStore.from_dataframe(log.load()).lesson_frames())
+
+    assert log.load().empty and log.segment_count == 0
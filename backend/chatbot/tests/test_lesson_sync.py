@@ -0,0 +1,104 @@
+"""Sync lesson incremental: plan_lesson_sync chọn đúng document cần kiểm tra / lesson đã xoá, và
+VectorStore.apply_lesson_changes upsert / xoá theo lesson_id (copy-on-write)"""
+import numpy as np
+import pandas as pd
+
+from benchmarks.fakes import FakeLessonsCollection, FakeSentenceModel, make_lessons
+from lesson_sync import embed_changed_lessons, iter_lesson_docs, plan_lesson_sync
+from vector_store import VectorStore
+
+MODEL = FakeSentenceModel(dim=32)
+
+
+def _faq_store(n: int = 20) -> VectorStore:
+    questions = [f"FAQ question {i}" for i in range(n)]
+    return VectorStore.from_dataframe(pd.DataFrame({
+        'question': questions,
+        'answer': [f"FAQ answer {i}" for i in range(n)],
+        'category': 'grammar',
+        'source_type': 'faq',
+        'embedding': list(MODEL.encode(questions)),
+    }))
+
+
+def _sync(store: VectorStore, coll, full: bool = False) -> VectorStore:
+    known, watermark = store.lesson_state()
+    query, deleted = plan_lesson_sync(coll, known, watermark, full=full)
+    upserts = embed_changed_lessons(iter_lesson_docs(coll, query), known, MODEL)
+    return store.copy().apply_lesson_changes(upserts, deleted)
+
+
+def _live_passages(store: VectorStore) -> list:
+    live = store.live_rows()
+    return sorted((lid, int(chunk)) for lid, chunk in zip(store.lesson_ids[live], store.chunks[live]) if lid is not None)
+
+
+def test_plan_lesson_sync_queries_changed_and_unseen_and_reports_deleted():
+    coll = FakeLessonsCollection(make_lessons(5))
+    store = _sync(_faq_store(), coll, full=True)
+    known, watermark = store.lesson_state()
+    ids = coll.ids()
+
+    coll.update_one(ids[0], {'content': 'Nội dung mới về câu bị động.'})
+    coll.delete_one(ids[1])
+    added = coll.insert_one({'title': 'New', 'content': 'Mệnh đề quan hệ.', 'updatedAt': watermark})
+    query, deleted = plan_lesson_sync(coll, known, watermark)
+
+    assert deleted == {ids[1]}
+    checked = {doc['_id'] for doc in iter_lesson_docs(coll, query)}
+    assert {ids[0], added} <= checked and ids[1] not in checked
+
+    full_query, full_deleted = plan_lesson_sync(coll, known, watermark, full=True)
+    assert full_query == {} and full_deleted == {ids[1]}
+
+
+def test_unchanged_lessons_are_not_re_embedded():
+    coll = FakeLessonsCollection(make_lessons(6))
+    store = _sync(_faq_store(), coll, full=True)
+    known, _ = store.lesson_state()
+
+    upserts = embed_changed_lessons(iter_lesson_docs(coll, {}), known, MODEL)
+
+    assert upserts.empty
+
+
+def test_apply_lesson_changes_upserts_and_deletes_by_lesson_id():
+    coll = FakeLessonsCollection(make_lessons(10))  # lesson 9 dài, có nhiều passage
+    faq = _faq_store()
+    store = _sync(faq, coll, full=True)
+    ids = coll.ids()
+    assert store.lesson_count == 10 and len(faq) == 20 and faq.lesson_count == 0  # bản cũ không đổi
+    assert len([p for p in _live_passages(store) if p[0] == ids[9]]) > 1
+
+    coll.update_one(ids[9], {'content': 'Bài học ngắn về mạo từ.'})
+    coll.delete_one(ids[3])
+    before = store
+    before_passages = _live_passages(before)
+    store = _sync(store, coll)
+
+    passages = _live_passages(store)
+    assert len(passages) == len(set(passages))
+    assert [p for p in passages if p[0] == ids[9]] == [(ids[9], 0)]
+    assert all(p[0] != ids[3] for p in passages)
+    assert store.lesson_count == 9 and set(store.lesson_state()[0]) == set(coll.ids())
+    assert _live_passages(before) == before_passages  # reader của snapshot cũ không thấy thay đổi
+
+    # Search chỉ trả về dòng còn sống: lesson bị xoá không còn, lesson sửa trả nội dung mới
+    doc = coll.find_one({'_id': ids[9]})
+    question = store.questions.to_list(store.live_rows())
+    query = store.vectors(store.live_rows()[[i for i, q in enumerate(question) if 'mạo từ' in q]])[0]
+    indices, scores = store.search(query, top_k=3, threshold=0.0)
+    assert store.lesson_ids[indices[0]] == doc['_id'] and np.isclose(scores[0], 1.0, atol=1e-5)
+    assert ids[3] not in set(store.lesson_ids[indices])
+
+
+def test_upsert_and_delete_in_same_batch_deletes():
+    coll = FakeLessonsCollection(make_lessons(3))
+    store = _sync(_faq_store(), coll, full=True)
+    lesson_id = coll.ids()[0]
+    upserts = embed_changed_lessons(iter_lesson_docs(coll, {'_id': {'$in': [lesson_id]}}), {}, MODEL)
+
+    store = store.copy().apply_lesson_changes(upserts, [lesson_id])
+
+    assert lesson_id not in store.lesson_state()[0]
+    assert store.lesson_count == 2
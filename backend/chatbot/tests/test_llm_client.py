@@ -0,0 +1,57 @@
+"""LLMClient: prompt trùng nhau đang chạy dùng chung một call upstream, concurrency bị giới hạn"""
+import asyncio
+
+from llm_client import FakeLLMBackend, LLMClient
+
+
+def test_identical_in_flight_prompts_share_one_upstream_call():
+    backend = FakeLLMBackend(latency_ms=50, jitter=0.0, fail_rate=0.0)
+    client = LLMClient(backend, max_concurrency=4)
+
+    async def main():
+        return await asyncio.gather(*(client.generate("Câu hỏi: What is a gerund?") for _ in range(8)))
+
+    answers = asyncio.run(main())
+
+    assert len(set(answers)) == 1
+    assert backend.calls == 1
+    assert client.upstream_calls == 1
+    assert client.coalesced == 7
+    assert client.stats()['in_flight_prompts'] == 0
+
+
+def test_distinct_prompts_are_not_coalesced_and_respect_concurrency():
+    backend = FakeLLMBackend(latency_ms=20, jitter=0.0, fail_rate=0.0)
+    client = LLMClient(backend, max_concurrency=2)
+    peak = 0
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, client.active)
+            await asyncio.sleep(0.002)
+
+    async def main():
+        watcher = asyncio.ensure_future(watch())
+        answers = await asyncio.gather(*(client.generate(f"Câu hỏi: question {i}") for i in range(6)))
+        watcher.cancel()
+        return answers
+
+    answers = asyncio.run(main())
+
+    assert len(set(answers)) == 6
+    assert backend.calls == 6 and client.coalesced == 0
+    assert 1 <= peak <= 2
+
+
+def test_finished_prompt_is_called_again():
+    backend = FakeLLMBackend(latency_ms=1, jitter=0.0, fail_rate=0.0)
+    client = LLMClient(backend, max_concurrency=2)
+
+    async def main():
+        await client.generate("Câu hỏi: again")
+        await client.generate("Câu hỏi: again")
+
+    asyncio.run(main())
+
+    assert backend.calls == 2 and client.coalesced == 0
@@ -0,0 +1,44 @@
+"""StreamingMarkdownCleaner ghép lại phải bằng clean_markdown_response, dù chunk bị cắt ở đâu"""
+import random
+
+import pytest
+
+from markdown_cleaner import StreamingMarkdownCleaner, clean_markdown_line, clean_markdown_response
+
+ANSWERS = [
+    "**Thì hiện tại hoàn thành** (Present Perfect) dùng để diễn tả hành động đã xảy ra .\n\n"
+    "* **Cấu trúc:** S + have/has + V3\n* Ví dụ: `I have finished my homework` .\n\n\n\n"
+    "Lưu ý: _already_, _yet_ và ~~ever~~ thường đi kèm !",
+    "***Quan trọng***: câu bị động dùng **be + V3**, ví dụ __The cake was eaten__ .\n"
+    "** Bước 1: xác định tân ngữ\n** Bước 2: chia động từ *be* theo thì ,\n\nXong!",
+    "IELTS band 7 cần:\n\n1. Từ vựng đa dạng\n2. Ngữ pháp chính xác ?\n\n\n   \n\nChúc bạn học tốt .  ",
+    "Không có markdown nào ở đây cả, chỉ là một câu trả lời bình thường.",
+]
+
+
+def _stream(text: str, cuts) -> str:
+    cleaner = StreamingMarkdownCleaner()
+    parts, start = [], 0
+    for cut in list(cuts) + [len(text)]:
+        parts.append(cleaner.feed(text[start:cut]))
+        start = cut
+    parts.append(cleaner.flush())
+    return ''.join(parts)
+
+
+@pytest.mark.parametrize('text', ANSWERS)
+def test_streaming_matches_full_cleaning(text):
+    expected = clean_markdown_response(text)
+    assert _stream(text, []) == expected
+    assert _stream(text, range(1, len(text))) == expected  # từng ký tự
+    assert _stream(text, [i for i, ch in enumerate(text) if ch == ' ']) == expected  # từng token
+    rng = random.Random(len(text))
+    for _ in range(50):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, min(20, len(text) - 1))))
+        assert _stream(text, cuts) == expected
+
+
+def test_line_rules_are_the_response_rules():
+    for text in ANSWERS:
+        for line in text.split('\n'):
+            assert clean_markdown_line(line).strip() == clean_markdown_response(line) or not line.strip()
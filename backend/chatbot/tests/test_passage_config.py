@@ -0,0 +1,64 @@
+"""Đổi cấu hình chia passage (PASSAGE_CONFIG): mọi đường ghi (sync, /admin/index_lessons, change stream)
+encode lại toàn bộ và ghi lại base thay vì upsert từng lesson vào delta log"""
+import lesson_segments
+import lesson_sync
+from benchmarks.fakes import FakeLessonsCollection, make_lessons
+
+
+def _set_passage_config(monkeypatch, app_module, config: str):
+    for module in (lesson_sync, lesson_segments, app_module):
+        monkeypatch.setattr(module, 'PASSAGE_CONFIG', config)
+
+
+def _hashes(app_module) -> dict:
+    return dict(app_module.current_lesson_state()[0])
+
+
+def _synced_app(app_module, monkeypatch):
+    coll = FakeLessonsCollection(make_lessons(12))
+    monkeypatch.setattr(app_module, 'lessons_coll', coll)
+    assert app_module.sync_courses_from_mongodb(full=True) is True
+    coll.update_one(coll.ids()[0], {'content': 'Bài học ngắn về mạo từ.'})
+    assert app_module.sync_courses_from_mongodb() is True
+    assert app_module.lesson_log.segment_count == 1  # Thay đổi thường: một delta segment
+    assert app_module.lesson_log.passage_config == lesson_sync.PASSAGE_CONFIG
+    return coll
+
+
+def test_sync_after_passage_config_change_rebuilds_base(app_module, monkeypatch):
+    coll = _synced_app(app_module, monkeypatch)
+    before = _hashes(app_module)
+
+    _set_passage_config(monkeypatch, app_module, '400:50:32')
+    assert app_module.passage_config_changed()
+    assert app_module.sync_courses_from_mongodb() is True  # incremental được nâng thành full
+
+    after = _hashes(app_module)
+    assert set(after) == set(coll.ids()) and all(after[lid] != before[lid] for lid in after)
+    assert app_module.lesson_log.passage_config == '400:50:32'
+    assert app_module.lesson_log.segment_count == 0
+    assert not app_module.passage_config_changed()
+    # Base mới replay ra đúng các lesson, với hash theo cấu hình mới
+    replayed = app_module.lesson_log.load()
+    assert dict(zip(replayed['lesson_id'], replayed['content_hash'])) == after
+
+
+def test_admin_index_and_change_stream_rebuild_after_config_change(app_module, monkeypatch):
+    coll = _synced_app(app_module, monkeypatch)
+    ids = coll.ids()
+
+    _set_passage_config(monkeypatch, app_module, '500:50:32')
+    app_module.index_lessons_by_id(ids[:2])
+    assert app_module.lesson_log.passage_config == '500:50:32'
+    assert app_module.lesson_log.segment_count == 0
+    assert len(_hashes(app_module)) == len(ids)
+
+    _set_passage_config(monkeypatch, app_module, '600:50:32')
+    app_module.apply_lesson_events([coll.find_one({'_id': ids[0]})], set())
+    assert app_module.lesson_log.passage_config == '600:50:32'
+    assert app_module.lesson_log.segment_count == 0
+    assert set(_hashes(app_module)) == set(ids)
+
+    # Sau khi đã rebuild, event thường lại ghi delta segment
+    app_module.apply_lesson_events([], {ids[1]})
+    assert app_module.lesson_log.segment_count == 1 and ids[1] not in _hashes(app_module)
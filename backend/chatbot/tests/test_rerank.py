@@ -0,0 +1,46 @@
+"""Reranker._plan: cắt pool / bỏ bước đắt nhất theo budget latency"""
+import rerank
+from rerank import Reranker
+
+
+def _reranker(budget_ms: float, **costs) -> Reranker:
+    reranker = Reranker(mode='cross_encoder+mmr', budget_ms=budget_ms)
+    reranker.cost_ms.update(costs)
+    return reranker
+
+
+def test_plan_runs_everything_before_costs_are_measured():
+    reranker = _reranker(5.0)
+    assert reranker._plan(['cross_encoder', 'mmr'], 50, 5) == (['cross_encoder', 'mmr'], 50)
+
+
+def test_plan_caps_pool_to_budget():
+    reranker = _reranker(10.0, cross_encoder=0.5, mmr=0.0)
+    assert reranker._plan(['cross_encoder', 'mmr'], 50, 5) == (['cross_encoder', 'mmr'], 20)
+
+
+def test_plan_skips_most_expensive_stage_when_top_k_plus_one_does_not_fit():
+    reranker = _reranker(10.0, cross_encoder=2.0, mmr=0.01)
+    # 10 / 2.01 < 6 ứng viên -> bỏ cross_encoder, MMR một mình vẫn vừa cả pool
+    assert reranker._plan(['cross_encoder', 'mmr'], 50, 5) == (['mmr'], 50)
+    assert reranker._skips['cross_encoder'] == 1
+
+
+def test_plan_keeps_stage_when_whole_small_pool_fits():
+    reranker = _reranker(10.0, cross_encoder=2.0)
+    # Pool chỉ có 4 ứng viên (<= top_k): chạy cả pool là đủ, không cần top_k + 1
+    assert reranker._plan(['cross_encoder'], 4, 5) == (['cross_encoder'], 4)
+
+
+def test_plan_with_infinite_budget_never_skips():
+    reranker = _reranker(float('inf'), cross_encoder=1e6, mmr=1e6)
+    assert reranker._plan(['cross_encoder', 'mmr'], 50, 5) == (['cross_encoder', 'mmr'], 50)
+
+
+def test_plan_probes_after_repeated_skips():
+    reranker = _reranker(1.0, cross_encoder=5.0)
+    for _ in range(rerank._PROBE_AFTER_SKIPS - 1):
+        assert reranker._plan(['cross_encoder'], 50, 5) == ([], 50)
+    # Lần thứ _PROBE_AFTER_SKIPS: chạy lại với pool nhỏ nhất để đo lại chi phí
+    assert reranker._plan(['cross_encoder'], 50, 5) == (['cross_encoder'], 6)
+    assert reranker._skips['cross_encoder'] == 0
@@ -0,0 +1,83 @@
+"""SnapshotRegistry publish bằng atomic swap; sync single-flight qua sync_lock"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from index_snapshot import SnapshotRegistry
+from vector_store import VectorStore
+
+
+def _store(n: int) -> VectorStore:
+    return VectorStore.from_dataframe(pd.DataFrame({
+        'question': [f"q{i}" for i in range(n)],
+        'answer': '',
+        'category': 'general',
+        'embedding': list(np.eye(max(n, 1), 8, dtype=np.float32)[:n] + 0.1),
+    }))
+
+
+def test_publish_swaps_current_and_readers_keep_their_snapshot():
+    registry = SnapshotRegistry()
+    assert registry.current.version == 0 and len(registry.current) == 0
+
+    first = registry.publish(_store(3))
+    held = registry.current  # reader đọc current một lần ở đầu request
+    second = registry.publish(_store(5))
+
+    assert (first.version, second.version) == (1, 2)
+    assert registry.current is second and len(registry.current) == 5
+    assert held is first and len(held.store) == 3
+
+
+def test_concurrent_publishes_get_distinct_increasing_versions():
+    registry = SnapshotRegistry()
+    store = _store(2)
+    versions = []
+    lock = threading.Lock()
+
+    def writer():
+        for _ in range(200):
+            snapshot = registry.publish(store)
+            with lock:
+                versions.append(snapshot.version)
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(versions) == list(range(1, 801))
+    assert registry.current.version == 800
+
+
+def test_sync_is_single_flight(app_module, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_sync(full=False):
+        calls.append(full)
+        entered.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(app_module, '_sync_courses_from_mongodb', slow_sync)
+    results = []
+    running = threading.Thread(target=lambda: results.append(app_module.sync_courses_from_mongodb()))
+    running.start()
+    assert entered.wait(5)
+    try:
+        # Sync thứ hai (thread nền, /sync, watcher) bị bỏ qua, không chờ và không chạy song song
+        assert app_module.sync_courses_from_mongodb(full=True) == app_module.SYNC_SKIPPED
+        response = TestClient(app_module.app).post('/sync')
+        assert response.json()['status'] == 'in_progress'
+    finally:
+        release.set()
+        running.join(5)
+
+    assert results == [True] and calls == [False]
+    assert not app_module.sync_lock.locked()
+    assert app_module.sync_courses_from_mongodb(full=True) is True and calls == [False, True]
@@ -0,0 +1,21 @@
+"""
+Bất biến của index snapshot khi /ask chạy song song với sync, /sync và /admin/index_lessons
+(benchmarks.stress_snapshots chạy vài giây trên FakeLessonsCollection).
+
+Không cần MongoDB, mạng hay model: fake LLM + FakeSentenceModel.
+    cd backend/chatbot && python -m pytest -q tests
+"""
+import argparse
+import os
+
+STRESS_SECONDS = float(os.getenv('STRESS_TEST_SECONDS', '3'))
+
+
+def test_snapshot_invariants_under_concurrent_sync(app_module):
+    from benchmarks.stress_snapshots import run
+
+    result = run(argparse.Namespace(seconds=STRESS_SECONDS, readers=4, lessons=100))
+
+    assert result['error_count'] == 0, result['errors']
+    assert result['asks'] > 0
+    assert result['snapshots_published'] > 1
@@ -0,0 +1,57 @@
+"""
+Full sync từ MongoDB stream từng chunk vào store: bộ nhớ tạm không tăng theo kích thước collection
+(ngoài chính index), không giữ lại các chunk đã áp dụng.
+"""
+import gc
+import tracemalloc
+import weakref
+
+from benchmarks.fakes import FakeLessonsCollection, make_lessons
+from lesson_sync import iter_changed_lesson_chunks
+
+
+def _full_sync(app_module, monkeypatch, n_lessons: int):
+    """Full sync n_lessons bài; trả về (peak - baseline, retained - baseline, số chunk sống tối đa cùng lúc)"""
+    monkeypatch.setattr(app_module, 'lessons_coll', FakeLessonsCollection(make_lessons(n_lessons)))
+    alive = {'now': 0, 'max': 0}
+
+    def _released():
+        alive['now'] -= 1
+
+
+    def tracked_chunks(docs, known, model):
+        # Chunk nhỏ để collection test đã gấp nhiều lần một chunk
+        for chunk in iter_changed_lesson_chunks(docs, known, model, chunk_size=50):
+            alive['now'] += 1
+            alive['max'] = max(alive['max'], alive['now'])
+            weakref.finalize(chunk, _released)
+            yield chunk
+
+    monkeypatch.setattr(app_module, 'iter_changed_lesson_chunks', tracked_chunks)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        assert app_module.sync_courses_from_mongodb(full=True)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert app_module.index_snapshots.current.store.lesson_count == n_lessons
+    return peak - baseline, retained - baseline, alive['max']
+
+
+def test_full_sync_memory_stays_flat_as_collection_grows(app_module, monkeypatch):
+    import vector_store
+
+    monkeypatch.setattr(vector_store, '_FRAME_BLOCK_ROWS', 256)
+
+    small_peak, small_retained, small_alive = _full_sync(app_module, monkeypatch, 400)
+    large_peak, large_retained, large_alive = _full_sync(app_module, monkeypatch, 1600)
+
+    # Không bao giờ giữ quá chunk đang áp dụng (và chunk sắp encode)
+    assert small_alive <= 2 and large_alive <= 2
+    # Phần peak vượt trên index còn giữ lại chỉ là overhead tăng buffer của chính index,
+    # không tăng nhanh hơn index (gom cả collection vào bộ nhớ thì tăng ~1.5x index)
+    small_extra, large_extra = small_peak - small_retained, large_peak - large_retained
+    assert large_extra - small_extra <= large_retained - small_retained
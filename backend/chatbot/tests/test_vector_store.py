@@ -0,0 +1,211 @@
+"""VectorStore: kết quả search khớp brute-force cosine trên các dòng còn sống"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import vector_store
+from ann_index import FlatIndex
+from benchmarks.ann_recall import make_queries, synthetic_corpus
+from quantization import QuantizedIndex
+from vector_store import VectorStore
+
+DIM = 24
+
+
+def _frame(keys, rng, source_type='faq', category='grammar') -> pd.DataFrame:
+    """Một dòng mỗi key; lesson: key = (lesson_id, chunk)"""
+    frame = pd.DataFrame({
+        'question': [f"question {key}" for key in keys],
+        'answer': [f"answer {key}" for key in keys],
+        'category': category,
+        'source_type': source_type,
+        'embedding': list(rng.standard_normal((len(keys), DIM)).astype(np.float32)),
+    })
+    if source_type == 'lessons':
+        frame['lesson_id'] = [lid for lid, _ in keys]
+        frame['chunk'] = [chunk for _, chunk in keys]
+        frame['content_hash'] = [f"hash-{key}" for key in keys]
+    return frame
+
+
+def _lesson_keys(lesson_ids, passages: int = 2):
+    return [(lid, chunk) for lid in lesson_ids for chunk in range(passages)]
+
+
+class BruteForce:
+    """Tham chiếu: dict question -> vector chuẩn hoá của các dòng đang sống"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def apply(self, frame: pd.DataFrame, deleted=()):
+        replaced = set(deleted) | set(frame.get('lesson_id', ()))
+        self.rows = {q: (lid, v) for q, (lid, v) in self.rows.items() if lid not in replaced}
+        lesson_ids = frame['lesson_id'] if 'lesson_id' in frame else [None] * len(frame)
+        for question, lid, vec in zip(frame['question'], lesson_ids, frame['embedding']):
+            if lid not in set(deleted):
+                self.rows[question] = (lid, vec / np.linalg.norm(vec))
+
+    def top_k(self, query: np.ndarray, k: int, threshold: float):
+        query = query / np.linalg.norm(query)
+        scored = sorted(((float(v @ query), q) for q, (_, v) in self.rows.items()), reverse=True)
+        return [(q, s) for s, q in scored[:k] if s >= threshold]
+
+
+def _results(store: VectorStore, indices, scores):
+    return [(q, float(s)) for q, s in zip(store.questions.to_list(indices), scores)]
+
+
+def _assert_matches(store: VectorStore, reference: BruteForce, queries, k=8, threshold=-1.0):
+    batch = store.search_batch(queries, top_k=k, threshold=threshold)
+    for query, (batch_indices, batch_scores) in zip(queries, batch):
+        expected = reference.top_k(query, k, threshold)
+        got = _results(store, *store.search(query, top_k=k, threshold=threshold))
+        assert [q for q, _ in got] == [q for q, _ in expected]
+        assert np.allclose([s for _, s in got], [s for _, s in expected], atol=1e-5)
+        assert store.questions.to_list(batch_indices) == [q for q, _ in got]
+        assert np.allclose(batch_scores, [s for _, s in got], atol=1e-5)
+
+
+@pytest.mark.parametrize('min_dead_to_compact', [10 ** 9, 0])
+def test_search_skips_tombstones_and_matches_brute_force(monkeypatch, min_dead_to_compact):
+    # 10**9: tombstone nằm lại trong store; 0: compact ngay khi vượt STORE_MAX_DEAD_RATIO
+    monkeypatch.setattr(vector_store, '_MIN_DEAD_TO_COMPACT', min_dead_to_compact)
+    rng = np.random.default_rng(7)
+    reference = BruteForce()
+    faq = _frame(range(40), rng)
+    store = VectorStore.from_dataframe(faq)
+    reference.apply(faq)
+
+    lessons = _frame(_lesson_keys([f"L{i}" for i in range(30)]), rng, source_type='lessons')
+    store = store.copy().apply_lesson_changes(lessons, ())
+    reference.apply(lessons)
+    for step in range(5):
+        # Sửa vài lesson (passage mới thay passage cũ) và xoá vài lesson khác
+        changed = _frame(_lesson_keys([f"L{i}" for i in range(step, 30, 7)], passages=1 + step % 3),
+                         rng, source_type='lessons')
+        deleted = [f"L{i}" for i in range(step + 3, 30, 11)]
+        store = store.copy().apply_lesson_changes(changed, deleted)
+        reference.apply(changed, deleted)
+
+    if min_dead_to_compact:
+        assert len(store.dead) > 0
+    else:
+        assert len(store.dead) <= vector_store.STORE_MAX_DEAD_RATIO * len(store.lesson_matrix)
+    assert len(store.live_rows()) == len(reference.rows)
+    queries = rng.standard_normal((12, DIM)).astype(np.float32)
+    _assert_matches(store, reference, queries)
+    _assert_matches(store, reference, queries, k=5, threshold=0.2)
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_quantized_top_k_matches_float(dtype):
+    matrix = synthetic_corpus(3000, 64, seed=3)
+    queries = make_queries(matrix, 40, seed=3)
+    flat, quantized = FlatIndex(matrix), QuantizedIndex.build(matrix, dtype)
+
+    found = [quantized.search(query, 10) for query in queries]
+    recall = np.mean([len(set(rows) & set(flat.search(query, 10)[0])) / 10 for query, (rows, _) in zip(queries, found)])
+    assert recall >= 0.98
+    for query, (rows, scores) in zip(queries, found):
+        assert np.allclose(scores, matrix[rows] @ query, atol=1e-6)  # điểm trả về là cosine float32 (rescoring)
+        assert np.all(np.diff(scores) <= 0)
+    for (rows, scores), (batch_rows, batch_scores) in zip(found, quantized.search_batch(queries, 10)):
+        assert np.array_equal(rows, batch_rows) and np.allclose(scores, batch_scores)
+
+    # Store dùng index lượng tử hoá cho phần tĩnh cho cùng top-k như store float
+    frame = pd.DataFrame({'question': [f"q{i}" for i in range(len(matrix))], 'answer': '', 'category': 'general',
+                          'embedding': list(matrix)})
+    float_store = VectorStore.from_dataframe(frame).build_index(dtype='float32')
+    quantized_store = VectorStore.from_dataframe(frame).build_index(dtype=dtype)
+    assert isinstance(quantized_store.static_index, QuantizedIndex)
+    hits = [quantized_store.search(query, top_k=5, threshold=0.0)[0] for query in queries]
+    expected = [float_store.search(query, top_k=5, threshold=0.0)[0] for query in queries]
+    assert np.mean([len(set(a) & set(b)) / 5 for a, b in zip(hits, expected)]) >= 0.98
+
+
+def test_filtered_search_matches_brute_force_after_lesson_changes():
+    rng = np.random.default_rng(11)
+    categories = ['grammar', 'vocabulary', 'ielts']
+    faq = pd.concat([_frame([f"{c}-{i}" for i in range(15)], rng, category=c) for c in categories], ignore_index=True)
+    store = VectorStore.from_dataframe(faq)
+    for step in range(4):
+        # Partition được cập nhật tăng dần: lesson mới, lesson đổi category, lesson bị xoá
+        frames = [_frame(_lesson_keys([f"L{c}{i}" for i in range(step, 12, 3)], passages=1 + step % 2), rng,
+                         source_type='lessons', category=categories[(j + step) % 3])
+                  for j, c in enumerate('ab')]
+        store = store.copy().apply_lesson_changes(pd.concat(frames, ignore_index=True), [f"La{step + 6}"])
+
+    live = store.live_rows()
+    row_categories = np.array(store.categories.to_list(live), dtype=object)
+    row_sources = np.array(store.source_types.to_list(live), dtype=object)
+    queries = rng.standard_normal((6, DIM)).astype(np.float32)
+    for category in categories + [None]:
+        for source_type in ('faq', 'lessons', None):
+            match = np.ones(len(live), dtype=bool)
+            if category is not None:
+                match &= row_categories == category
+            if source_type is not None:
+                match &= row_sources == source_type
+            candidates = live[match]
+            batch = store.search_batch(queries, top_k=5, threshold=-1.0, category=category, source_type=source_type)
+            for query, (batch_rows, _) in zip(queries, batch):
+                query = query / np.linalg.norm(query)
+                scores = store.vectors(candidates) @ query
+                expected = candidates[np.argsort(-scores, kind='stable')[:5]]
+                rows, found = store.search(query, top_k=5, threshold=-1.0, category=category, source_type=source_type)
+                assert list(rows) == list(expected)
+                assert np.allclose(found, np.sort(scores)[::-1][:5], atol=1e-5)
+                assert list(batch_rows) == list(expected)
+
+
+def _hybrid_store(monkeypatch, questions) -> VectorStore:
+    """Store RETRIEVAL_MODE=hybrid; embedding dòng i là vector đơn vị thứ i nên cosine với query đúng bằng
+    hệ số của query ở chiều đó"""
+    monkeypatch.setattr(vector_store, 'RETRIEVAL_MODE', 'hybrid')
+    return VectorStore.from_dataframe(pd.DataFrame({
+        'question': questions,
+        'answer': [''] * len(questions),
+        'category': 'grammar',
+        'embedding': list(np.eye(len(questions), DIM, dtype=np.float32)),
+    }))
+
+
+def _query(cosines: dict) -> np.ndarray:
+    """Query đơn vị có cosine cho trước với các dòng, phần còn lại nằm ở chiều cuối (không dòng nào dùng)"""
+    query = np.zeros(DIM, dtype=np.float32)
+    for row, cosine in cosines.items():
+        query[row] = cosine
+    query[-1] = np.sqrt(1.0 - np.sum(query ** 2))
+    return query
+
+
+def test_hybrid_returns_keyword_match_below_cosine_threshold(monkeypatch):
+    store = _hybrid_store(monkeypatch, [
+        "What is the past participle?",
+        "How do I get IELTS band 7 in writing?",
+        "Thì hiện tại đơn dùng khi nào?",
+        "Past participle of irregular verbs list",
+        "Cách dùng mạo từ a an the",
+        "Phân biệt say và tell",
+        "Câu điều kiện loại 1",
+        "Cách viết email trang trọng",
+    ])
+    # Embedding chấm thuật ngữ gõ nguyên văn thấp hơn threshold 0.3; dòng 2 gần về vector nhưng không khớp từ khoá
+    query = _query({0: 0.22, 2: 0.4, 3: 0.05, 4: 0.2})
+
+    vector_rows, _ = store.search(query, top_k=5, threshold=0.3)
+    hybrid_rows, hybrid_scores = store.search(query, top_k=5, threshold=0.3, text="past participle")
+
+    assert list(vector_rows) == [2]
+    assert set(hybrid_rows) == {0, 2}
+    assert np.allclose(hybrid_scores[list(hybrid_rows).index(0)], 0.22, atol=1e-5)  # điểm trả về vẫn là cosine
+    # Dòng 3 khớp từ khoá nhưng cosine dưới HYBRID_LEXICAL_FLOOR; dòng 4 không khớp từ khoá nên giữ threshold
+    assert 3 not in hybrid_rows and 4 not in hybrid_rows
+
+    ielts = _query({1: 0.2})
+    assert len(store.search(ielts, top_k=5, threshold=0.3)[0]) == 0
+    assert list(store.search(ielts, top_k=5, threshold=0.3, text="IELTS band 7")[0]) == [1]
+
+    batch = store.search_batch(np.stack([query, ielts]), top_k=5, threshold=0.3, texts=["past participle", "ielts band 7"])
+    assert set(batch[0][0]) == {0, 2} and list(batch[1][0]) == [1]
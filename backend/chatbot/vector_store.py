@@ -0,0 +1,690 @@
+"""
+Vector store trong bộ nhớ cho retrieval.
+
+Giữ embedding float32 đã chuẩn hoá L2 cùng các cột metadata song song, được dựng một lần khi load
+dữ liệu (và khi sync/index lesson) thay vì chuyển đổi lại DataFrame ở mỗi request /ask.
+
+Embedding chia làm hai phần theo thứ tự dòng:
+- phần tĩnh: các dòng đầu không thuộc lesson nào (FAQ), không bao giờ đổi lúc chạy. Index cấu hình
+  (flat / ivf / hnsw, lượng tử hoá) chỉ dựng trên phần này, một lần khi load (`build_index`), và được
+  dùng chung bởi mọi bản copy của store, nên upsert lesson không dựng lại / lưu lại index ANN.
+- phần lesson: các dòng còn lại, tìm bằng brute-force (flat); kết quả hai phần được gộp theo điểm.
+ Metadata ở dạng cột gọn (xem corpus): chuỗi trong buffer Arrow, category /
+source_type là mã int32, metadata lesson (lesson_id, title, content_hash, updated_at) là các mảng
+song song. Request chỉ materialize top-k dòng (`hits`); store là nguồn dữ liệu duy nhất của
+snapshot, bảng lesson cho writer được dựng lại từng block khi compact (`lesson_frames`). Khi có câu hỏi dạng
+text, kết quả vector được gộp với BM25 (lexical_index) bằng reciprocal rank fusion.
+
+Mỗi store giữ sẵn mảng row (đã sắp xếp) của từng category / source_type, nên truy vấn có filter
+chỉ chấm điểm các dòng trong partition đó thay vì cả corpus.
+
+Một lesson có thể gồm nhiều dòng (passage, cột `chunks`) cùng lesson_id; upsert thay toàn bộ
+passage của lesson, và `collapse_passages` chỉ giữ passage điểm cao nhất của mỗi lesson.
+
+Upsert / xoá là copy-on-write theo segment: phần tĩnh bất biến, passage mới được nối vào cuối các cột
+và ma trận lesson (AppendBuffer, xem corpus), dòng cũ của lesson bị thay / xoá chỉ bị đánh dấu
+(tombstone `dead`) và bị loại khi tìm. Khi tombstone vượt STORE_MAX_DEAD_RATIO phần lesson thì store
+được compact (dựng lại các cột từ các dòng còn sống).
+"""
+import os
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from ann_index import (_EMPTY, FlatIndex, in_sorted, index_path_for, load_index, load_or_build_index, query_blocks,
+                       search_batch, top_k_from_scores, top_k_rows)
+from corpus import Hit, InternedColumn, StringColumn, extend, take
+from lexical_index import (HYBRID_DEPTH, HYBRID_LEXICAL_FLOOR, HYBRID_LEXICAL_TOP, HYBRID_PREFILTER_CANDIDATES,
+                           HYBRID_PREFILTER_MIN_ROWS, RETRIEVAL_MODE, LexicalIndex, Vocabulary, build_terms,
+                           reciprocal_rank_fusion)
+from quantization import EMBEDDING_DTYPE, QUANTIZED_DTYPES, QuantizedIndex, quantized_index_path
+
+
+def embeddings_to_matrix(embeddings) -> np.ndarray:
+    """Chuyển cột embedding (list/ndarray mỗi dòng) thành ma trận float32 liên tục"""
+    values = list(embeddings)
+    if not values:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.ascontiguousarray(np.stack([np.asarray(v, dtype=np.float32) for v in values]))
+
+
+def l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    """Chuẩn hoá L2 theo từng dòng; dòng có norm = 0 được giữ nguyên (giống sklearn)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        norm = float(np.linalg.norm(matrix))
+        return matrix / norm if norm > 0 else matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def _column(df: pd.DataFrame, name: str, default=None) -> list:
+    if name not in df.columns:
+        return [default] * len(df)
+    return [default if _is_missing(v) else v for v in df[name].tolist()]
+
+
+def _is_missing(value) -> bool:
+    if value is None:
+        return True
+    try:
+        return bool(pd.isna(value)) if np.isscalar(value) else False
+    except (TypeError, ValueError):
+        return False
+
+
+def _strings(values, convert=None) -> StringColumn:
+    if isinstance(values, StringColumn):
+        return values
+    return StringColumn.from_values(values if convert is None else (convert(v) for v in values))
+
+
+def _interned(values) -> InternedColumn:
+    return values if isinstance(values, InternedColumn) else InternedColumn.from_values(values)
+
+
+def _tag_text(tags) -> Optional[str]:
+    """Tags (list / ndarray / chuỗi) -> một chuỗi, đủ cho BM25 (lexical_index tách từ lại)"""
+    if tags is None or isinstance(tags, str):
+        return tags
+    return ' '.join(str(t) for t in tags) or None
+
+
+def _meta_field(metas: List[Optional[dict]], name: str) -> List[Optional[str]]:
+    return [m.get(name) if isinstance(m, dict) else None for m in metas]
+
+
+def _frame_lesson_ids(df: pd.DataFrame, metas: Optional[List[Optional[dict]]] = None) -> List[Optional[str]]:
+    """lesson_id của từng dòng: cột lesson_id, hoặc meta['lesson_id'] (bảng lesson cũ)"""
+    metas = _column(df, 'meta', None) if metas is None else metas
+    return [str(lid) if lid is not None else None for lid in
+            (lid if lid is not None else meta_id
+             for lid, meta_id in zip(_column(df, 'lesson_id', None), _meta_field(metas, 'lesson_id')))]
+
+
+def _static_rows(lesson_ids: np.ndarray) -> int:
+    """Số dòng đầu không thuộc lesson nào (phần tĩnh: FAQ, hoặc cả corpus nếu không có lesson)"""
+    is_lesson = np.fromiter((lid is not None for lid in lesson_ids), dtype=bool, count=len(lesson_ids))
+    return int(np.argmax(is_lesson)) if is_lesson.any() else len(lesson_ids)
+
+
+def _merge_hits(parts: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Gộp top-k của nhiều phần (row toàn cục, điểm) thành top-k chung"""
+    parts = [part for part in parts if len(part[0])]
+    if len(parts) <= 1:
+        return parts[0] if parts else _EMPTY
+    rows = np.concatenate([rows for rows, _ in parts])
+    return top_k_from_scores(np.concatenate([scores for _, scores in parts]), k, ids=rows)
+
+
+def _timestamps(values) -> np.ndarray:
+    return pd.to_datetime(pd.Series(list(values), dtype=object), errors='coerce', utc=False).to_numpy('datetime64[ms]') \
+        if len(values) else np.empty(0, dtype='datetime64[ms]')
+
+
+_NO_ROWS = np.empty(0, dtype=np.int64)
+# Compaction: khi số dòng tombstone vượt tỉ lệ này của phần lesson (và ít nhất _MIN_DEAD_TO_COMPACT)
+STORE_MAX_DEAD_RATIO = float(os.getenv('STORE_MAX_DEAD_RATIO', '0.25'))
+_MIN_DEAD_TO_COMPACT = 256
+# Khi có lesson nhiều passage: lấy top_k * PASSAGE_OVERFETCH dòng rồi gộp theo lesson (collapse_passages)
+PASSAGE_OVERFETCH = int(os.getenv('PASSAGE_OVERFETCH', '3'))
+# Số dòng mỗi block khi ghi lại bảng lesson từ store (lesson_frames)
+_FRAME_BLOCK_ROWS = 4096
+# Các cột song song với các dòng của store (ngoài embedding), cùng được take/concat khi store đổi
+_COLUMNS = ('questions', 'answers', 'tags', 'categories', 'source_types', 'lesson_ids', 'chunks', 'lesson_titles',
+            'content_hashes', 'updated_at', 'terms')
+
+
+class LessonHashes(Mapping):
+    """lesson_id -> content_hash của một phiên bản store: view trên các cột (không dựng dict / bảng)"""
+
+    def __init__(self, lesson_rows: Dict[str, List[int]], content_hashes: StringColumn):
+        self._rows = lesson_rows
+        self._hashes = content_hashes
+
+    def __getitem__(self, lesson_id: str) -> Optional[str]:
+        return self._hashes[self._rows[lesson_id][0]]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class VectorStore:
+    """Ma trận embedding đã chuẩn hoá + metadata song song, dùng cho top-k cosine search"""
+
+    def __init__(self, matrix: np.ndarray, questions, answers, categories, source_types,
+                 lesson_ids: Optional[Sequence[Optional[str]]] = None, normalized: bool = False,
+                 tags: Optional[Sequence] = None, vocab: Optional[Vocabulary] = None,
+                 lesson_titles=None, content_hashes=None, updated_at=None, chunks=None,
+                 lesson_matrix: Optional[np.ndarray] = None):
+        """Các cột nhận list thường hoặc cột đã dựng sẵn (StringColumn / InternedColumn).
+        `matrix` là embedding theo thứ tự dòng; nếu có `lesson_matrix` thì `matrix` chỉ gồm các dòng
+        của phần tĩnh và `lesson_matrix` là phần còn lại (không phải nối hai ma trận)."""
+        n = len(questions)
+        self.questions = _strings(questions)
+        self.answers = _strings(answers)
+        self.tags = _strings(tags if tags is not None else [None] * n, _tag_text)
+        self.categories = _interned(categories)
+        self.source_types = _interned(source_types)
+        self.lesson_ids = np.empty(n, dtype=object)
+        self.lesson_ids[:] = list(lesson_ids) if lesson_ids is not None else [None] * n
+        self.n_static = _static_rows(self.lesson_ids)
+        if lesson_matrix is None:
+            matrix, lesson_matrix = matrix[:self.n_static], matrix[self.n_static:]
+        self.static_matrix = self._prepare(matrix, normalized)
+        self.lesson_matrix = self._prepare(lesson_matrix, normalized)
+        self.chunks = np.asarray(chunks if chunks is not None else np.zeros(n), dtype=np.int32)
+        self.lesson_titles = _strings(lesson_titles if lesson_titles is not None else [None] * n)
+        self.content_hashes = _strings(content_hashes if content_hashes is not None else [None] * n)
+        self.updated_at = (np.asarray(updated_at, dtype='datetime64[ms]') if isinstance(updated_at, np.ndarray)
+                           else _timestamps(updated_at if updated_at is not None else [None] * n))
+        self.dead = _NO_ROWS  # Row (tăng dần) của các passage đã bị thay / xoá, tới khi compact
+        self._buffers = {}  # AppendBuffer của các cột numpy (xem _append), dùng chung với bản copy
+        self._reindex_lessons()
+        self._reindex_partitions()
+        self.static_index = FlatIndex(self.static_matrix)
+        # Term của từng dòng (cho BM25, chỉ khi hybrid); vocab dùng chung với các store dựng từ store này
+        self.vocab = vocab if vocab is not None else Vocabulary()
+        self.terms = None
+        self.lexical = None
+        if RETRIEVAL_MODE == 'hybrid':
+            self.terms = build_terms(self.vocab, self.questions.to_list(), self.answers.to_list(), self.tags.to_list())
+            self.lexical = LexicalIndex(self.vocab, self.terms)
+
+    @staticmethod
+    def _prepare(matrix: np.ndarray, normalized: bool) -> np.ndarray:
+        if not len(matrix):
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.ascontiguousarray(matrix, dtype=np.float32) if normalized else l2_normalize(matrix)
+
+    def build_index(self, base_path: Optional[str] = None, backend: Optional[str] = None,
+                    dtype: str = EMBEDDING_DTYPE) -> 'VectorStore':
+        """Thay index flat của phần tĩnh bằng backend cấu hình (xem ann_index), lưu/đọc cạnh `base_path`
+        (file chỉ chứa các dòng tĩnh nên không đổi khi lesson đổi). Khi vẫn là brute-force và `dtype` là
+        float16/int8 thì quét trên ma trận lượng tử hoá (xem quantization). Chỉ gọi lúc load, không
+        gọi trên đường ghi: bản copy của store dùng chung index này."""
+        kwargs = {} if backend is None else {'backend': backend}
+        self.static_index = load_or_build_index(self.static_matrix, base_path, **kwargs)
+        if isinstance(self.static_index, FlatIndex) and dtype in QUANTIZED_DTYPES and self.n_static:
+            self.static_index = QuantizedIndex.build(self.static_matrix, dtype)
+        return self
+
+    def save_static_index(self, base_path: str, fingerprint: str):
+        """Ghi index phần tĩnh cạnh `base_path` (shared index) để worker khác load thay vì dựng lại"""
+        index = self.static_index
+        if isinstance(index, QuantizedIndex):
+            index.save(quantized_index_path(base_path, index.quantized.dtype), fingerprint)
+        elif not isinstance(index, FlatIndex):
+            index.save(index_path_for(base_path, index.name), fingerprint)
+
+    def load_static_index(self, base_path: str, name: str, fingerprint: str) -> bool:
+        """Dùng index `name` (vd. 'ivf', 'flat-int8') của phần tĩnh đã được process khác ghi cạnh
+        `base_path`, với fingerprint đã biết nên không hash lại ma trận. False nếu không có / không khớp."""
+        if name.startswith('flat-'):
+            index = QuantizedIndex.load(quantized_index_path(base_path, name[len('flat-'):]),
+                                        self.static_matrix, fingerprint)
+        else:
+            index = load_index(self.static_matrix, base_path, fingerprint, backend=name)
+        if index is None:
+            return False
+        self.static_index = index
+        return True
+
+    def reuse_static_index(self, other: 'VectorStore') -> bool:
+        """Dùng index phần tĩnh của `other` nếu hai store có chung ma trận tĩnh (cùng buffer, vd. cùng
+        memmap FAQ), để dựng lại store từ đĩa không phải hash / load lại index"""
+        mine, theirs = self.static_matrix, other.static_matrix
+        if not self.n_static or mine.shape != theirs.shape or mine.strides != theirs.strides \
+                or mine.__array_interface__['data'][0] != theirs.__array_interface__['data'][0]:
+            return False
+        self.static_index = other.static_index
+        return True
+
+    @property
+    def index_name(self) -> str:
+        """Tên index của phần tĩnh (+ flat nếu có dòng lesson), vd. 'ivf+flat'"""
+        names = ([self.static_index.name] if self.n_static else []) + (['flat'] if len(self.lesson_matrix) else [])
+        return '+'.join(dict.fromkeys(names)) or 'flat'
+
+    @classmethod
+    def empty(cls) -> 'VectorStore':
+        return cls(np.zeros((0, 0), dtype=np.float32), [], [], [], [])
+
+    @classmethod
+    def from_dataframe(cls, df: Optional[pd.DataFrame], prefix_matrix: Optional[np.ndarray] = None,
+                       vocab: Optional[Vocabulary] = None) -> 'VectorStore':
+        """Dựng store từ DataFrame có các cột question/answer/category/embedding (+ cột lesson:
+        lesson_id, meta, content_hash, updated_at). DataFrame không được giữ lại.
+
+        `prefix_matrix` (đã chuẩn hoá, vd. ma trận FAQ memory-map) thay cho cột embedding của
+        len(prefix_matrix) dòng đầu; khi nó đúng bằng phần tĩnh thì được dùng trực tiếp, không copy.
+        """
+        if df is None or df.empty:
+            return cls.empty()
+        metas = _column(df, 'meta', None)
+        lesson_ids = _frame_lesson_ids(df, metas)
+        lesson_matrix = None
+        if prefix_matrix is None or not len(prefix_matrix):
+            if 'embedding' not in df.columns:
+                return cls.empty()
+            matrix, normalized = embeddings_to_matrix(df['embedding']), False
+        elif len(df) == len(prefix_matrix):
+            matrix, normalized = prefix_matrix, True
+        else:
+            tail = l2_normalize(embeddings_to_matrix(df['embedding'].iloc[len(prefix_matrix):]))
+            if _static_rows(np.asarray(lesson_ids, dtype=object)) == len(prefix_matrix):
+                matrix, lesson_matrix = prefix_matrix, tail
+            else:
+                matrix = np.concatenate([prefix_matrix, tail])
+            normalized = True
+        return cls(
+            matrix,
+            _column(df, 'question', ''),
+            _column(df, 'answer', ''),
+            _column(df, 'category', 'general'),
+            _column(df, 'source_type', 'faq'),
+            lesson_ids=lesson_ids,
+            normalized=normalized,
+            tags=_column(df, 'tags', None),
+            vocab=vocab,
+            lesson_titles=_meta_field(metas, 'title'),
+            content_hashes=_column(df, 'content_hash', None),
+            updated_at=_column(df, 'updated_at', None),
+            chunks=_column(df, 'chunk', 0),
+            lesson_matrix=lesson_matrix,
+        )
+
+    @classmethod
+    def from_arrow(cls, table: pa.Table, matrix: np.ndarray, vocab: Optional[Vocabulary] = None,
+                   lesson_matrix: Optional[np.ndarray] = None) -> 'VectorStore':
+        """Dựng lại store từ bảng của to_arrow() (shared index) + ma trận đã chuẩn hoá (memmap); có
+        `lesson_matrix` thì `matrix` chỉ là phần tĩnh (xem __init__)"""
+        def strings(name: str) -> StringColumn:
+            if name not in table.column_names:
+                return StringColumn.nulls(table.num_rows)
+            column = table.column(name)
+            if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+                return StringColumn.from_values(_tag_text(v) for v in column.to_pylist())
+            return StringColumn.from_arrow(column)
+
+        lesson_ids = table.column('lesson_id').to_pylist() if 'lesson_id' in table.column_names \
+            else [None] * table.num_rows
+        updated_at = table.column('updated_at').to_numpy() if 'updated_at' in table.column_names else None
+        chunks = table.column('chunk').fill_null(0).to_numpy() if 'chunk' in table.column_names else None
+        return cls(
+            matrix, strings('question'), strings('answer'),
+            InternedColumn.from_arrow(table.column('category')),
+            InternedColumn.from_arrow(table.column('source_type')),
+            lesson_ids=lesson_ids, normalized=True, tags=strings('tags'), vocab=vocab,
+            lesson_titles=strings('lesson_title'), content_hashes=strings('content_hash'),
+            updated_at=updated_at, chunks=chunks, lesson_matrix=lesson_matrix,
+        )
+
+    def to_arrow(self, rows: Optional[np.ndarray] = None) -> pa.Table:
+        """Metadata theo đúng thứ tự dòng của ma trận (không có embedding), để ghi parquet; `rows` chỉ
+        lấy các dòng đó (vd. live_rows())"""
+        table = pa.table({
+            'question': self.questions.array,
+            'answer': self.answers.array,
+            'tags': self.tags.array,
+            'category': self.categories.to_arrow(),
+            'source_type': self.source_types.to_arrow(),
+            'lesson_id': pa.array(self.lesson_ids.tolist(), type=pa.large_string()),
+            'chunk': pa.array(self.chunks, type=pa.int32()),
+            'lesson_title': self.lesson_titles.array,
+            'content_hash': self.content_hashes.array,
+            'updated_at': pa.array(self.updated_at, type=pa.timestamp('ms')),
+        })
+        return table if rows is None else table.take(pa.array(rows, type=pa.int64()))
+
+    def copy(self) -> 'VectorStore':
+        """Bản sao nông để writer sửa bên ngoài trong khi reader vẫn dùng bản cũ: mọi cột, ma trận và index
+        được dùng chung, vì apply_lesson_changes chỉ nối thêm sau phần bản cũ đang đọc rồi thay thuộc
+        tính của bản sao (không ghi tại chỗ)."""
+        clone = object.__new__(VectorStore)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def _reindex_lessons(self):
+        """lesson_id -> các row passage của lesson, theo thứ tự chunk"""
+        rows: Dict[str, List[int]] = {}
+        for i, lid in enumerate(self.lesson_ids):
+            if lid is not None:
+                rows.setdefault(lid, []).append(i)
+        for lid, lesson_rows in rows.items():
+            if len(lesson_rows) > 1:
+                lesson_rows.sort(key=self.chunks.__getitem__)
+        self._lesson_rows = rows
+        self.has_passages = any(len(r) > 1 for r in rows.values())
+        updated = self.updated_at[~np.isnat(self.updated_at)]
+        self.lesson_watermark = pd.Timestamp(updated.max()).to_pydatetime() if len(updated) else None
+
+    @property
+    def lesson_count(self) -> int:
+        return len(self._lesson_rows)
+
+    def lesson_state(self) -> Tuple[LessonHashes, Optional[datetime]]:
+        """({lesson_id: content_hash}, watermark updated_at lớn nhất) của phiên bản store này, cho writer
+        (sync / change stream) so hash; không dựng bảng lesson"""
+        return LessonHashes(self._lesson_rows, self.content_hashes), self.lesson_watermark
+
+    def live_rows(self) -> np.ndarray:
+        """Các row chưa bị tombstone, tăng dần"""
+        rows = np.arange(len(self.lesson_ids), dtype=np.int64)
+        return np.setdiff1d(rows, self.dead, assume_unique=True) if len(self.dead) else rows
+
+    def _reindex_partitions(self):
+        self.partitions = {'category': self.categories.partition(), 'source_type': self.source_types.partition()}
+
+    def filter_rows(self, category: Optional[str] = None, source_type: Optional[str] = None) -> Optional[np.ndarray]:
+        """Row (tăng dần) khớp filter; None nếu không lọc gì (không filter hoặc filter khớp mọi dòng)"""
+        rows = None
+        for field, value in (('category', category), ('source_type', source_type)):
+            if value is None:
+                continue
+            part = self.partitions[field].get(value, _NO_ROWS)
+            rows = part if rows is None else np.intersect1d(rows, part, assume_unique=True)
+        if rows is not None and len(rows) == len(self):
+            return None
+        return rows
+
+    def apply_lesson_changes(self, upserts: Optional[pd.DataFrame], deleted_ids: Iterable[str]) -> 'VectorStore':
+        """Upsert/xoá lesson theo lesson_id, copy-on-write: passage của lesson upsert được nối vào cuối
+        store, các dòng cũ của lesson bị thay / bị xoá thành tombstone. Chi phí theo số dòng đổi: không
+        copy ma trận hay cột, BM25 chỉ thêm segment cho dòng mới, partition chỉ dựng lại cho nhãn bị
+        đụng tới. Tombstone vượt STORE_MAX_DEAD_RATIO phần lesson thì compact."""
+        deleted = set(deleted_ids)
+        if deleted and upserts is not None and not upserts.empty:
+            # Lesson vừa upsert vừa xoá trong cùng batch: xoá thắng
+            upserts = upserts[[lid not in deleted for lid in _frame_lesson_ids(upserts)]]
+        added = VectorStore.from_dataframe(upserts, vocab=self.vocab)
+        lesson_rows = dict(self._lesson_rows)
+        killed = [row for lid in deleted.union(added._lesson_rows) for row in lesson_rows.pop(lid, ())]
+        if not len(added) and not killed:
+            return self
+
+        n = len(self.lesson_ids)
+        if len(added):
+            self._append(added)
+            for lid, rows in added._lesson_rows.items():
+                lesson_rows[lid] = [n + row for row in rows]
+            self.has_passages = self.has_passages or added.has_passages
+            latest = added.lesson_watermark  # Watermark chỉ tăng (max đang chạy), compact tính lại
+            if latest is not None and (self.lesson_watermark is None or latest > self.lesson_watermark):
+                self.lesson_watermark = latest
+        killed = np.sort(np.asarray(killed, dtype=np.int64))
+        if len(killed):
+            self.dead = np.union1d(self.dead, killed)
+        self._lesson_rows = lesson_rows
+        self._update_partitions(added, n, killed)
+        if len(self.dead) > max(_MIN_DEAD_TO_COMPACT, STORE_MAX_DEAD_RATIO * len(self.lesson_matrix)):
+            self._compact()
+        return self
+
+    def _append(self, added: 'VectorStore'):
+        """Nối các dòng của `added` vào cuối các cột, ma trận lesson và BM25 (xem corpus.extend: n dòng
+        đầu mà bản cũ đang đọc không bị ghi lại)"""
+        n = len(self.lesson_ids)
+        buffers = dict(self._buffers)
+
+        def grow(name: str, view: np.ndarray, values: np.ndarray) -> np.ndarray:
+            buffers[name], view = extend(buffers.get(name), view, values)
+            return view
+
+        for name in _COLUMNS:
+            column, other = getattr(self, name), getattr(added, name)
+            if column is None:  # terms khi không bật hybrid
+                continue
+            if isinstance(column, StringColumn):
+                column = column.concat(other)
+            elif isinstance(column, InternedColumn):
+                labels, codes = column.merge(other)
+                column = InternedColumn(grow(name, column.codes, codes), labels)
+            else:
+                column = grow(name, column, other)
+            setattr(self, name, column)
+        self.lesson_matrix = grow('lesson_matrix', self.lesson_matrix, added.vectors(np.arange(len(added))))
+        self._buffers = buffers
+        if self.lexical is not None:
+            self.lexical = self.lexical.append(added.lexical, n)
+
+    def _update_partitions(self, added: 'VectorStore', n: int, killed: np.ndarray):
+        """Nhãn có dòng bị tombstone thì lọc bỏ các dòng đó, nhãn có dòng mới thì nối thêm (row mới lớn
+        hơn mọi row cũ nên mảng vẫn tăng dần); các nhãn khác dùng chung mảng cũ"""
+        partitions = {}
+        for field in ('category', 'source_type'):
+            parts = dict(self.partitions[field])
+            if len(killed):
+                for label, rows in list(parts.items()):
+                    first = int(np.searchsorted(rows, killed[0]))
+                    drop = in_sorted(rows[first:], killed)
+                    if drop.any():
+                        parts[label] = np.concatenate([rows[:first], rows[first:][~drop]])
+            for label, rows in added.partitions[field].items():
+                parts[label] = np.concatenate([parts.get(label, _NO_ROWS), rows + n])
+            partitions[field] = {label: rows for label, rows in parts.items() if len(rows)}
+        self.partitions = partitions
+
+    def _compact(self):
+        """Dựng lại các cột chỉ từ các dòng còn sống (row đổi, hết tombstone); phần tĩnh và index giữ nguyên"""
+        live = self.live_rows()
+        for name in _COLUMNS:
+            if getattr(self, name) is not None:
+                setattr(self, name, take(getattr(self, name), live))
+        self.lesson_matrix = np.ascontiguousarray(self.lesson_matrix[live[self.n_static:] - self.n_static])
+        self.dead, self._buffers = _NO_ROWS, {}
+        self._reindex_lessons()
+        self._reindex_partitions()
+        if self.lexical is not None:
+            self.lexical = LexicalIndex(self.vocab, self.terms)
+
+    def lesson_frames(self, block_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Các dòng lesson theo schema của lesson log (LESSON_SCHEMA), từng block `block_rows` dòng, cho
+        compaction của writer: bảng lesson không phải nằm trọn trong bộ nhớ. Embedding là vector đã chuẩn
+        hoá của store."""
+        rows = self.partitions['source_type'].get('lessons', _NO_ROWS)
+        block_rows = block_rows or _FRAME_BLOCK_ROWS
+        for start in range(0, len(rows), block_rows):
+            yield self._lesson_frame(rows[start:start + block_rows])
+
+    def _lesson_frame(self, rows: np.ndarray) -> pd.DataFrame:
+        lesson_ids = self.lesson_ids[rows].tolist()
+        titles = self.lesson_titles.to_list(rows)
+        return pd.DataFrame({
+            'question': self.questions.to_list(rows),
+            'answer': self.answers.to_list(rows),
+            'category': self.categories.to_list(rows),
+            'embedding': list(self.vectors(rows)),
+            'meta': [{'lesson_id': lid, 'title': title, 'source': 'lessons'} for lid, title in zip(lesson_ids, titles)],
+            'source_type': 'lessons',
+            'lesson_id': lesson_ids,
+            'chunk': self.chunks[rows],
+            'content_hash': self.content_hashes.to_list(rows),
+            'updated_at': pd.to_datetime(self.updated_at[rows]),
+        })
+
+    @property
+    def metadata_nbytes(self) -> int:
+        """Ước lượng bộ nhớ của các cột metadata (không gồm ma trận, BM25)"""
+        strings = sum(getattr(self, name).nbytes for name in
+                      ('questions', 'answers', 'tags', 'categories', 'source_types', 'lesson_titles', 'content_hashes'))
+        lesson_ids = self.lesson_ids.nbytes + sum(len(lid) + 49 for lid in self._lesson_rows)
+        return strings + lesson_ids + self.chunks.nbytes + self.updated_at.nbytes
+
+    def __len__(self) -> int:
+        """Số dòng còn sống (không tính tombstone)"""
+        return len(self.questions) - len(self.dead)
+
+    @property
+    def dim(self) -> int:
+        matrix = self.static_matrix if len(self.static_matrix) else self.lesson_matrix
+        return matrix.shape[1] if matrix.ndim == 2 else 0
+
+    @property
+    def matrix_nbytes(self) -> int:
+        return self.static_matrix.nbytes + self.lesson_matrix.nbytes
+
+    def vectors(self, rows) -> np.ndarray:
+        """Vector đã chuẩn hoá của các row (toàn cục), gom từ phần tĩnh và phần lesson"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(self.lesson_matrix):
+            return self.static_matrix[rows]
+        if not self.n_static:
+            return self.lesson_matrix[rows]
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        static = rows < self.n_static
+        out[static] = self.static_matrix[rows[static]]
+        out[~static] = self.lesson_matrix[rows[~static] - self.n_static]
+        return out
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 5, threshold: float = 0.3,
+               text: Optional[str] = None, category: Optional[str] = None,
+               source_type: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Trả về (indices, cosine) của top-k dòng có cosine >= threshold, sắp xếp giảm dần.
+        Có `text` (và RETRIEVAL_MODE=hybrid): top-k theo fusion vector + BM25 (xem _hybrid).
+        `category` / `source_type`: chỉ tìm trong partition tương ứng."""
+        subset = self.filter_rows(category, source_type)
+        if len(self) == 0 or top_k <= 0 or (subset is not None and len(subset) == 0):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = l2_normalize(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+        if text and self.lexical is not None:
+            return self._hybrid(query, text, top_k, threshold, subset=subset)
+        indices, scores = self._vector_search(query, top_k, subset)
+        keep = scores >= threshold
+        return indices[keep], scores[keep]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 5, threshold: float = 0.3,
+                     texts: Optional[Sequence[str]] = None, category: Optional[str] = None,
+                     source_type: Optional[str] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """search() cho nhiều query (Q, d) cùng lúc: một phép nhân ma trận thay vì Q phép nhân vector"""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        subset = self.filter_rows(category, source_type)
+        if len(self) == 0 or top_k <= 0 or (subset is not None and len(subset) == 0):
+            empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+            return [empty] * len(queries)
+
+        queries = l2_normalize(queries)
+        if texts is not None and self.lexical is not None:
+            if self._prefilter_enabled(subset):
+                return [self._hybrid(q, t, top_k, threshold, subset=subset) for q, t in zip(queries, texts)]
+            hits = self._vector_search_batch(queries, top_k * HYBRID_DEPTH, subset)
+            return [self._hybrid(q, t, top_k, threshold, h, subset) for q, t, h in zip(queries, texts, hits)]
+        results = self._vector_search_batch(queries, top_k, subset)
+        return [(indices[scores >= threshold], scores[scores >= threshold]) for indices, scores in results]
+
+    def _vector_search(self, query: np.ndarray, k: int,
+                       subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k cosine trên cả store (index phần tĩnh + quét phần lesson, gộp theo điểm), hoặc chỉ
+        trên các dòng của partition `subset`"""
+        if subset is None:
+            return _merge_hits([self.static_index.search(query, k), self._lesson_search(query, k)], k)
+        return top_k_from_scores(self.vectors(subset) @ query, k, ids=subset)
+
+    def _vector_search_batch(self, queries: np.ndarray, k: int,
+                             subset: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if subset is None:
+            static = search_batch(self.static_index, queries, k)
+            return [_merge_hits(parts, k) for parts in zip(static, self._lesson_search_batch(queries, k))]
+        matrix = self.vectors(subset)  # Gom partition một lần cho cả batch
+        results = []
+        for block in query_blocks(len(queries), len(subset)):
+            results.extend((subset[rows], scores) for rows, scores in top_k_rows(queries[block] @ matrix.T, k))
+        return results
+
+    def _lesson_search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k brute-force trên phần lesson, bỏ tombstone; trả về row toàn cục"""
+        if not len(self.lesson_matrix):
+            return _EMPTY
+        scores = self.lesson_matrix @ query
+        if len(self.dead):
+            scores[self.dead - self.n_static] = -np.inf
+        rows, scores = top_k_from_scores(scores, k)
+        live = np.isfinite(scores)
+        return rows[live] + self.n_static, scores[live]
+
+    def _lesson_search_batch(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if not len(self.lesson_matrix):
+            return [_EMPTY] * len(queries)
+        dead = self.dead - self.n_static
+        results = []
+        for block in query_blocks(len(queries), len(self.lesson_matrix)):
+            scores = queries[block] @ self.lesson_matrix.T
+            if len(dead):
+                scores[:, dead] = -np.inf
+            for rows, top in top_k_rows(scores, k):
+                live = np.isfinite(top)
+                results.append((rows[live] + self.n_static, top[live]))
+        return results
+
+    def _prefilter_enabled(self, subset: Optional[np.ndarray] = None) -> bool:
+        return (len(self) if subset is None else len(subset)) >= HYBRID_PREFILTER_MIN_ROWS
+
+    def _hybrid(self, query: np.ndarray, text: str, top_k: int, threshold: float,
+                vector_hits: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Reciprocal rank fusion của top vector và top BM25.
+
+        Dòng phải có cosine >= threshold như ở chế độ vector, trừ HYBRID_LEXICAL_TOP dòng BM25 cao nhất
+        (khớp thuật ngữ mạnh) chỉ cần cosine >= HYBRID_LEXICAL_FLOOR; dưới sàn đó vẫn bị loại. Điểm trả
+        về vẫn là cosine.
+        Với corpus lớn (>= HYBRID_PREFILTER_MIN_ROWS) và đủ ứng viên lexical, phía vector chỉ chấm
+        các ứng viên đó thay vì quét cả ma trận.
+        """
+        depth = top_k * HYBRID_DEPTH
+        prefilter = vector_hits is None and self._prefilter_enabled(subset)
+        lex_rows, _ = self.lexical.search(
+            text, max(depth, HYBRID_PREFILTER_CANDIDATES) if prefilter else depth, allowed=subset,
+            excluded=self.dead)
+        if vector_hits is None:
+            if prefilter and len(lex_rows) >= depth:
+                vector_hits = self._vector_search(query, depth, np.sort(lex_rows))
+            else:
+                vector_hits = self._vector_search(query, depth, subset)
+        rows, _ = reciprocal_rank_fusion([vector_hits[0], lex_rows[:depth]])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        cosine = self.vectors(rows) @ query
+        floor = np.full(len(rows), threshold, dtype=np.float32)
+        floor[np.isin(rows, lex_rows[:HYBRID_LEXICAL_TOP])] = min(threshold, HYBRID_LEXICAL_FLOOR)
+        keep = cosine >= floor
+        return rows[keep][:top_k], cosine[keep][:top_k].astype(np.float32)
+
+    def fetch_k(self, top_k: int) -> int:
+        """Số dòng cần lấy để sau collapse_passages vẫn còn đủ top_k lesson / FAQ khác nhau"""
+        return top_k * PASSAGE_OVERFETCH if self.has_passages else top_k
+
+    def collapse_passages(self, indices: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Giữ passage điểm cao nhất của mỗi lesson (indices đã sắp giảm dần theo điểm), tối đa top_k dòng"""
+        seen = set()
+        keep = []
+        for position, row in enumerate(indices):
+            lid = self.lesson_ids[row]
+            if lid is not None:
+                if lid in seen:
+                    continue
+                seen.add(lid)
+            keep.append(position)
+            if len(keep) == top_k:
+                break
+        return indices[keep], scores[keep]
+
+    def hits(self, indices: np.ndarray, scores: np.ndarray) -> List[Hit]:
+        """Materialize chỉ các dòng top-k (mỗi cột một lần take) cho phần xử lý phía sau"""
+        questions = self.questions.to_list(indices)
+        answers = self.answers.to_list(indices)
+        categories = self.categories.to_list(indices)
+        source_types = self.source_types.to_list(indices)
+        titles = self.lesson_titles.to_list(indices)
+        return [Hit(int(row), question or '', answer or '', category, source_type, self.lesson_ids[row], float(score),
+                    title)
+                for row, question, answer, category, source_type, score, title
+                in zip(indices, questions, answers, categories, source_types, scores, titles)]